@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# License: GPLv2
+#
+# This script works on Python2 and Python3
+#
+# measures the invocation latency of skm-authorized-keys.py the way sshd
+# runs it, against a local stub of the SSHKey Manager API
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CLIENT=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'skm-authorized-keys.py')
+API_KEY='benchmark'
+
+class StubHandler(BaseHTTPRequestHandler):
+  keys = 10
+  delay = 0.0
+
+  def do_POST(self):
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    time.sleep(self.delay)
+    if not self.path.startswith('/api/authorized_keys/'):
+      self.send_response(404)
+      self.end_headers()
+      return
+    body = ''.join('ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQ%05d key%d\n' % (i, i) for i in range(self.keys))
+    body = body.encode('ascii')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+def percentile(values, percent):
+  values = sorted(values)
+  return values[int(round((len(values) - 1) * percent / 100.0))]
+
+def report(title, timings):
+  print("%-30s n=%-6d p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms" % (
+    title,
+    len(timings),
+    percentile(timings, 50) * 1000,
+    percentile(timings, 90) * 1000,
+    percentile(timings, 99) * 1000,
+    max(timings) * 1000
+  ))
+
+def write_config(filename, address, cache_dir, ttl):
+  with open(filename, 'w') as f:
+    f.write("[default]\n")
+    f.write("apikey = " + API_KEY + "\n")
+    f.write("address = " + address + "\n")
+    f.write("hostname = bench.example.com\n")
+    f.write("cache_dir = " + cache_dir + "\n")
+    f.write("cache_ttl = " + str(ttl) + "\n")
+
+def run(command, count, before=None):
+  timings = []
+  devnull = open(os.devnull, 'w')
+  for i in range(count):
+    if before:
+      before()
+    start = time.time()
+    code = subprocess.call(command, stdout=devnull, stderr=devnull)
+    timings.append(time.time() - start)
+    if code != 0:
+      print("Error: " + " ".join(command) + " returned " + str(code))
+      sys.exit(1)
+  devnull.close()
+  return timings
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument('-n', '--runs', type=int, default=100, help='invocations per round. defaults: 100')
+  parser.add_argument('-k', '--keys', type=int, default=10, help='keys returned by the stub API. defaults: 10')
+  parser.add_argument('-d', '--delay', type=float, default=0.0, help='seconds the stub API waits per request. defaults: 0')
+  parser.add_argument('-p', '--python', default=sys.executable, help='python interpreter running the client.')
+  args = parser.parse_args()
+
+  StubHandler.keys = args.keys
+  StubHandler.delay = args.delay
+  server = HTTPServer(('127.0.0.1', 0), StubHandler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  address = 'http://127.0.0.1:%d/api/getkeys/' % server.server_address[1]
+
+  workdir = tempfile.mkdtemp(prefix='skm-benchmark')
+  try:
+    cache_dir = os.path.join(workdir, 'cache')
+    cache_file = os.path.join(cache_dir, 'root')
+    config = os.path.join(workdir, 'skm-deploy.conf')
+    command = [args.python, CLIENT, '-c', config, 'root']
+
+    def drop_cache():
+      if os.path.exists(cache_file):
+        os.unlink(cache_file)
+
+    report('python startup', run([args.python, '-c', 'pass'], args.runs))
+
+    write_config(config, address, cache_dir, 60)
+    report('cold (API request)', run(command, args.runs, drop_cache))
+    report('warm (cached)', run(command, args.runs))
+
+    # expired cache and API down: the stale entry is served
+    server.shutdown()
+    server.server_close()
+    write_config(config, address, cache_dir, 0)
+    report('stale (API down)', run(command, args.runs))
+  finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# License: GPLv2
+#
+# This script works on Python2 and Python3
+#
+# sshd AuthorizedKeysCommand for the SSHKey Manager Django app.
+# sshd runs it on every login, so it answers from a local cache and
+# loads the HTTP code only if the cache is missing or expired.
+#
+#   AuthorizedKeysCommand /usr/local/bin/skm-authorized-keys %u
+#   AuthorizedKeysCommandUser skm
+#
+# usage: skm-authorized-keys [-c config] account [hostname]
+#
+# It reads the [default] section of /etc/skm-deploy.conf:
+#   apikey, address           same as skm-deploy
+#   authorized_keys_address   defaults to address with getkeys/ replaced by authorized_keys/
+#   hostname                  host name in SSHKey Manager, defaults to the local host name
+#   cache_dir                 writable by AuthorizedKeysCommandUser, defaults to /var/cache/skm-authorized-keys
+#   cache_ttl                 seconds a cached answer is used, defaults to 60
+#   cache_max_stale           seconds a cached answer is used while the API is unreachable, defaults to 86400
+#   timeout                   API timeout in seconds, defaults to 5
+
+import os
+import sys
+import time
+
+DEFAULT_CONFIG='/etc/skm-deploy.conf'
+DEFAULTS={
+  'cache_dir': '/var/cache/skm-authorized-keys',
+  'cache_ttl': '60',
+  'cache_max_stale': '86400',
+  'timeout': '5',
+}
+
+def read_config(filename):
+  """
+  minimal reader for the [default] section, ConfigParser costs more than
+  the whole cache lookup
+  """
+  cfg = dict(DEFAULTS)
+  section = None
+  with open(filename) as f:
+    for line in f:
+      line = line.strip()
+      if line == '' or line[0] in '#;':
+        continue
+      if line[0] == '[':
+        section = line.strip('[]').strip()
+        continue
+      if section != 'default':
+        continue
+      separators = [pos for pos in (line.find('='), line.find(':')) if pos > 0]
+      if separators:
+        pos = min(separators)
+        cfg[line[:pos].strip().lower()] = line[pos + 1:].strip()
+  return cfg
+
+def _authorized_keys_address(cfg):
+  if 'authorized_keys_address' in cfg:
+    address = cfg['authorized_keys_address']
+  else:
+    address = cfg['address'].rstrip('/')
+    if address.endswith('getkeys'):
+      address = address[:-len('getkeys')] + 'authorized_keys'
+  return address.rstrip('/') + '/'
+
+def read_cache(filename):
+  try:
+    with open(filename) as f:
+      return os.fstat(f.fileno()).st_mtime, f.read()
+  except (IOError, OSError):
+    return None, None
+
+def write_cache(filename, content):
+  directory = os.path.dirname(filename)
+  try:
+    if not os.path.isdir(directory):
+      os.makedirs(directory, 0o700)
+    tmp = filename + '.' + str(os.getpid())
+    with open(tmp, 'w') as f:
+      f.write(content)
+    os.rename(tmp, filename)
+  except (IOError, OSError) as e:
+    sys.stderr.write("skm-authorized-keys: could not write cache " + filename + ": " + str(e) + "\n")
+
+def fetch(cfg, hostname, account):
+  """
+  authorized_keys of the account from the API,
+  empty if the account does not exist on this host
+  """
+  try:
+    from urllib.request import urlopen
+    from urllib.parse import urlencode, quote
+    from urllib.error import HTTPError
+  except ImportError:
+    from urllib2 import urlopen, HTTPError
+    from urllib import urlencode, quote
+
+  url = _authorized_keys_address(cfg) + quote(hostname) + '/' + quote(account)
+  data = urlencode({'API_KEY': cfg['apikey']}).encode('ascii')
+  try:
+    response = urlopen(url, data, float(cfg['timeout']))
+  except HTTPError as e:
+    if e.code == 404:
+      return ''
+    raise
+  try:
+    return response.read().decode('utf-8')
+  finally:
+    response.close()
+
+def main(argv):
+  config = DEFAULT_CONFIG
+  if len(argv) > 2 and argv[1] == '-c':
+    config = argv[2]
+    argv = argv[2:]
+  if len(argv) < 2:
+    sys.stderr.write("usage: skm-authorized-keys [-c config] account [hostname]\n")
+    return 1
+
+  account = argv[1]
+  if account == '' or '/' in account or account.startswith('.'):
+    sys.stderr.write("skm-authorized-keys: invalid account name\n")
+    return 1
+
+  cfg = read_config(config)
+  filename = os.path.join(cfg['cache_dir'], account)
+  mtime, content = read_cache(filename)
+  if content is not None:
+    age = time.time() - mtime
+    if 0 <= age < float(cfg['cache_ttl']):
+      sys.stdout.write(content)
+      return 0
+
+  if len(argv) > 2:
+    hostname = argv[2]
+  elif 'hostname' in cfg:
+    hostname = cfg['hostname']
+  else:
+    import socket
+    hostname = socket.gethostname()
+
+  try:
+    fresh = fetch(cfg, hostname, account)
+  except Exception as e:
+    if content is not None and age < float(cfg['cache_max_stale']):
+      sys.stderr.write("skm-authorized-keys: API error, using cached keys: " + str(e) + "\n")
+      sys.stdout.write(content)
+      return 0
+    sys.stderr.write("skm-authorized-keys: API error: " + str(e) + "\n")
+    return 1
+
+  write_cache(filename, fresh)
+  sys.stdout.write(fresh)
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
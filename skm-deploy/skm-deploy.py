@@ -9,6 +9,7 @@
 
 import argparse
 import os
+import re
 import requests
 import tempfile
 import shutil
@@ -22,8 +23,10 @@ except:
 
 
 DEFAULT_CONFIG='/etc/skm-deploy.conf'
+DEFAULT_STATE_DIR='/var/lib/skm-deploy'
 CONFIG=None
 POST_DATA={}
+HEADERS={}
 
 def write_keys(directory, accounts):
   for acc in accounts:
@@ -33,6 +36,52 @@ def write_keys(directory, accounts):
     with open(filename, 'w') as f:
       f.write(content)
 
+def deploy_hosts(hosts):
+  errors = 0
+  for key in hosts:
+    host = hosts[key]
+    connect = key
+    if host['ip']:
+      connect = host['ip']
+    try:
+      print("Info: Deploying Host: " + key)
+      directory = tempfile.mkdtemp('_' + key, prefix='skm-deploy')
+      write_keys(directory, host['accounts'])
+      shutil.rmtree(directory)
+    except Exception as e:
+      print("Error: error on host " + key)
+      errors += 1
+  return errors
+
+def _changes_address(config):
+  if 'changes_address' in config:
+    return config['changes_address']
+  return re.sub(r'getkeys/?$', 'changes/', config['address'])
+
+def _state_filename(state_dir, prefix):
+  if 'filter_type' in POST_DATA:
+    name = prefix + '_' + POST_DATA['filter_type'] + '_' + POST_DATA['filter_value']
+  else:
+    name = prefix + '_all'
+  return os.path.join(state_dir, re.sub(r'[^0-9A-Za-z_.-]', '_', name))
+
+def read_state(filename):
+  try:
+    with open(filename) as f:
+      return f.read().strip()
+  except IOError:
+    return None
+
+def write_state(filename, value):
+  try:
+    if not os.path.isdir(os.path.dirname(filename)):
+      os.makedirs(os.path.dirname(filename))
+    with open(filename + '.tmp', 'w') as f:
+      f.write(value)
+    os.rename(filename + '.tmp', filename)
+  except (IOError, OSError) as e:
+    print("Warning: could not write state file " + filename + ": " + str(e))
+
 def _get_config(filename):
   setting = ConfigParser.ConfigParser()
   setting.read(filename)
@@ -41,11 +90,97 @@ def _get_config(filename):
     cfg[opt] = setting.get('default', opt)
   return cfg
 
+def deploy_changes(config, revision_file, since):
+  """
+  deploy only the hosts changed since the last run,
+  returns False if the API needs a full deployment
+  """
+  data = dict(POST_DATA)
+  data['since'] = since
+  r = requests.post(_changes_address(config), data)
+
+  if r.status_code == 410:
+    print("Info: revision " + since + " is too old, deploying all hosts")
+    return False
+
+  if r.status_code != 200:
+    print("Error: API Returned Status Code: " + str(r.status_code))
+    exit(1)
+
+  json = r.json()
+  for key in json['removed']:
+    print("Info: Host removed: " + key)
+  if len(json['hosts']) == 0:
+    print("Info: keys unchanged since revision " + since)
+
+  if deploy_hosts(json['hosts']) == 0:
+    write_state(revision_file, str(json['revision']))
+  return True
+
+def deploy_all(config, etag_file, revision_file, page_size):
+  """
+  deploy all hosts, page by page if page_size is set. Only the first
+  page is compared with the ETag of the last run: its revision covers
+  all hosts. The pages are not one snapshot, hosts added or renamed
+  between two requests can be missing from this run.
+  """
+  headers = dict(HEADERS)
+  etag = read_state(etag_file)
+  if etag:
+    headers['If-None-Match'] = etag
+
+  data = dict(POST_DATA)
+  if page_size:
+    data['limit'] = page_size
+
+  r = requests.post(config['address'], data, headers=headers)
+
+  if r.status_code == 304:
+    print("Info: keys unchanged since the last deployment")
+    if revision_file and r.headers.get('X-SKM-Revision'):
+      write_state(revision_file, r.headers['X-SKM-Revision'])
+    exit(0)
+
+  etag = r.headers.get('ETag')
+  revision = r.headers.get('X-SKM-Revision')
+  hosts = 0
+  errors = 0
+  while True:
+    if r.status_code != 200:
+      print("Error: API Returned Status Code: " + str(r.status_code))
+      exit(1)
+
+    json = r.json()
+    after = None
+    if page_size and isinstance(json.get('hosts'), dict) and 'accounts' not in json['hosts']:
+      # servers without paging ignore limit and return all hosts
+      after = json.get('next')
+      json = json['hosts']
+    hosts += len(json)
+    errors += deploy_hosts(json)
+    if after is None:
+      break
+    data['after'] = after
+    r = requests.post(config['address'], data, headers=HEADERS)
+
+  if hosts == 0:
+    print("Warning: API returned a empty json. Please check filter and or accounts")
+    exit(1);
+
+  if errors == 0:
+    if etag:
+      write_state(etag_file, etag)
+    if revision_file and revision:
+      write_state(revision_file, revision)
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
   parser.add_argument('-t', '--filter-type', help='run filter against: [group|environment|host]')
   parser.add_argument('-f', '--filter-value', help='filter value.')
   parser.add_argument('-c', '--config', help='configration with secret token and URL to webservice. defaults: /etc/skm-deploy.conf')
+  parser.add_argument('-s', '--state-dir', default=DEFAULT_STATE_DIR, help='directory to remember the last deployed version. defaults: /var/lib/skm-deploy')
+  parser.add_argument('-i', '--incremental', action='store_true', help='only deploy hosts changed since the last run.')
+  parser.add_argument('-p', '--page-size', type=int, default=0, help='number of hosts fetched per request, 0 fetches all at once. The pages are not one consistent snapshot. defaults: 0')
   args = parser.parse_args()
 
   if args.config:
@@ -58,7 +193,7 @@ if __name__ == '__main__':
     exit(1)
 
   if args.filter_type:
-    if args.filter_type not in [ 'group', 'host', 'environemnt' ]:
+    if args.filter_type not in [ 'group', 'host', 'environment' ]:
       print("Error: Unkown filter type argument: " + args.filter_type)
       exit(1)
     if args.filter_value is None:
@@ -71,27 +206,12 @@ if __name__ == '__main__':
   config = _get_config(CONFIG)
   POST_DATA['API_KEY'] = config['apikey']
 
-  r = requests.post(config['address'], POST_DATA)
-
-  if r.status_code != 200:
-    print("Error: API Returned Status Code: " + str(r.status_code))
-    exit(1)
-
-  if len(r.json()) == 0:
-    print("Warning: API returned a empty json. Please check filter and or accounts")
-    exit(1);
+  etag_file = _state_filename(args.state_dir, 'etag')
+  revision_file = None
+  if args.incremental:
+    revision_file = _state_filename(args.state_dir, 'revision')
+    since = read_state(revision_file)
+    if since and deploy_changes(config, revision_file, since):
+      exit(0)
 
-  json = r.json()
-  for key in json:
-    host = json[key]
-    connect = key
-    if host['ip']:
-      connect = host['ip']
-    try:
-      print("Info: Deploying Host: " + key)
-      directory = tempfile.mkdtemp('_' + key, prefix='skm-deploy')
-      write_keys(directory, host['accounts'])
-      shutil.rmtree(directory)
-    except Exception as e:
-      print("Error: error on host " + key)
-      pass
+  deploy_all(config, etag_file, revision_file, args.page_size)
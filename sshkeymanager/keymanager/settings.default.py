@@ -77,7 +77,15 @@ PUPPETDB = {
     'SSL_VERIFY': True,
     'SSL_KEY': None,
     'SSL_CERT': None,
-    'TIMEOUT': 20
+    'TIMEOUT': 20,
+    ## facts imported as host labels for selector group rules, e.g. ['role', 'datacenter']
+    'LABEL_FACTS': [],
+    ## rows per request, None reads every result with one request
+    'PAGE_SIZE': 1000,
+    ## pages requested at once
+    'WORKERS': 4,
+    ## retries after a connection error, timeout or server error
+    'RETRIES': 3
 }
 
 ## API Key to receive key configuration via API
@@ -85,6 +93,32 @@ API_KEYS = [
         'K6TFCt/67kZTU',
     ]
 
+## stream the API response host by host instead of building it in memory.
+## the content is the same, but the response has no Content-Length.
+API_STREAMING = False
+
+## number of host/account entries cached in every process for api/authorized_keys
+AUTHORIZED_KEYS_CACHE_SIZE = 10000
+
+## seconds a getkeys response is shared with identical requests of the same revision,
+## concurrent identical requests always wait for one computation
+API_COALESCE_TTL = 5
+
+## bytes of getkeys responses kept for API_COALESCE_TTL in every process
+API_COALESCE_MAX_BYTES = 20 * 1024 * 1024
+
+## alias in CACHES to keep the accounts of every host for the API, e.g. a memcached cache.
+## Entries are versioned per host, a change only invalidates the affected hosts.
+## Outdated entries expire with the TIMEOUT of the cache. None disables the cache.
+ACCESS_CACHE = None
+
+## alias in CACHES for the counts of the overview page, None disables the cache.
+## The counts are dropped on every change and expire after STATS_CACHE_TTL seconds.
+## Use a cache shared by all processes, e.g. memcached: with a per-process cache
+## like locmem a change only drops the counts of the process that made it.
+STATS_CACHE = None
+STATS_CACHE_TTL = 30
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
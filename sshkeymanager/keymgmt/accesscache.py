@@ -0,0 +1,129 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from keymgmt.effective import chunks
+from keymgmt.models import EffectiveAccess, SSHKey
+
+
+def load_accounts(host_ids):
+    """
+    accounts with their ssh key entries from the EffectiveAccess table,
+    as dict of host id to the accounts. Hosts without accounts are missing.
+    """
+    hosts = {}
+    rows = EffectiveAccess.objects.filter(host_id__in=host_ids).values_list(
+        'host_id', 'account_name', 'sshkey__sshkey', 'sshkey__name').order_by('host_id', 'account_name', 'position')
+    for host_id, account, sshkey, sshkey_name in rows:
+        keys = hosts.setdefault(host_id, {}).setdefault(account, [])
+        if sshkey is not None:
+            keys.append(SSHKey.key_entry(sshkey, sshkey_name))
+    return hosts
+
+
+class AccessCache:
+    """
+    Accounts of a host in the Django cache ACCESS_CACHE, keyed by host id
+    and Host.access_revision. A refresh of the EffectiveAccess rows moves
+    the access_revision of exactly the refreshed hosts, so their old
+    entries are not used anymore while all other hosts stay cached.
+    Outdated entries expire with the timeout of the cache backend.
+
+    The counters are per process. A miss of an entry this process has
+    stored with the same revision counts as eviction, a miss of an entry
+    stored with an older revision as invalidation.
+    """
+
+    def __init__(self, alias=None):
+        self.alias = alias
+        self.lock = threading.Lock()
+        self.stored = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def cache_alias(self):
+        if self.alias is None:
+            return getattr(settings, 'ACCESS_CACHE', None)
+        return self.alias
+
+    def enabled(self):
+        return self.cache_alias() is not None
+
+    def cache(self):
+        return caches[self.cache_alias()]
+
+    def key(host_id, revision):
+        return 'skm:access:%d:%d' % (host_id, revision)
+
+    def get_many(self, hosts):
+        """
+        cached accounts of the given (host id, access revision) tuples,
+        as dict of host id to the accounts
+        """
+        found = self.cache().get_many([AccessCache.key(host_id, revision) for host_id, revision in hosts])
+
+        result = {}
+        with self.lock:
+            for host_id, revision in hosts:
+                key = AccessCache.key(host_id, revision)
+                if key in found:
+                    self.hits += 1
+                    result[host_id] = found[key]
+                    continue
+                self.misses += 1
+                stored = self.stored.get(host_id)
+                if stored == revision:
+                    self.evictions += 1
+                elif stored is not None:
+                    self.invalidations += 1
+        return result
+
+    def set_many(self, hosts):
+        """
+        store the accounts of (host id, access revision, accounts) tuples
+        """
+        self.cache().set_many(
+            dict((AccessCache.key(host_id, revision), accounts) for host_id, revision, accounts in hosts)
+        )
+        with self.lock:
+            for host_id, revision, accounts in hosts:
+                self.stored[host_id] = revision
+
+    def accounts(self, hosts):
+        """
+        accounts of the given (host id, access revision) tuples, missing
+        hosts are read from the EffectiveAccess table and stored
+        """
+        result = {}
+        for chunk in chunks(hosts):
+            found = self.get_many(chunk)
+            missing = [host_id for host_id, revision in chunk if host_id not in found]
+            if len(missing) > 0:
+                loaded = load_accounts(missing)
+                entries = [(host_id, revision, loaded.get(host_id, {})) for host_id, revision in chunk
+                           if host_id not in found]
+                self.set_many(entries)
+                for host_id, revision, accounts in entries:
+                    found[host_id] = accounts
+            result.update(found)
+        return result
+
+    def reset_stats(self):
+        with self.lock:
+            self.stored.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        return {
+            'enabled': self.enabled(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
+
+
+access_cache = AccessCache()
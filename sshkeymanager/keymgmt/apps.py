@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class KeymgmtConfig(AppConfig):
+    name = 'keymgmt'
+    verbose_name = 'SSH Key Manager'
+
+    def ready(self):
+        import keymgmt.signals
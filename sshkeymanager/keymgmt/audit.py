@@ -0,0 +1,110 @@
+"""
+Audit report of the keys deployed to every host and account, read from
+the EffectiveAccess table page by page.
+"""
+from collections import OrderedDict
+import csv
+
+from django.core.paginator import Paginator
+
+from keymgmt.models import EffectiveAccess, Host
+
+CSV_HEADER = ['host', 'environment', 'account', 'key', 'fingerprint']
+
+
+class AccessAudit:
+    """
+    Hosts with their accounts and keys, optionally filtered by the name
+    of an environment, a group (including its subgroups), an account or
+    a key. With an account or key filter only the matching accounts and
+    keys are part of the report.
+
+    A page needs a fixed number of queries whatever its size: the count,
+    the hosts of the page and their EffectiveAccess rows.
+    """
+    FILTERS = ['environment', 'group', 'account', 'key']
+
+    def __init__(self, environment=None, group=None, account=None, key=None):
+        self.filters = {'environment': environment, 'group': group, 'account': account, 'key': key}
+
+        self.rows = EffectiveAccess.objects.all()
+        if account:
+            self.rows = self.rows.filter(account_name=account)
+        if key:
+            self.rows = self.rows.filter(sshkey__name=key)
+
+        self.hosts = Host.objects.all()
+        if environment:
+            self.hosts = self.hosts.filter(environment__name=environment)
+        if group:
+            self.hosts = self.hosts.filter(
+                id__in=Host.objects.filter(group__ancestor_links__ancestor__name=group).values('id'))
+        if account or key:
+            self.hosts = self.hosts.filter(id__in=self.rows.values('host_id'))
+        self.hosts = self.hosts.order_by('name')
+
+    def accounts(self, host_ids):
+        """
+        accounts of the hosts with their keys as (name, fingerprint) tuples,
+        as dict of host id to an OrderedDict of the accounts
+        """
+        result = {}
+        rows = self.rows.filter(host_id__in=host_ids).values_list(
+            'host_id', 'account_name', 'sshkey__name', 'sshkey__fingerprint').order_by(
+            'host_id', 'account_name', 'position')
+        for host_id, account, key, fingerprint in rows:
+            keys = result.setdefault(host_id, OrderedDict()).setdefault(account, [])
+            if key is not None:
+                keys.append((key, fingerprint))
+        return result
+
+    def page(self, number, per_page=100):
+        """
+        a Paginator page of hosts, every host with the attribute accounts.
+        Raises django.core.paginator.InvalidPage for pages out of range.
+        """
+        page = Paginator(self.hosts.select_related('environment'), per_page).page(number)
+        hosts = list(page.object_list)
+        accounts = self.accounts([host.id for host in hosts])
+        for host in hosts:
+            host.accounts = accounts.get(host.id, OrderedDict())
+        page.object_list = hosts
+        return page
+
+    def iter_rows(self, chunk_size=500):
+        """
+        the report as CSV rows of CSV_HEADER, one row per key and one
+        row without key for accounts without any. Hosts are read in
+        chunks ordered by name.
+        """
+        after = None
+        while True:
+            hosts = self.hosts
+            if after is not None:
+                hosts = hosts.filter(name__gt=after)
+            hosts = list(hosts.values_list('id', 'name', 'environment__name')[:chunk_size])
+            if len(hosts) == 0:
+                return
+            after = hosts[-1][1]
+            accounts = self.accounts([host_id for host_id, name, environment in hosts])
+            for host_id, name, environment in hosts:
+                for account, keys in accounts.get(host_id, {}).items():
+                    if len(keys) == 0:
+                        yield [name, environment, account, '', '']
+                    for key, fingerprint in keys:
+                        yield [name, environment, account, key, fingerprint or '']
+
+
+class Echo:
+    """ file like object for csv.writer, write returns the line """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    """ yields every row of rows as CSV line, starting with CSV_HEADER """
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
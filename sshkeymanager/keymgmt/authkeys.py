@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading
+
+from django.conf import settings
+
+from keymgmt.models import AccessRevision, EffectiveAccess, HostChange, SSHKey
+
+
+class AuthorizedKeysCache:
+    """
+    In-process LRU cache for the authorized_keys content of one account
+    on one host, used for sshd AuthorizedKeysCommand.
+
+    Every lookup reads the AccessRevision. If it moved since the last
+    lookup, only the entries of the hosts in the HostChange log between
+    both revisions are dropped, so changes made by other processes are
+    seen as well.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.revision = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def size(self):
+        if self.max_entries is None:
+            return getattr(settings, 'AUTHORIZED_KEYS_CACHE_SIZE', 10000)
+        return self.max_entries
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.revision = None
+
+    def sync(self):
+        """
+        drop the entries of all hosts changed since the last lookup,
+        returns the current revision
+        """
+        revision, baseline = AccessRevision.objects.values_list('revision', 'baseline').get(pk=1)
+        with self.lock:
+            if self.revision is not None and self.revision >= revision:
+                return self.revision
+            if self.revision is None or self.revision < baseline:
+                self.entries.clear()
+            elif len(self.entries) > 0:
+                changed = set(HostChange.objects.filter(
+                    revision__gt=self.revision,
+                    revision__lte=revision
+                ).values_list('host_name', flat=True))
+                for key in list(self.entries.keys()):
+                    if key[0] in changed:
+                        del self.entries[key]
+                        self.invalidations += 1
+            self.revision = revision
+        return revision
+
+    def load(self, host_name, account):
+        """
+        authorized_keys lines from the EffectiveAccess table,
+        None if the account does not exist on the host
+        """
+        rows = EffectiveAccess.objects.filter(host__name=host_name, account_name=account).values_list(
+            'sshkey__sshkey', 'sshkey__name').order_by('position')
+        rows = list(rows)
+        if len(rows) == 0:
+            return None
+        return [SSHKey.key_entry(sshkey, name) for sshkey, name in rows if sshkey is not None]
+
+    def get(self, host_name, account):
+        revision = self.sync()
+        key = (host_name, account)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        entries = self.load(host_name, account)
+
+        with self.lock:
+            # another thread dropped changed hosts meanwhile, entries could be outdated
+            if self.revision == revision:
+                self.entries[key] = entries
+                while len(self.entries) > self.size():
+                    self.entries.popitem(last=False)
+        return entries
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'revision': self.revision
+        }
+
+
+authorized_keys_cache = AuthorizedKeysCache()
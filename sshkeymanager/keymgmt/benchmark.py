@@ -0,0 +1,116 @@
+"""
+Helpers for ./manage.py benchmark: a synthetic fleet that only lives
+inside a transaction and timing statistics.
+"""
+from contextlib import contextmanager
+import base64
+import os
+import time
+
+from django.db import transaction
+from django.db.models import Max
+
+from keymgmt import effective
+from keymgmt.models import Environment, Group, Host, SSHAccount, SSHKey, SSHKeyring
+from keymgmt.validators import sshkey_fingerprint
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+
+def report(title, timings):
+    """
+    print the distribution of timings given in seconds as milliseconds
+    """
+    print("%-30s n=%-6d p50=%.3fms p90=%.3fms p99=%.3fms max=%.3fms" % (
+        title,
+        len(timings),
+        percentile(timings, 50) * 1000,
+        percentile(timings, 90) * 1000,
+        percentile(timings, 99) * 1000,
+        max(timings) * 1000
+    ))
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def random_sshkey(comment):
+    blob = base64.b64encode(os.urandom(64)).decode('ascii')
+    return 'ssh-rsa ' + blob + ' ' + comment
+
+
+@contextmanager
+def synthetic_fleet(hosts=1000, environments=5, groups=50, keys=500, keyrings=20):
+    """
+    creates a fleet with accounts on every level and rolls it back at the end.
+    Every host is member of three groups, every keyring holds 20 keys.
+    """
+    with transaction.atomic():
+        Environment.objects.bulk_create(
+            [Environment(name='bench-env%d' % i) for i in range(environments)]
+        )
+        envs = list(Environment.objects.filter(name__startswith='bench-env').order_by('id'))
+
+        Host.objects.bulk_create(
+            [Host(name='bench%06d.example.com' % i, environment=envs[i % environments]) for i in range(hosts)],
+            batch_size=effective.BATCH_SIZE
+        )
+        host_ids = list(Host.objects.filter(name__startswith='bench').order_by('id').values_list('id', flat=True))
+
+        Group.objects.bulk_create([Group(name='bench group %d' % i) for i in range(groups)])
+        group_ids = list(Group.objects.filter(name__startswith='bench group').order_by('id').values_list('id', flat=True))
+        memberships = set()
+        for i, host_id in enumerate(host_ids):
+            for j in (i, i * 7 + 1, i * 13 + 2):
+                memberships.add((group_ids[j % groups], host_id))
+        Group.hosts.through.objects.bulk_create(
+            [Group.hosts.through(group_id=g, host_id=h) for g, h in memberships],
+            batch_size=effective.BATCH_SIZE
+        )
+
+        sshkeys = [random_sshkey('bench%d' % i) for i in range(keys)]
+        SSHKey.objects.bulk_create(
+            [SSHKey(name='Bench Key %d' % i, sshkey=sshkey, fingerprint=sshkey_fingerprint(sshkey))
+             for i, sshkey in enumerate(sshkeys)],
+            batch_size=effective.BATCH_SIZE
+        )
+        key_ids = list(SSHKey.objects.filter(name__startswith='Bench Key').order_by('id').values_list('id', flat=True))
+
+        SSHKeyring.objects.bulk_create([SSHKeyring(name='Bench Ring %d' % i) for i in range(keyrings)])
+        ring_ids = list(SSHKeyring.objects.filter(name__startswith='Bench Ring').order_by('id').values_list('id', flat=True))
+        SSHKeyring.keys.through.objects.bulk_create(
+            [SSHKeyring.keys.through(sshkeyring_id=r, sshkey_id=key_ids[(i * 20 + j) % keys])
+                for i, r in enumerate(ring_ids) for j in range(20)],
+            batch_size=effective.BATCH_SIZE
+        )
+
+        accounts = []
+        for env in envs:
+            accounts.append(SSHAccount(name='root', obj_name='environment', obj_id=env.id))
+        for group_id in group_ids:
+            accounts.append(SSHAccount(name='deploy', obj_name='group', obj_id=group_id))
+        for host_id in host_ids[::10]:
+            accounts.append(SSHAccount(name='app', obj_name='host', obj_id=host_id))
+        last_account = SSHAccount.objects.aggregate(Max('id'))['id__max'] or 0
+        SSHAccount.objects.bulk_create(accounts, batch_size=effective.BATCH_SIZE)
+
+        account_keys = []
+        account_keyrings = []
+        account_ids = SSHAccount.objects.filter(id__gt=last_account).order_by('id').values_list('id', flat=True)
+        for i, account_id in enumerate(account_ids):
+            for j in range(3):
+                account_keys.append(SSHAccount.keys.through(sshaccount_id=account_id, sshkey_id=key_ids[(i * 3 + j) % keys]))
+            account_keyrings.append(SSHAccount.keyrings.through(sshaccount_id=account_id, sshkeyring_id=ring_ids[i % keyrings]))
+        SSHAccount.keys.through.objects.bulk_create(account_keys, batch_size=effective.BATCH_SIZE)
+        SSHAccount.keyrings.through.objects.bulk_create(account_keyrings, batch_size=effective.BATCH_SIZE)
+
+        effective.rebuild()
+        yield
+        transaction.set_rollback(True)
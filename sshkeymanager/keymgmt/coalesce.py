@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+
+
+class Flight:
+    """
+    one running computation, other requests for the same key wait for it
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key within a process:
+    the first request computes the result, requests arriving meanwhile
+    wait for it and share the same object. Results are kept for a few
+    seconds afterwards, so the burst of a cron run on many hosts is
+    answered by one computation. The kept results are bytes, at most
+    max_bytes of them per process, the oldest are dropped first.
+
+    Keys have to change whenever the result may change, api_get_keys
+    uses the ETag, which contains the access revision.
+    """
+
+    def __init__(self, ttl=None, max_bytes=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.results = OrderedDict()
+        self.size = 0
+        self.computed = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.errors = 0
+
+    def timeout(self):
+        if self.ttl is None:
+            return getattr(settings, 'API_COALESCE_TTL', 5)
+        return self.ttl
+
+    def limit(self):
+        if self.max_bytes is None:
+            return getattr(settings, 'API_COALESCE_MAX_BYTES', 20 * 1024 * 1024)
+        return self.max_bytes
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.size = 0
+
+    def expire(self, now):
+        while len(self.results) > 0:
+            key, (expires, result) = next(iter(self.results.items()))
+            if expires > now:
+                break
+            self.drop(key)
+
+    def drop(self, key):
+        expires, result = self.results.pop(key)
+        self.size -= len(result)
+
+    def do(self, key, func):
+        """
+        result of func() for key, computed once for all concurrent callers
+        """
+        with self.lock:
+            self.expire(time.monotonic())
+            if key in self.results:
+                self.cached += 1
+                return self.results[key][1]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                if flight.error is None:
+                    self.store(key, flight.result)
+                else:
+                    self.errors += 1
+            flight.done.set()
+        return flight.result
+
+    def store(self, key, result):
+        """ keep the bytes result for the ttl, dropping the oldest results over the limit """
+        ttl = self.timeout()
+        limit = self.limit()
+        if ttl <= 0 or len(result) > limit:
+            return
+        self.results[key] = (time.monotonic() + ttl, result)
+        self.size += len(result)
+        while self.size > limit:
+            self.drop(next(iter(self.results)))
+
+    def stats(self):
+        return {
+            'computed': self.computed,
+            'coalesced': self.coalesced,
+            'cached': self.cached,
+            'errors': self.errors,
+            'entries': len(self.results),
+            'bytes': self.size
+        }
+
+
+get_keys_flight = SingleFlight()
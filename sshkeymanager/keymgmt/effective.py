@@ -0,0 +1,165 @@
+from django.db import transaction
+from django.db.models import Q
+
+from keymgmt.models import AccessRevision, EffectiveAccess, Group, GroupClosure, Host, HostChange, SSHAccount
+from keymgmt.resolver import AccountResolver
+
+# number of hosts resolved and written per round, keeps the IN lists
+# below the variable limit of SQLite
+BATCH_SIZE = 500
+
+
+def chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def access_rows(resolver):
+    """
+    EffectiveAccess rows (not saved) for all hosts of an AccountResolver
+    """
+    rows = []
+    for host, accounts in resolver.all():
+        for name, keys in accounts.items():
+            if len(keys) == 0:
+                rows.append(EffectiveAccess(host_id=host.id, account_name=name, sshkey=None, position=0))
+            for position, key in enumerate(keys):
+                rows.append(EffectiveAccess(host_id=host.id, account_name=name, sshkey_id=key.id, position=position))
+    return rows
+
+
+def refresh_hosts(host_ids):
+    """
+    recompute the EffectiveAccess rows of the given hosts
+    """
+    host_ids = list(host_ids)
+    if len(host_ids) == 0:
+        return
+    with transaction.atomic():
+        revision = AccessRevision.bump()
+        for chunk in chunks(host_ids):
+            EffectiveAccess.objects.filter(host_id__in=chunk).delete()
+            resolver = AccountResolver(Host.objects.filter(id__in=chunk))
+            EffectiveAccess.objects.bulk_create(access_rows(resolver))
+            Host.objects.filter(id__in=chunk).update(access_revision=revision)
+            HostChange.objects.bulk_create(
+                [HostChange(host_name=host.name, revision=revision) for host in resolver.hosts]
+            )
+
+
+def record_removed(host_names):
+    """
+    log hosts that are gone, because they were deleted or renamed
+    """
+    with transaction.atomic():
+        revision = AccessRevision.bump()
+        HostChange.objects.bulk_create(
+            [HostChange(host_name=name, revision=revision, removed=True) for name in host_names]
+        )
+
+
+def changes_since(since):
+    """
+    hosts changed after revision since, as tuple of
+    (revision, names of changed hosts, names of removed hosts).
+    revision is None if since is older than the baseline.
+    """
+    current = AccessRevision.objects.get(pk=1)
+    if since < current.baseline:
+        return None, [], []
+    removed = {}
+    changes = HostChange.objects.filter(revision__gt=since, revision__lte=current.revision)
+    for name, is_removed in changes.values_list('host_name', 'removed').order_by('revision', 'id'):
+        removed[name] = is_removed
+    changed = sorted(name for name, is_removed in removed.items() if not is_removed)
+    removed = sorted(name for name, is_removed in removed.items() if is_removed)
+    return current.revision, changed, removed
+
+
+def prune_changes(keep):
+    """
+    remove the change log of all but the last keep revisions
+    """
+    with transaction.atomic():
+        baseline = AccessRevision.objects.select_for_update().get(pk=1).revision - keep
+        AccessRevision.objects.filter(pk=1, baseline__lt=baseline).update(baseline=baseline)
+        HostChange.objects.filter(revision__lte=baseline).delete()
+
+
+def rebuild():
+    """
+    recompute the whole EffectiveAccess table, returns the number of hosts.
+    The change log is dropped, clients have to fetch all hosts again.
+    The GroupClosure is rebuilt first, the parents could be changed directly.
+    """
+    with transaction.atomic():
+        GroupClosure.rebuild()
+        revision = AccessRevision.bump()
+        AccessRevision.objects.filter(pk=1).update(baseline=revision)
+        HostChange.objects.filter(revision__lt=revision).delete()
+        EffectiveAccess.objects.all().delete()
+        Host.objects.update(access_revision=revision)
+        host_ids = list(Host.objects.order_by('id').values_list('id', flat=True))
+        for chunk in chunks(host_ids):
+            resolver = AccountResolver(Host.objects.filter(id__in=chunk))
+            EffectiveAccess.objects.bulk_create(access_rows(resolver))
+    return len(host_ids)
+
+
+def check_consistency(hosts):
+    """
+    compare EffectiveAccess with Host.get_account_merged(),
+    returns the names of all hosts that differ
+    """
+    stored = {}
+    for host_id, name, key_id in EffectiveAccess.objects.filter(host__in=hosts).values_list(
+            'host_id', 'account_name', 'sshkey_id').order_by('host', 'account_name', 'position'):
+        accounts = stored.setdefault(host_id, {})
+        keys = accounts.setdefault(name, [])
+        if key_id is not None:
+            keys.append(key_id)
+
+    differ = []
+    for host in hosts:
+        merged = {}
+        for name, keys in host.get_account_merged().items():
+            merged[name] = [key.id for key in keys]
+        if stored.get(host.id, {}) != merged:
+            differ.append(host.name)
+    return differ
+
+
+def hosts_for_accounts(accounts):
+    """
+    ids of all hosts an account queryset is deployed to
+    """
+    memberships = Group.hosts.through.objects.filter(
+        group__ancestor_links__ancestor__in=accounts.filter(obj_name='group').values('obj_id')
+    )
+    hosts = Host.objects.filter(
+        Q(id__in=accounts.filter(obj_name='host').values('obj_id')) |
+        Q(environment__in=accounts.filter(obj_name='environment').values('obj_id')) |
+        Q(id__in=memberships.values('host_id'))
+    )
+    return set(hosts.values_list('id', flat=True))
+
+
+def hosts_for_environments(environments):
+    return set(Host.objects.filter(environment__in=environments).values_list('id', flat=True))
+
+
+def hosts_for_groups(groups):
+    """
+    ids of all hosts of the groups and their subgroups
+    """
+    memberships = Group.hosts.through.objects.filter(group__ancestor_links__ancestor__in=groups)
+    return set(memberships.values_list('host_id', flat=True))
+
+
+def hosts_for_keyrings(keyrings):
+    return hosts_for_accounts(SSHAccount.objects.filter(keyrings__in=keyrings))
+
+
+def hosts_for_keys(keys):
+    return hosts_for_accounts(SSHAccount.objects.filter(Q(keys__in=keys) | Q(keyrings__keys__in=keys)))
@@ -0,0 +1,111 @@
+"""
+Reconcile group memberships with the GroupRules: a host is added to a
+group if it matches one of the rules of the group, either a regular
+expression on its name or a selector on its labels. Memberships added
+by rules are recorded as RuleMembership and removed again once no rule
+of the group matches the host, also after the last rule of the group
+was deleted. Hosts added by hand stay in the group.
+"""
+from django.db import transaction
+
+from keymgmt import effective
+from keymgmt.models import Group, GroupRule, Host, RuleMatcher, RuleMembership
+
+
+def membership_diff(group_ids, host_ids=None, batch_size=effective.BATCH_SIZE):
+    """
+    memberships of the given groups that differ from their rules, as tuple of
+    (list of (group id, host id) to add, list of (row id, group id, host id) to remove).
+    All hosts, or the hosts of host_ids, are evaluated in batches of batch_size.
+    Only memberships recorded as RuleMembership are removed.
+    """
+    group_ids = set(group_ids)
+    matcher = RuleMatcher.for_rules(GroupRule.objects.filter(group__in=group_ids))
+    through = Group.hosts.through
+
+    hosts = Host.objects.all()
+    if host_ids is not None:
+        hosts = hosts.filter(id__in=host_ids)
+
+    selected = {}
+    for group_id, host_id in matcher.selected(hosts):
+        selected.setdefault(host_id, set()).add(group_id)
+
+    added = []
+    removed = []
+    after = 0
+    while True:
+        batch = list(hosts.filter(id__gt=after).order_by('id').values_list('id', 'name')[:batch_size])
+        if len(batch) == 0:
+            break
+        after = batch[-1][0]
+
+        existing = {}
+        rows = through.objects.filter(host_id__in=[host_id for host_id, name in batch]).values_list(
+            'id', 'group_id', 'host_id')
+        for row_id, group_id, host_id in rows:
+            if group_id in group_ids:
+                existing[(group_id, host_id)] = row_id
+        created = RuleMembership.objects.filter(host_id__in=[host_id for host_id, name in batch],
+                                                group_id__in=group_ids).values_list('group_id', 'host_id')
+
+        wanted = set()
+        for host_id, name in batch:
+            for group_id in matcher.groups_for(name) | selected.get(host_id, set()):
+                wanted.add((group_id, host_id))
+
+        added.extend(sorted(wanted.difference(existing.keys())))
+        removed.extend(sorted((existing[pair], pair[0], pair[1]) for pair in created
+                              if pair in existing and pair not in wanted))
+    return added, removed
+
+
+def reconcile(group_ids=None, dry_run=False, host_ids=None):
+    """
+    add and remove memberships of the groups until they match their rules,
+    all groups with rules or with memberships added by rules if group_ids
+    is None. Groups without any rule lose the memberships their former
+    rules added. host_ids limits the hosts
+    to evaluate, all hosts if None. The rows are written in bulk in one
+    transaction and the EffectiveAccess rows of all changed hosts are
+    refreshed once. Returns the number of added and removed memberships.
+    """
+    if group_ids is None:
+        group_ids = set(GroupRule.objects.values_list('group_id', flat=True).distinct())
+        group_ids.update(RuleMembership.objects.values_list('group_id', flat=True).distinct())
+    group_ids = list(group_ids)
+    if len(group_ids) == 0:
+        return 0, 0
+
+    through = Group.hosts.through
+    with transaction.atomic():
+        added, removed = membership_diff(group_ids, host_ids)
+        if dry_run or (len(added) == 0 and len(removed) == 0):
+            return len(added), len(removed)
+
+        for chunk in effective.chunks([row_id for row_id, group_id, host_id in removed]):
+            through.objects.filter(id__in=chunk).delete()
+        RuleMembership.forget((group_id, host_id) for row_id, group_id, host_id in removed)
+        through.objects.bulk_create(
+            [through(group_id=group_id, host_id=host_id) for group_id, host_id in added],
+            batch_size=effective.BATCH_SIZE
+        )
+        RuleMembership.record(added)
+        hosts = set(host_id for group_id, host_id in added)
+        hosts.update(host_id for row_id, group_id, host_id in removed)
+        effective.refresh_hosts(hosts)
+    return len(added), len(removed)
+
+
+def reconcile_labels(host_ids):
+    """
+    evaluate the selector rules again for hosts with changed labels,
+    returns the number of added and removed memberships
+    """
+    group_ids = list(GroupRule.objects.filter(rule_type='selector').values_list('group_id', flat=True).distinct())
+    added = removed = 0
+    for chunk in effective.chunks(host_ids):
+        result = reconcile(group_ids, host_ids=chunk)
+        added += result[0]
+        removed += result[1]
+    return added, removed
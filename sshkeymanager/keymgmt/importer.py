@@ -1,51 +1,128 @@
-from keymgmt.models import SSHKey, Environment, Host, SSHAccountAvailable
+from keymgmt.models import SSHKey, Environment, Group, GroupRule, Host, RuleMembership, SSHAccountAvailable
+from keymgmt.effective import BATCH_SIZE, chunks, refresh_hosts
+from keymgmt.grouprules import membership_diff
+from keymgmt import stats
+from keymgmt.validators import sshkey_fingerprint
 import os
+import sys
+import gzip
+import itertools
+import json
+import threading
+import time
 import requests
 import glob
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.conf import settings
+from django.db import transaction
+
+# seconds to wait before the first retry of a failed PuppetDB request,
+# multiplied by the number of the attempt
+RETRY_DELAY = 1
+
+# certnames per facts query of a page of nodes, keeps the URL short
+FACT_NODES = 100
 
 
 class ImportPuppetdb:
+    """
+    Reads nodes, facts and users from PuppetDB. With PAGE_SIZE the results
+    are read in pages of PAGE_SIZE rows, WORKERS pages are requested at
+    once. Connection errors, timeouts and server errors are retried RETRIES
+    times, other errors are raised at once. The requests, rows and
+    seconds per endpoint are counted in timings.
+    """
     def __init__(self):
         self.settings = self.get_settings()
+        # one session for all queries, the connections are reused
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(self.workers(), 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.verify = self.settings['SSL_VERIFY']
+        self.session.cert = (self.settings['SSL_CERT'], self.settings['SSL_KEY'])
+        self.lock = threading.Lock()
+        self.timings = OrderedDict()
 
     def get_settings(self):
         if hasattr(settings, 'PUPPETDB') is False:
             raise Exception("Could not find configuration PUPPETDB in settings")
         return settings.PUPPETDB
 
+    def workers(self):
+        return self.settings.get('WORKERS', 4)
+
     def users(self):
         users = []
-        puppetdb_users = self._get('/resources/User')
-        for user in puppetdb_users:
-            users.append(user['title'])
+        for page in self._pages('/resources/User', ['certname', 'title']):
+            for user in page:
+                users.append(user['title'])
         users = list(OrderedDict.fromkeys(users))
         return users
 
     def nodes(self):
+        return list(self.iter_nodes())
+
+    def iter_nodes(self):
+        """
+        the nodes as generator, the nodes are read page by page while the
+        caller imports them. With PAGE_SIZE the worker reading a page also
+        reads the ipaddress and label facts of its nodes, so the memory
+        does not grow with the number of nodes. Without PAGE_SIZE the
+        facts of all nodes are read with one query.
+        """
+        if self.settings.get('PAGE_SIZE'):
+            pages = self._pages('/nodes', ['certname'], convert=self.with_facts)
+        else:
+            pages = [self.with_facts(self._get('/nodes'), self.facts(self.fact_names()))]
+        for page in pages:
+            for node in page:
+                yield node
+
+    def fact_names(self):
+        return ['ipaddress'] + list(self.settings.get('LABEL_FACTS', []))
+
+    def with_facts(self, page, facts=None):
+        """
+        the nodes of a page of /nodes with their ipaddress and labels,
+        the facts of the page are read if not given
+        """
+        if facts is None:
+            facts = self.facts(self.fact_names(), [node["certname"] for node in page])
         nodes = []
-        puppetdb_nodes = self._get('/nodes')
-        for node in puppetdb_nodes:
-            nodes.append(
-                {
-                    'name': node["certname"],
-                    'ip': self.node_ipaddress(node["certname"]),
-                    'env': node["catalog-environment"]
-                 }
-            )
+        for node in page:
+            labels = {}
+            for fact, values in facts.items():
+                if fact != 'ipaddress' and node["certname"] in values:
+                    labels[fact] = values[node["certname"]]
+            nodes.append({
+                'name': node["certname"],
+                'ip': facts['ipaddress'].get(node["certname"]),
+                'env': node["catalog-environment"],
+                'labels': labels
+            })
         return nodes
 
-    def node_ipaddress(self, node):
-        ip = None
-        try:
-            result = self._get('/nodes/' + node + '/facts/ipaddress')
-            ip = result[0]["value"]
-        except:
-            """ we don't care if we found no ip address """
-            pass
-        return ip
+    def facts(self, names, certnames=None):
+        """
+        values of the facts, as dict of fact name to dict of certname to
+        value. All facts of all nodes are read with one query, the facts of
+        the nodes in certnames with one query per FACT_NODES nodes.
+        """
+        values = dict((name, {}) for name in names)
+        query = ['or'] + [['=', 'name', name] for name in values]
+        if certnames is None:
+            pages = self._pages('/facts', ['certname', 'name'], {'query': json.dumps(query)})
+        else:
+            pages = (self._get('/facts', {'query': json.dumps(['and', query, ['in', 'certname', ['array', chunk]]])})
+                     for chunk in batches(certnames, FACT_NODES))
+        for page in pages:
+            for fact in page:
+                values[fact["name"]][fact["certname"]] = str(fact["value"])
+        return values
 
     def _url(self):
         if self.settings['SSL_KEY'] is None and self.settings['SSL_CERT'] is None:
@@ -54,27 +131,99 @@ class ImportPuppetdb:
             proto = 'https'
         return proto + '://' + self.settings['HOST'] + ':' + str(self.settings['PORT']) + '/v4'
 
+    def _pages(self, query, order_by, params=None, convert=None):
+        """
+        the result of a query as generator of pages, in order. Without
+        PAGE_SIZE the whole result is one page. The first page asks for the
+        total, the other pages are requested by the worker threads, at most
+        WORKERS pages ahead of the consumer. Without a total the pages are
+        read one after the other until a page is not full. convert is
+        applied to every paged result by the thread that read it.
+        """
+        page_size = self.settings.get('PAGE_SIZE')
+        if not page_size:
+            yield self._get(query, params)
+            return
+
+        params = dict(params or {}, limit=page_size, order_by=json.dumps([{'field': field} for field in order_by]))
+
+        def read(offset):
+            page = self._get(query, dict(params, offset=offset))
+            return page if convert is None else convert(page)
+
+        page, headers = self._request(query, dict(params, offset=0, include_total='true'))
+        full = len(page) == page_size
+        yield page if convert is None else convert(page)
+        if headers.get('X-Records') is None:
+            offset = page_size
+            while full:
+                page = self._get(query, dict(params, offset=offset))
+                full = len(page) == page_size
+                offset += page_size
+                yield page if convert is None else convert(page)
+            return
+
+        offsets = iter(range(page_size, int(headers['X-Records']), page_size))
+        with ThreadPoolExecutor(max_workers=self.workers()) as executor:
+            pending = deque(executor.submit(read, offset) for offset in itertools.islice(offsets, self.workers()))
+            while len(pending) > 0:
+                page = pending.popleft().result()
+                for offset in itertools.islice(offsets, 1):
+                    pending.append(executor.submit(read, offset))
+                yield page
+
     def _get(self, query, params=None):
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        return self._request(query, params)[0]
+
+    def _request(self, query, params=None):
+        """ body and headers of the response, failed requests are retried if retryable """
         url = self._url() + query
-        try:
-            req = requests.get(url,
-                        params=params,
-                        headers=headers,
-                        verify=self.settings['SSL_VERIFY'],
-                        cert=(self.settings['SSL_CERT'], self.settings['SSL_KEY']),
-                        timeout=self.settings['TIMEOUT']
-                    )
-            body = req.json()
-            if body is not None:
-                return body
-            else:
-                raise Exception("no body returned by query: " + url)
-        except:
-            print("Error: with connecting to PuppetDB")
-            raise
+        retries = self.settings.get('RETRIES', 3)
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                req = self.session.get(url,
+                            params=params,
+                            timeout=self.settings['TIMEOUT']
+                        )
+                req.raise_for_status()
+                body = req.json()
+                break
+            except requests.RequestException as e:
+                attempt += 1
+                if attempt > retries or not retryable(e):
+                    print("Error: with connecting to PuppetDB", file=sys.stderr)
+                    raise
+                time.sleep(RETRY_DELAY * attempt)
+        if body is None:
+            raise Exception("no body returned by query: " + url)
+        self.record(query, time.time() - start, len(body))
+        return body, req.headers
+
+    def record(self, query, seconds, rows):
+        with self.lock:
+            timing = self.timings.setdefault(query, {'requests': 0, 'rows': 0, 'seconds': 0.0})
+            timing['requests'] += 1
+            timing['rows'] += rows
+            timing['seconds'] += seconds
+
+
+def retryable(error):
+    """ connection problems and server errors may pass, a bad query or a denied request never does """
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def batches(items, size):
+    """ lists of up to size items of an iterable, read lazily """
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, size))
+        if len(batch) == 0:
+            return
+        yield batch
 
 
 class ImportSSHAccountAvailable:
@@ -105,30 +254,121 @@ class ImportSSHAccountAvailable:
 
 
 class ImportHost:
-    def __init__(self, file):
+    def __init__(self, file, keep_names=True):
         self.filename = file
         self.content = []
         self.import_errors = []
         self.import_ok = []
         self.import_already = []
+        self.keep_names = keep_names
+        self.counts = {'ok': 0, 'already': 0, 'errors': 0}
+        self.environments = {}
+        self.invalid_environments = set()
 
-    def import_host(self):
-        for host in self.content:
-            env = self.create_or_return_env(host['env'])
-            if env is not None:
-                try:
-                    Host.objects.get(name=host['name'])
-                    self.import_already.append(host['name'])
-                    continue
-                except:
-                    pass
-                chost = self.create_host(host['name'], env, host['ip'])
-                if chost is not None:
-                    self.import_ok.append(host['name'])
-                else:
-                    self.import_errors.append(host['name'])
-            else:
-                self.import_errors.append(host['name'])
+    def import_host(self, batch_size=BATCH_SIZE):
+        """ create the hosts of self.content, see import_stream """
+        self.import_stream(self.content, batch_size)
+
+    def import_stream(self, hosts, batch_size=BATCH_SIZE, progress=None):
+        """
+        create the hosts of an iterable of split_line dicts in batches of
+        batch_size. Every batch is validated in memory and inserted in one
+        transaction together with its group memberships and EffectiveAccess
+        rows, so only one batch is held in memory. progress is called after
+        every batch with the number of rows read so far.
+        """
+        rows = 0
+        for batch in batches((host for host in hosts if host is not None), batch_size):
+            self.import_batch(batch)
+            rows += len(batch)
+            if progress is not None:
+                progress(rows)
+        if self.counts['ok'] > 0:
+            stats.invalidate()
+
+    def import_batch(self, hosts):
+        existing = set()
+        for chunk in chunks(set(host['name'] for host in hosts)):
+            existing.update(Host.objects.filter(name__in=chunk).values_list('name', flat=True))
+        environments = self.bulk_environments(set(host['env'] for host in hosts if host['name'] not in existing))
+
+        new_hosts = []
+        for host in hosts:
+            if host['name'] in existing:
+                self.record('already', host['name'])
+                continue
+            if host['env'] not in environments:
+                self.record('errors', host['name'])
+                continue
+            new_host = Host(name=host['name'], environment_id=environments[host['env']], ipaddress=host['ip'])
+            try:
+                new_host.clean()
+                new_host.clean_fields(exclude=['environment'])
+            except ValidationError:
+                self.record('errors', host['name'])
+                continue
+            existing.add(host['name'])
+            new_hosts.append(new_host)
+
+        if len(new_hosts) > 0:
+            self.bulk_hosts(new_hosts)
+            for host in new_hosts:
+                self.record('ok', host.name)
+
+    def record(self, result, name):
+        """ count the result of a host, with keep_names also in its list """
+        self.counts[result] += 1
+        if self.keep_names:
+            getattr(self, 'import_' + result).append(name)
+
+    def bulk_environments(self, names):
+        """
+        ids of the environments as dict of name to id, missing environments
+        with a valid name are created. Known environments are kept for the
+        next batches.
+        """
+        missing = [name for name in names if name not in self.environments and name not in self.invalid_environments]
+        for chunk in chunks(missing):
+            self.environments.update(Environment.objects.filter(name__in=chunk).values_list('name', 'id'))
+        new_environments = []
+        for name in missing:
+            if name in self.environments:
+                continue
+            env = Environment(name=name)
+            try:
+                env.clean()
+                env.clean_fields()
+            except ValidationError:
+                self.invalid_environments.add(name)
+                continue
+            new_environments.append(env)
+        if len(new_environments) > 0:
+            Environment.objects.bulk_create(new_environments)
+            for chunk in chunks([env.name for env in new_environments]):
+                self.environments.update(Environment.objects.filter(name__in=chunk).values_list('name', 'id'))
+        return dict((name, self.environments[name]) for name in names if name in self.environments)
+
+    def bulk_hosts(self, hosts):
+        """
+        insert the validated hosts, add them to the groups of the matching
+        rules and compute their EffectiveAccess rows in one transaction
+        """
+        through = Group.hosts.through
+        with transaction.atomic():
+            Host.objects.bulk_create(hosts)
+            group_ids = list(GroupRule.objects.values_list('group_id', flat=True).distinct())
+            host_ids = []
+            for chunk in chunks([host.name for host in hosts]):
+                ids = list(Host.objects.filter(name__in=chunk).values_list('id', flat=True))
+                if len(group_ids) > 0:
+                    added, removed = membership_diff(group_ids, ids)
+                    through.objects.bulk_create(
+                        [through(group_id=group_id, host_id=host_id) for group_id, host_id in added],
+                        batch_size=BATCH_SIZE
+                    )
+                    RuleMembership.record(added)
+                host_ids.extend(ids)
+            refresh_hosts(host_ids)
 
     def create_host(self, hostname, env, ip):
         try:
@@ -180,10 +420,29 @@ class ImportHost:
 
         return host
 
+    def read_lines(self):
+        """
+        the parsed lines of the file as generator, blank lines are skipped.
+        The filename - reads from stdin, files ending with .gz are
+        decompressed while reading.
+        """
+        if self.filename == '-':
+            for host in ImportHost.parse_lines(sys.stdin):
+                yield host
+            return
+        opener = gzip.open if self.filename.endswith('.gz') else open
+        with opener(self.filename, 'rt') as f:
+            for host in ImportHost.parse_lines(f):
+                yield host
+
+    def parse_lines(lines):
+        for line in lines:
+            host = ImportHost.split_line(line)
+            if host is not None:
+                yield host
+
     def read_file(self):
-        with open(self.filename) as f:
-            for line in f:
-                self.content.append(ImportHost.split_line(line))
+        self.content.extend(self.read_lines())
 
 
 class ImportSSHKey:
@@ -193,27 +452,67 @@ class ImportSSHKey:
         self.sshkeys_added = []
         self.sshkeys_added_already = []
         self.sshkeys_added_errors = []
+        self.sshkeys_duplicates = []
         self.parse_option(options)
         self.make_uniq()
 
-    def add_keys_to_db(self):
-        for key in self.sshkeys:
-            sshkey_basename = os.path.basename(key)
-            name = SSHKey.filename2name(sshkey_basename)
-            try:
-                SSHKey.objects.get(name=name)
-                self.sshkeys_added_already.append(key)
-                continue
-            except ObjectDoesNotExist:
-                skey = SSHKey(name=name, sshkey=ImportSSHKey.ssh_read_key(key))
-
-            try:
-                skey.clean()
-                skey.full_clean()
-                skey.save()
-                self.sshkeys_added.append(key)
-            except ValidationError:
-                self.sshkeys_added_errors.append(key)
+    def add_keys_to_db(self, workers=1, batch_size=BATCH_SIZE):
+        """
+        import the key files in batches of batch_size. The files of a batch
+        are read and validated by a pool of workers threads, then the known
+        names and fingerprints of the batch are read with one query each
+        and the new keys are inserted with one bulk insert.
+        """
+        known = {}
+        names = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in chunks(self.sshkeys, batch_size):
+                prepared = list(executor.map(ImportSSHKey.prepare_key, batch))
+                existing = set(SSHKey.objects.filter(name__in=[skey.name for key, skey, valid in prepared]).values_list(
+                    'name', flat=True))
+                known.update(SSHKey.objects.filter(
+                    fingerprint__in=[skey.fingerprint for key, skey, valid in prepared if skey.fingerprint is not None]
+                ).values_list('fingerprint', 'name'))
+
+                new_keys = []
+                for key, skey, valid in prepared:
+                    if skey.name in existing or skey.name in names:
+                        self.sshkeys_added_already.append(key)
+                        continue
+                    if skey.fingerprint in known:
+                        self.sshkeys_duplicates.append(key + ' (same key as ' + known[skey.fingerprint] + ')')
+                        continue
+                    if not valid:
+                        self.sshkeys_added_errors.append(key)
+                        continue
+                    new_keys.append(skey)
+                    names.add(skey.name)
+                    known[skey.fingerprint] = skey.name
+                    self.sshkeys_added.append(key)
+                SSHKey.objects.bulk_create(new_keys)
+        if len(self.sshkeys_added) > 0:
+            stats.invalidate()
+
+    def prepare_key(filename):
+        """
+        the key of a file as tuple (filename, unsaved SSHKey, valid), runs
+        inside the worker threads and does not query the database
+        """
+        skey = SSHKey(name=SSHKey.filename2name(os.path.basename(filename)))
+        try:
+            skey.sshkey = ImportSSHKey.ssh_read_key(filename)
+        except (IOError, UnicodeDecodeError):
+            skey.sshkey = ''
+        try:
+            skey.fingerprint = sshkey_fingerprint(skey.sshkey)
+        except ValueError:
+            skey.fingerprint = None
+        try:
+            skey.clean()
+            skey.clean_fields()
+        except ValidationError:
+            return filename, skey, False
+        return filename, skey, True
 
     def parse_option(self, options):
         for option in options:
@@ -226,8 +525,8 @@ class ImportSSHKey:
                 self.option_with_errors.append(option)
 
     def ssh_read_key(filename):
-        content = open(filename).read()
-        return content
+        with open(filename) as f:
+            return f.read()
 
     def check_option_mode(self, option):
         """
@@ -239,7 +538,7 @@ class ImportSSHKey:
             return 'file'
 
     def check_directory(self, directory):
-        for file in glob.glob(os.path.join(directory, '*.pub')):
+        for file in sorted(glob.glob(os.path.join(directory, '*.pub'))):
             if self.check_option_mode(file):
                 self.sshkeys.append(file)
             else:
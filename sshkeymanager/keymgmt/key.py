@@ -1,4 +1,7 @@
-from keymgmt.models import Host, Environment, SSHAccount, Group
+import json
+
+from keymgmt.models import Host, Environment, SSHAccount, Group, SSHKey
+from keymgmt.accesscache import access_cache
 
 
 class ExceptionFilterValueMissing(Exception):
@@ -31,3 +34,106 @@ class KeyAccess:
 
     def all(self):
         return self.hosts
+
+    def export(self, hosts=None):
+        """
+        hosts with their accounts and ssh key entries as used by the API.
+        Reads the EffectiveAccess table with one query, hosts without
+        any account are part of the result.
+        """
+        if hosts is None:
+            hosts = self.hosts
+        if access_cache.enabled():
+            return self.export_cached(hosts)
+        rows = hosts.values_list(
+            'name',
+            'ipaddress',
+            'environment__name',
+            'effectiveaccess__account_name',
+            'effectiveaccess__sshkey__sshkey',
+            'effectiveaccess__sshkey__name',
+        ).order_by('name', 'effectiveaccess__account_name', 'effectiveaccess__position')
+
+        hosts = {}
+        for name, ipaddress, environment, account, sshkey, sshkey_name in rows:
+            if name not in hosts:
+                hosts[name] = {
+                    'ip': ipaddress,
+                    'environment': environment,
+                    'accounts': {}
+                }
+            if account is None:
+                continue
+            keys = hosts[name]['accounts'].setdefault(account, [])
+            if sshkey is not None:
+                keys.append(SSHKey.key_entry(sshkey, sshkey_name))
+        return hosts
+
+    def export_cached(self, hosts):
+        """
+        same as export(), the accounts are taken from the access cache
+        and only the missing hosts are read from EffectiveAccess
+        """
+        rows = list(hosts.values_list('id', 'name', 'ipaddress', 'environment__name', 'access_revision'))
+        accounts = access_cache.accounts([(host_id, revision) for host_id, name, ip, env, revision in rows])
+
+        hosts = {}
+        for host_id, name, ipaddress, environment, revision in rows:
+            hosts[name] = {
+                'ip': ipaddress,
+                'environment': environment,
+                'accounts': accounts[host_id]
+            }
+        return hosts
+
+    def page(self, limit, after=None):
+        """
+        up to limit hosts ordered by name, starting after the host name after.
+        Returns the hosts as export() does together with the name to
+        continue after, which is None on the last page.
+        """
+        hosts = self.hosts.order_by('name')
+        if after is not None:
+            hosts = hosts.filter(name__gt=after)
+        names = list(hosts.values_list('name', flat=True)[:limit + 1])
+        if len(names) == 0:
+            return {}, None
+        next_after = None
+        if len(names) > limit:
+            names = names[:limit]
+            next_after = names[-1]
+        return self.export(Host.objects.filter(name__in=names)), next_after
+
+    def iter_export(self, chunk_size=500):
+        """
+        same content as export(), as (hostname, host) tuples ordered by
+        hostname. Hosts are loaded in chunks, so memory does not grow with
+        the number of hosts.
+        """
+        after = None
+        while True:
+            hosts, after = self.page(chunk_size, after)
+            for name in sorted(hosts.keys()):
+                yield name, hosts[name]
+            if after is None:
+                return
+
+
+def json_stream(items):
+    """
+    yields the text of json.dumps(dict(items), sort_keys=True, indent=4)
+    piece by piece, items have to be sorted by key.
+    """
+    empty = True
+    for key, value in items:
+        if empty:
+            prefix = '{\n    '
+            empty = False
+        else:
+            prefix = ',\n    '
+        value = json.dumps(value, sort_keys=True, indent=4).replace('\n', '\n    ')
+        yield prefix + json.dumps(key) + ': ' + value
+    if empty:
+        yield '{}'
+    else:
+        yield '\n}'
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from keymgmt import grouprules
+from keymgmt.models import Group
+import time
+
+
+class Command(BaseCommand):
+    help = 'Add and remove group members of all groups with rules until they match the GroupRules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group',
+                    action='append',
+                    default=None,
+                    metavar='NAME',
+                    help='Only reconcile this group, also if it has no rules anymore. Can be given multiple times'
+                )
+        parser.add_argument('--dry-run',
+                    action='store_true',
+                    default=False,
+                    help='Only print the number of memberships to add and to remove'
+                )
+
+    def handle(self, *args, **options):
+        group_ids = None
+        if options['group'] is not None:
+            groups = dict(Group.objects.filter(name__in=options['group']).values_list('name', 'id'))
+            for name in options['group']:
+                if name not in groups:
+                    self.stderr.write("Error: group not found: " + name)
+                    exit(1)
+            group_ids = groups.values()
+
+        start = time.time()
+        added, removed = grouprules.reconcile(group_ids, dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write("Would add " + str(added) + " and remove " + str(removed) + " memberships.")
+        else:
+            self.stdout.write("Added " + str(added) + " and removed " + str(removed) + " memberships.")
+        self.stdout.write("Took %.2f seconds." % (time.time() - start))
@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.test import RequestFactory
+from keymgmt.authkeys import authorized_keys_cache
+from keymgmt.benchmark import synthetic_fleet, report, timed
+from keymgmt.models import EffectiveAccess, Host, SSHKey, SSHKeyring
+from keymgmt.resolver import AccountResolver, KeyReach
+from keymgmt.views import api_authorized_keys
+import random
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API against a synthetic fleet. All data is rolled back at the end.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--authorized-keys',
+                    action='store_true',
+                    default=False,
+                    help='Benchmark api/authorized_keys/<host>/<account> with a cold and a warm cache'
+                )
+        parser.add_argument('--key-reach',
+                    action='store_true',
+                    default=False,
+                    help='Benchmark the hosts and accounts a key reaches against resolving all hosts'
+                )
+        parser.add_argument('--hosts',
+                    type=int,
+                    default=1000,
+                    help='Number of hosts of the synthetic fleet (default: 1000)'
+                )
+        parser.add_argument('--requests',
+                    type=int,
+                    default=1000,
+                    help='Number of requests per round (default: 1000)'
+                )
+
+    def authorized_keys(self, options):
+        factory = RequestFactory()
+        data = {'API_KEY': settings.API_KEYS[0]}
+
+        pairs = list(EffectiveAccess.objects.values_list('host__name', 'account_name').distinct())
+        pairs = [random.choice(pairs) for i in range(options['requests'])]
+        requests = [(factory.post('/api/authorized_keys/', data), host, account) for host, account in pairs]
+
+        def run(title):
+            report(title, [timed(api_authorized_keys, *request) for request in requests])
+
+        authorized_keys_cache.clear()
+        run('authorized_keys cold')
+        run('authorized_keys warm')
+
+        keyring = SSHKeyring.objects.filter(name__startswith='Bench Ring').first()
+        keyring.keys.remove(keyring.keys.first())
+        run('authorized_keys invalidated')
+        print(authorized_keys_cache.stats())
+
+    def key_reach(self, options):
+        keys = list(SSHKey.objects.filter(name__startswith='Bench Key'))
+        keys = [random.choice(keys) for i in range(min(options['requests'], 100))]
+        report('key reach', [timed(lambda key: KeyReach([key]).reach(key), key) for key in keys])
+
+        def all_hosts(key):
+            reach = []
+            for host, accounts in AccountResolver(Host.objects.all()).all():
+                for name, account_keys in accounts.items():
+                    if key in account_keys:
+                        reach.append((host.name, name))
+            return reach
+        report('key reach via all hosts', [timed(all_hosts, keys[0])])
+
+    def handle(self, *args, **options):
+        if options['authorized_keys'] is False and options['key_reach'] is False:
+            print("Please see --help for more information")
+            exit(1)
+        print("Creating synthetic fleet with " + str(options['hosts']) + " hosts")
+        with synthetic_fleet(hosts=options['hosts']):
+            if options['authorized_keys']:
+                self.authorized_keys(options)
+            if options['key_reach']:
+                self.key_reach(options)
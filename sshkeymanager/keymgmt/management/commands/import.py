@@ -1,6 +1,11 @@
 from django.core.management.base import BaseCommand
 from keymgmt.importer import ImportSSHKey, ImportHost, ImportSSHAccountAvailable
+from keymgmt.effective import BATCH_SIZE
 import os
+import time
+
+# seconds between two progress lines of --host
+PROGRESS_INTERVAL = 5
 
 HELP_SSHKEY=[
     '  ==== Import SSH Keys ====',
@@ -11,7 +16,9 @@ HELP_SSHKEY=[
     'jonas_genannt.pub will get as name: Jonas Genannt',
     'example:',
     '  ./manage.py import --sshkey /tmp/all_keys',
-    '  ./manage.py import --sshkey /home/hggh/.ssh/id_rsa.pub'
+    '  ./manage.py import --sshkey /home/hggh/.ssh/id_rsa.pub',
+    'The files are read by --workers threads and written in batches of --batch-size:',
+    '  ./manage.py import --sshkey /tmp/ldap_export --workers 8'
 ]
 
 
@@ -29,7 +36,11 @@ HELP_HOST=[
     'hostname,,ip',
     'hostname',
     'hostname,env',
-    'hostname,env,ip'    
+    'hostname,env,ip',
+    '',
+    'Use - as filename to read from stdin, files ending with .gz are decompressed:',
+    '  zcat hosts.csv.gz | ./manage.py import --host -',
+    '  ./manage.py import --host hosts.csv.gz --summary'
 ]
 
 HELP_SSHACCOUNTAVAILABLE=[
@@ -55,6 +66,21 @@ class Command(BaseCommand):
                     default=False,
                     help='Import Hosts. For more information use ./manage.py --host help',
                 )
+        parser.add_argument('--workers',
+                    type=int,
+                    default=4,
+                    help='Threads reading and validating the key files of --sshkey, default: 4'
+                )
+        parser.add_argument('--batch-size',
+                    type=int,
+                    default=BATCH_SIZE,
+                    help='Hosts or SSH Keys written per batch by --host and --sshkey, default: %d' % BATCH_SIZE
+                )
+        parser.add_argument('--summary',
+                    action='store_true',
+                    default=False,
+                    help='Print only the number of imported hosts for --host, not every name'
+                )
         parser.add_argument('--sshaccountavailable',
                     nargs='+',
                     default=False,
@@ -92,7 +118,9 @@ class Command(BaseCommand):
             print ("\n".join(HELP_SSHKEY))
             exit(1)
         importer = ImportSSHKey(options['sshkey'])
-        importer.add_keys_to_db()
+        start = time.time()
+        importer.add_keys_to_db(workers=options['workers'], batch_size=options['batch_size'])
+        seconds = time.time() - start
             
         if len(importer.sshkeys_added_errors) > 0:
             print("Import Error with keys:")
@@ -103,32 +131,52 @@ class Command(BaseCommand):
             print("Already present in the database:")
             for key in importer.sshkeys_added_already:
                 print("    " + key)
+
+        if len(importer.sshkeys_duplicates) > 0:
+            print("Key material already present in the database:")
+            for key in importer.sshkeys_duplicates:
+                print("    " + key)
             
         if len(importer.sshkeys_added) > 0:
             print("new keys added to the database:")
             for key in importer.sshkeys_added:
                 print("    " + key)
 
+        print("%d key files in %.1f seconds, %d files/s" % (
+            len(importer.sshkeys), seconds, len(importer.sshkeys) / max(seconds, 0.001)))
+
 
     def host(self, options):
         if options['host'] == 'help':
             print("\n".join(HELP_HOST))
             exit(1)
-        if os.path.isfile(options['host']) and os.access(options['host'], os.R_OK):
+        if options['host'] == '-' or (os.path.isfile(options['host']) and os.access(options['host'], os.R_OK)):
             print("==== Starting import of hosts from: ", options['host'])
-            importer = ImportHost(options['host'])
-            importer.read_file()
-            importer.import_host()
-            #print(importer.content)
-            print("Import Host OK:")
-            for key in importer.import_ok:
-                print("   ", key)
-            print("Import Host Errors:")
-            for key in importer.import_errors:
-                print("   ", key)
-            print("Already available at database:")
-            for key in importer.import_already:
-                print("   ", key)
+            importer = ImportHost(options['host'], keep_names=not options['summary'])
+            start = time.time()
+            last = [start]
+
+            def progress(rows):
+                now = time.time()
+                if now - last[0] >= PROGRESS_INTERVAL:
+                    last[0] = now
+                    print("    %d rows, %d rows/s" % (rows, rows / (now - start)))
+
+            importer.import_stream(importer.read_lines(), batch_size=options['batch_size'], progress=progress)
+            rows = sum(importer.counts.values())
+            print("%d rows in %.1f seconds" % (rows, time.time() - start))
+            if not options['summary']:
+                print("Import Host OK:")
+                for key in importer.import_ok:
+                    print("   ", key)
+                print("Import Host Errors:")
+                for key in importer.import_errors:
+                    print("   ", key)
+                print("Already available at database:")
+                for key in importer.import_already:
+                    print("   ", key)
+            print("Import Host OK: %d, Errors: %d, Already available at database: %d" % (
+                importer.counts['ok'], importer.counts['errors'], importer.counts['already']))
         else:
             print("The filename " , options['host'], " is not available or not readable")
             exit(1)
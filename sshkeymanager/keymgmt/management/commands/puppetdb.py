@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from keymgmt import grouprules
 from keymgmt.importer import ImportPuppetdb
 from keymgmt.models import Host, Environment, SSHAccountAvailable
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
@@ -16,8 +17,8 @@ class Command(BaseCommand):
         print("Connecting to: " + importer._url() )
         print("Import Nodes:")
         print("============================")
-        nodes = importer.nodes()
-        for node in nodes:
+        changed = []
+        for node in importer.iter_nodes():
             try:
                 env = Environment.objects.get(name=node['env'])
             except ObjectDoesNotExist:
@@ -33,7 +34,6 @@ class Command(BaseCommand):
             try:
                 host = Host.objects.get(name=node['name'])
                 print("Info: Host " + node['name'] +  " already at database")
-                next
             except ObjectDoesNotExist:
                 host = Host(name=node['name'], environment=env, ipaddress=node['ip'])
                 try:
@@ -43,6 +43,14 @@ class Command(BaseCommand):
                     print("Info: Host " + node['name'] +  " saved into database")
                 except ValidationError:
                     print("Error: Host " + node['name'] +  " could not saved to database")
+                    continue
+            if host.set_labels(node['labels']):
+                changed.append(host.id)
+
+        if len(changed) > 0:
+            added, removed = grouprules.reconcile_labels(changed)
+            print("Info: labels of " + str(len(changed)) + " hosts changed, added " + str(added) +
+                  " and removed " + str(removed) + " group memberships")
 
         print("Import SSHAccountAvailable:")
         print("============================")
@@ -61,4 +69,10 @@ class Command(BaseCommand):
                     print("Info: Account " + user + " saved into database")
                 except ValidationError:
                     print("Error: Account "+ user + " could not saved to database")
-                    
\ No newline at end of file
+                    
+
+        print("PuppetDB requests:")
+        print("============================")
+        for query, timing in importer.timings.items():
+            print("Info: %s: %d requests, %d rows, %.2f seconds" % (
+                query, timing['requests'], timing['rows'], timing['seconds']))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from keymgmt import effective
+from keymgmt.models import Host
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the EffectiveAccess table or check it against Host.get_account_merged()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check',
+                    action='store_true',
+                    default=False,
+                    help='Only compare the EffectiveAccess table with the merged accounts of every host'
+                )
+        parser.add_argument('--prune-changes',
+                    type=int,
+                    default=None,
+                    metavar='REVISIONS',
+                    help='Only remove the host change log except for the last REVISIONS revisions'
+                )
+
+    def check(self):
+        differ = effective.check_consistency(Host.objects.all())
+        if len(differ) > 0:
+            print("EffectiveAccess differs for hosts:")
+            for name in differ:
+                print("   " + name)
+            exit(1)
+        print("EffectiveAccess is consistent.")
+
+    def handle(self, *args, **options):
+        if options['check']:
+            self.check()
+        elif options['prune_changes'] is not None:
+            effective.prune_changes(options['prune_changes'])
+            print("Host change log pruned.")
+        else:
+            count = effective.rebuild()
+            print("EffectiveAccess rebuilt for " + str(count) + " hosts.")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from keymgmt.models import SSHKey
+from keymgmt.validators import sshkey_fingerprint
+
+
+class Command(BaseCommand):
+    help = 'List SSH keys without fingerprint: keys with the same key material as another key and invalid keys'
+
+    def handle(self, *args, **options):
+        names = dict(SSHKey.objects.exclude(fingerprint=None).values_list('fingerprint', 'name'))
+        duplicates = {}
+        invalid = []
+        for name, sshkey in SSHKey.objects.filter(fingerprint=None).order_by('id').values_list('name', 'sshkey'):
+            try:
+                fingerprint = sshkey_fingerprint(sshkey)
+            except ValueError:
+                invalid.append(name)
+                continue
+            duplicates.setdefault(fingerprint, []).append(name)
+
+        if len(duplicates) == 0 and len(invalid) == 0:
+            print("No duplicate SSH keys found.")
+            return
+
+        for fingerprint, keys in sorted(duplicates.items()):
+            print(fingerprint + ":")
+            if fingerprint in names:
+                print("    " + names[fingerprint] + " (has the fingerprint)")
+            for name in keys:
+                print("    " + name)
+        if len(invalid) > 0:
+            print("Keys with invalid key material:")
+            for name in invalid:
+                print("    " + name)
+        exit(1)
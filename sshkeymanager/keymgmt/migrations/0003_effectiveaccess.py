@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from django.db import models, migrations
+
+
+def ordered_links(through, owner, target, rank):
+    """ ids of target per owner id from a through model, in the order of rank """
+    links = {}
+    for owner_id, target_id in through.objects.values_list(owner, target):
+        links.setdefault(owner_id, []).append(target_id)
+    for ids in links.values():
+        ids.sort(key=lambda target_id: rank[target_id])
+    return links
+
+
+def fill_effective_access(apps, schema_editor):
+    """
+    the merged accounts of every host as in Host.get_account_merged(),
+    computed in memory from the historical models. The models of
+    keymgmt.effective can not be used, they belong to the latest schema.
+    """
+    Host = apps.get_model('keymgmt', 'Host')
+    Group = apps.get_model('keymgmt', 'Group')
+    SSHKey = apps.get_model('keymgmt', 'SSHKey')
+    SSHKeyring = apps.get_model('keymgmt', 'SSHKeyring')
+    SSHAccount = apps.get_model('keymgmt', 'SSHAccount')
+    EffectiveAccess = apps.get_model('keymgmt', 'EffectiveAccess')
+
+    key_rank = dict((key_id, i) for i, key_id in enumerate(
+        SSHKey.objects.order_by('name', 'id').values_list('id', flat=True)))
+    ring_rank = dict((ring_id, i) for i, ring_id in enumerate(
+        SSHKeyring.objects.order_by('name', 'id').values_list('id', flat=True)))
+    group_rank = dict((group_id, i) for i, group_id in enumerate(
+        Group.objects.order_by('name', 'id').values_list('id', flat=True)))
+
+    account_keys = ordered_links(SSHAccount.keys.through, 'sshaccount_id', 'sshkey_id', key_rank)
+    account_rings = ordered_links(SSHAccount.keyrings.through, 'sshaccount_id', 'sshkeyring_id', ring_rank)
+    ring_keys = ordered_links(SSHKeyring.keys.through, 'sshkeyring_id', 'sshkey_id', key_rank)
+    host_groups = ordered_links(Group.hosts.through, 'host_id', 'group_id', group_rank)
+
+    accounts = {}
+    for account_id, name, obj_name, obj_id in SSHAccount.objects.order_by('name', 'id').values_list(
+            'id', 'name', 'obj_name', 'obj_id'):
+        keys = list(account_keys.get(account_id, []))
+        for ring_id in account_rings.get(account_id, []):
+            keys.extend(ring_keys.get(ring_id, []))
+        accounts.setdefault((obj_name, obj_id), []).append((name, keys))
+
+    rows = []
+    for host_id, environment_id in Host.objects.values_list('id', 'environment_id'):
+        sources = accounts.get(('host', host_id), []) + accounts.get(('environment', environment_id), [])
+        for group_id in host_groups.get(host_id, []):
+            sources += accounts.get(('group', group_id), [])
+        merged = OrderedDict()
+        for name, keys in sources:
+            merged.setdefault(name, []).extend(keys)
+        for name, keys in merged.items():
+            keys = list(OrderedDict.fromkeys(keys))
+            if len(keys) == 0:
+                rows.append(EffectiveAccess(host_id=host_id, account_name=name, sshkey_id=None, position=0))
+            for position, key_id in enumerate(keys):
+                rows.append(EffectiveAccess(host_id=host_id, account_name=name, sshkey_id=key_id, position=position))
+    EffectiveAccess.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0002_auto_20150501_1914'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectiveAccess',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('account_name', models.CharField(verbose_name='SSH Account Name', max_length=100)),
+                ('position', models.IntegerField(verbose_name='Position', default=0)),
+                ('host', models.ForeignKey(to='keymgmt.Host')),
+                ('sshkey', models.ForeignKey(blank=True, null=True, to='keymgmt.SSHKey')),
+            ],
+            options={
+                'ordering': ['host', 'account_name', 'position'],
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='effectiveaccess',
+            index_together=set([('host', 'account_name', 'position')]),
+        ),
+        migrations.RunPython(fill_effective_access, migrations.RunPython.noop),
+    ]
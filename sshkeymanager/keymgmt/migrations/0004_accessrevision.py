@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def create_revision(apps, schema_editor):
+    AccessRevision = apps.get_model('keymgmt', 'AccessRevision')
+    AccessRevision.objects.create(pk=1, revision=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0003_effectiveaccess'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessRevision',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('revision', models.IntegerField(verbose_name='Revision', default=0)),
+            ],
+        ),
+        migrations.RunPython(create_revision, migrations.RunPython.noop),
+    ]
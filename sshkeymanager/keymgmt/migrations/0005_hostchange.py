@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0004_accessrevision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostChange',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('host_name', models.CharField(verbose_name='Host Name', max_length=155)),
+                ('revision', models.IntegerField(verbose_name='Revision', db_index=True)),
+                ('removed', models.BooleanField(verbose_name='removed', default=False)),
+            ],
+            options={
+                'ordering': ['revision', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='accessrevision',
+            name='baseline',
+            field=models.IntegerField(verbose_name='Baseline', default=0),
+        ),
+    ]
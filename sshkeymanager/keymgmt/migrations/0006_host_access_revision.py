@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def set_access_revision(apps, schema_editor):
+    """ the EffectiveAccess rows of all hosts belong to the current revision """
+    AccessRevision = apps.get_model('keymgmt', 'AccessRevision')
+    Host = apps.get_model('keymgmt', 'Host')
+    revision = AccessRevision.objects.get(pk=1).revision
+    Host.objects.update(access_revision=revision)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0005_hostchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='host',
+            name='access_revision',
+            field=models.IntegerField(verbose_name='Access Revision', default=0, editable=False),
+        ),
+        migrations.RunPython(set_access_revision, migrations.RunPython.noop),
+    ]
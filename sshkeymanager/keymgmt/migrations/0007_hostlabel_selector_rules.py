@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0006_host_access_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostLabel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('key', models.CharField(verbose_name='Key', max_length=64, validators=[django.core.validators.RegexValidator(regex='^[0-9A-Za-z_./-]+$', message='Label key is not valid.')])),
+                ('value', models.CharField(verbose_name='Value', max_length=255, blank=True)),
+                ('host', models.ForeignKey(to='keymgmt.Host')),
+            ],
+            options={
+                'ordering': ['key'],
+            },
+        ),
+        migrations.AddField(
+            model_name='grouprule',
+            name='rule_type',
+            field=models.CharField(verbose_name='Rule Type', max_length=16, default='regex', choices=[('regex', 'regular expression on the host name'), ('selector', 'selector on the host labels')]),
+        ),
+        migrations.AlterField(
+            model_name='grouprule',
+            name='rule',
+            field=models.CharField(verbose_name='Group Rule', max_length=255),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hostlabel',
+            unique_together=set([('host', 'key')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='hostlabel',
+            index_together=set([('key', 'value')]),
+        ),
+    ]
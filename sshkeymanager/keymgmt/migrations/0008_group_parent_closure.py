@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+def create_closure(apps, schema_editor):
+    """ existing groups have no parent, only their own row """
+    Group = apps.get_model('keymgmt', 'Group')
+    GroupClosure = apps.get_model('keymgmt', 'GroupClosure')
+    GroupClosure.objects.bulk_create(
+        [GroupClosure(ancestor_id=group_id, descendant_id=group_id, depth=0)
+         for group_id in Group.objects.values_list('id', flat=True)],
+        batch_size=500
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0007_hostlabel_selector_rules'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('depth', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='parent',
+            field=models.ForeignKey(verbose_name='Parent Group', blank=True, null=True, related_name='children', on_delete=django.db.models.deletion.SET_NULL, to='keymgmt.Group'),
+        ),
+        migrations.AddField(
+            model_name='groupclosure',
+            name='ancestor',
+            field=models.ForeignKey(related_name='descendant_links', to='keymgmt.Group'),
+        ),
+        migrations.AddField(
+            model_name='groupclosure',
+            name='descendant',
+            field=models.ForeignKey(related_name='ancestor_links', to='keymgmt.Group'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='groupclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='groupclosure',
+            index_together=set([('descendant', 'ancestor')]),
+        ),
+        migrations.RunPython(create_closure, migrations.RunPython.noop),
+    ]
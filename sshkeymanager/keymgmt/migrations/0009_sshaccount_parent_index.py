@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0008_group_parent_closure'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='sshaccount',
+            index_together=set([('obj_name', 'obj_id')]),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from keymgmt.validators import sshkey_fingerprint
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """
+    fingerprint of every key in batches. Of keys with the same material
+    only the oldest one gets the fingerprint, ./manage.py sshkey_duplicates
+    lists the others.
+    """
+    SSHKey = apps.get_model('keymgmt', 'SSHKey')
+    seen = set()
+    after = 0
+    while True:
+        batch = list(SSHKey.objects.filter(id__gt=after).order_by('id').values_list('id', 'sshkey')[:500])
+        if len(batch) == 0:
+            break
+        after = batch[-1][0]
+        for key_id, sshkey in batch:
+            try:
+                fingerprint = sshkey_fingerprint(sshkey)
+            except ValueError:
+                continue
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+            SSHKey.objects.filter(id=key_id).update(fingerprint=fingerprint)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0009_sshaccount_parent_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sshkey',
+            name='fingerprint',
+            field=models.CharField(verbose_name='Fingerprint', max_length=64, null=True, editable=False),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='sshkey',
+            name='fingerprint',
+            field=models.CharField(verbose_name='Fingerprint', max_length=64, unique=True, null=True, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0010_sshkey_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='effectiveaccess',
+            index_together=set([('host', 'account_name', 'position'), ('account_name', 'host')]),
+        ),
+    ]
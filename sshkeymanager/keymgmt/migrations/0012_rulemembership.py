@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import models, migrations
+
+from keymgmt.selector import parse_selector
+
+
+def record_rule_memberships(apps, schema_editor):
+    """
+    memberships of groups with rules whose host matches one of the rules
+    were added by the rules, as far as anybody can tell
+    """
+    GroupRule = apps.get_model('keymgmt', 'GroupRule')
+    Group = apps.get_model('keymgmt', 'Group')
+    Host = apps.get_model('keymgmt', 'Host')
+    HostLabel = apps.get_model('keymgmt', 'HostLabel')
+    RuleMembership = apps.get_model('keymgmt', 'RuleMembership')
+    through = Group.hosts.through
+
+    pairs = set()
+    for rule, group_id, rule_type in GroupRule.objects.values_list('rule', 'group_id', 'rule_type'):
+        members = through.objects.filter(group_id=group_id)
+        if rule_type == 'selector':
+            hosts = Host.objects.all()
+            for key, operator, values in parse_selector(rule):
+                labels = HostLabel.objects.filter(key=key)
+                if operator in ('in', 'notin'):
+                    labels = labels.filter(value__in=values)
+                if operator in ('in', 'exists'):
+                    hosts = hosts.filter(id__in=labels.values('host_id'))
+                else:
+                    hosts = hosts.exclude(id__in=labels.values('host_id'))
+            host_ids = members.filter(host__in=hosts).values_list('host_id', flat=True)
+        else:
+            pattern = re.compile(rule)
+            host_ids = [host_id for host_id, name in members.values_list('host_id', 'host__name')
+                        if pattern.search(name)]
+        pairs.update((group_id, host_id) for host_id in host_ids)
+
+    RuleMembership.objects.bulk_create(
+        [RuleMembership(group_id=group_id, host_id=host_id) for group_id, host_id in pairs],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('keymgmt', '0011_effectiveaccess_account_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleMembership',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('group', models.ForeignKey(to='keymgmt.Group')),
+                ('host', models.ForeignKey(to='keymgmt.Host')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rulemembership',
+            unique_together=set([('group', 'host')]),
+        ),
+        migrations.RunPython(record_rule_memberships, migrations.RunPython.noop),
+    ]
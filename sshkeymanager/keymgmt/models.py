@@ -1,14 +1,18 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import F, Count, Max
+from django.db.models.signals import m2m_changed
 from django.apps import apps
 import re
+import threading
 from collections import OrderedDict
 import itertools
 
 from django.utils.translation import ugettext as _
 from model_utils.fields import AutoCreatedField, AutoLastModifiedField
-from keymgmt.validators import validate_sshkey, validate_regex
+from keymgmt.validators import validate_sshkey, validate_regex, sshkey_fingerprint
+from keymgmt.selector import parse_selector
 from django.core.validators import MinLengthValidator, MaxLengthValidator, validate_slug, RegexValidator
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.exceptions import ValidationError
 
 
 class DeleteNotAllowed(Exception):
@@ -119,6 +123,8 @@ class Host(models.Model):
     environment = models.ForeignKey(Environment)
     created = AutoCreatedField(_('created'))
     updated = AutoLastModifiedField(_('updated'))
+    # AccessRevision of the last EffectiveAccess refresh, versions the access cache
+    access_revision = models.IntegerField(_('Access Revision'), default=0, editable=False)
 
     def get_account_merged(self):
         """
@@ -136,7 +142,7 @@ class Host(models.Model):
                 accounts[acc.name] = []
             accounts[acc.name].append(acc.get_all_keys())
 
-        for group in self.group_set.all():
+        for group in self.get_groups():
             for acc in group.get_accounts():
                 if acc.name not in accounts:
                     accounts[acc.name] = []
@@ -159,14 +165,33 @@ class Host(models.Model):
     def save(self, force_insert=False, force_update=False, using=None):
         """ override default save to check if host.name matches a groupRule and add it to Group """
         super(Host, self).save(force_insert=force_insert, force_update=force_update, using=using)
-        rules = GroupRule.objects.all()
-        for rule in rules:
-            if rule.rule_match_host(self.name):
-                rule.group.hosts.add(self)
+        GroupRule.apply_to_hosts([self])
+
+    def get_groups(self):
+        """ groups of the host and all their parent groups, as one query """
+        return Group.objects.filter(descendant_links__descendant__hosts=self).distinct()
 
     def get_accounts(self):
         return SSHAccount.host_objects.filter(obj_id=self.id)
 
+    def set_labels(self, labels):
+        """
+        replace the labels of the host with the dict labels,
+        returns True if a label changed
+        """
+        current = dict(self.hostlabel_set.values_list('key', 'value'))
+        if current == labels:
+            return False
+        with transaction.atomic():
+            self.hostlabel_set.filter(key__in=[key for key in current.keys() if key not in labels]).delete()
+            for key, value in labels.items():
+                if key in current and current[key] != value:
+                    self.hostlabel_set.filter(key=key).update(value=value)
+            HostLabel.objects.bulk_create(
+                [HostLabel(host=self, key=key, value=value) for key, value in labels.items() if key not in current]
+            )
+        return True
+
     def clean(self):
         self.name = self.name.strip()
         if self.ipaddress:
@@ -180,6 +205,43 @@ class Host(models.Model):
         super(Host, self).delete(using=using)
 
 
+class HostLabel(models.Model):
+    """
+    HostLabel model.
+    key/value label of a host like role=db or dc=fra1, e.g. imported
+    from PuppetDB facts. Selector GroupRules match hosts by their labels.
+    """
+    host = models.ForeignKey(Host)
+    key = models.CharField(_('Key'), null=False, max_length=64, blank=False,
+                           validators=[RegexValidator(regex='^[0-9A-Za-z_./-]+$', message=_('Label key is not valid.'))])
+    value = models.CharField(_('Value'), null=False, max_length=255, blank=True)
+
+    class Meta:
+        ordering = ['key']
+        unique_together = (('host', 'key'),)
+        index_together = [['key', 'value']]
+
+    def __str__(self):
+        return self.key + '=' + self.value
+
+    def select(selector, hosts=None):
+        """
+        hosts matching a label selector like "role=db,dc in (fra1,ams2)",
+        as one query with a subquery per requirement
+        """
+        if hosts is None:
+            hosts = Host.objects.all()
+        for key, operator, values in parse_selector(selector):
+            labels = HostLabel.objects.filter(key=key)
+            if operator in ('in', 'notin'):
+                labels = labels.filter(value__in=values)
+            if operator in ('in', 'exists'):
+                hosts = hosts.filter(id__in=labels.values('host_id'))
+            else:
+                hosts = hosts.exclude(id__in=labels.values('host_id'))
+        return hosts
+
+
 class Group(models.Model):
     """
     Group model.
@@ -193,6 +255,9 @@ class Group(models.Model):
     created = AutoCreatedField(_('created'))
     updated = AutoLastModifiedField(_('updated'))
     hosts = models.ManyToManyField(Host)
+    # accounts of the parent group apply to the hosts of this group too
+    parent = models.ForeignKey('self', verbose_name=_('Parent Group'), null=True, blank=True,
+                               related_name='children', on_delete=models.SET_NULL)
 
     class Meta:
         ordering = ['name']
@@ -203,38 +268,353 @@ class Group(models.Model):
 
     def clean(self):
         self.name = self.name.strip()
+        if self.parent_id is not None and self.pk is not None:
+            if GroupClosure.objects.filter(ancestor=self, descendant_id=self.parent_id).exists():
+                raise ValidationError({'parent': _('A group can not be a child of itself or its subgroups.')})
 
     def __str__(self):
         return self.name
 
+    def save(self, force_insert=False, force_update=False, using=None):
+        """ keep the GroupClosure in sync with parent, before the hosts are refreshed on post_save """
+        with transaction.atomic():
+            created = self.pk is None
+            if not created:
+                GroupClosure.move(self)
+            super(Group, self).save(force_insert=force_insert, force_update=force_update, using=using)
+            if created:
+                GroupClosure.insert(self)
+
     def get_accounts(self):
         return SSHAccount.group_objects.filter(obj_id=self.id)
 
+    def get_ancestors(self):
+        """ the parent groups up to the root, nearest first """
+        return Group.objects.filter(descendant_links__descendant=self, descendant_links__depth__gt=0).order_by(
+            'descendant_links__depth')
+
+    def get_hosts(self):
+        """ hosts of this group and all its subgroups, as one query """
+        return Host.objects.filter(group__ancestor_links__ancestor=self).distinct()
+
     def get_absolute_url(self):
         return reverse('group_detail', kwargs={'pk': self.pk})
 
-    def delete(self, using=None):
-        SSHAccount.objects.all().filter(obj_name='group').filter(obj_id=self.id).delete()
-        super(Group, self).delete(using=using)
+
+class GroupClosure(models.Model):
+    """
+    GroupClosure model.
+    transitive closure of Group.parent: a row for every group and each of
+    its ancestors with their distance, and the group itself with depth 0.
+    The groups affecting a host and the hosts affected by a group are
+    a single join on this table, whatever the depth of the tree.
+    """
+    ancestor = models.ForeignKey(Group, related_name='descendant_links')
+    descendant = models.ForeignKey(Group, related_name='ancestor_links')
+    depth = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('ancestor', 'descendant'),)
+        index_together = [['descendant', 'ancestor']]
+
+    def insert(group):
+        """ rows of a new group, below the ancestors of its parent """
+        rows = [GroupClosure(ancestor_id=group.id, descendant_id=group.id, depth=0)]
+        if group.parent_id is not None:
+            for ancestor_id, depth in GroupClosure.objects.filter(descendant_id=group.parent_id).values_list(
+                    'ancestor_id', 'depth'):
+                rows.append(GroupClosure(ancestor_id=ancestor_id, descendant_id=group.id, depth=depth + 1))
+        GroupClosure.objects.bulk_create(rows)
+
+    def move(group):
+        """
+        move the subtree of group below group.parent, if the parent changed:
+        the links from the subtree to its old ancestors are replaced by the
+        links to the ancestors of the new parent
+        """
+        current = list(GroupClosure.objects.filter(descendant=group, depth=1).values_list('ancestor_id', flat=True))
+        if current == ([] if group.parent_id is None else [group.parent_id]):
+            return
+        subtree = dict(GroupClosure.objects.filter(ancestor=group).values_list('descendant_id', 'depth'))
+        if group.parent_id in subtree:
+            raise ValueError('group ' + group.name + ' can not be moved below its own subtree')
+
+        GroupClosure.objects.filter(descendant__in=subtree.keys()).exclude(ancestor__in=subtree.keys()).delete()
+        if group.parent_id is None:
+            return
+        rows = []
+        for ancestor_id, depth in GroupClosure.objects.filter(descendant_id=group.parent_id).values_list(
+                'ancestor_id', 'depth'):
+            for descendant_id, subtree_depth in subtree.items():
+                rows.append(GroupClosure(ancestor_id=ancestor_id, descendant_id=descendant_id,
+                                         depth=depth + subtree_depth + 1))
+        GroupClosure.objects.bulk_create(rows)
+
+    def rebuild():
+        """ recompute the whole table from Group.parent """
+        parents = dict(Group.objects.values_list('id', 'parent_id'))
+        rows = []
+        for group_id in parents.keys():
+            ancestor_id = group_id
+            depth = 0
+            while ancestor_id is not None and depth <= len(parents):
+                rows.append(GroupClosure(ancestor_id=ancestor_id, descendant_id=group_id, depth=depth))
+                ancestor_id = parents[ancestor_id]
+                depth += 1
+        with transaction.atomic():
+            GroupClosure.objects.all().delete()
+            GroupClosure.objects.bulk_create(rows, batch_size=500)
+        return len(rows)
 
 
 class GroupRule(models.Model):
     """
     Group Rule model.
     """
-    rule = models.CharField(_('Group Rule'), null=False, max_length=32, blank=False, validators=[validate_regex])
+    RULE_TYPES = (
+        ('regex', _('regular expression on the host name')),
+        ('selector', _('selector on the host labels')),
+    )
+    rule = models.CharField(_('Group Rule'), null=False, max_length=255, blank=False)
+    rule_type = models.CharField(_('Rule Type'), null=False, max_length=16, choices=RULE_TYPES, default='regex')
     group = models.ForeignKey(Group)
     created = AutoCreatedField(_('created'))
     updated = AutoLastModifiedField(_('updated'))
 
+    def clean(self):
+        self.rule = self.rule.strip()
+        if self.rule_type == 'selector':
+            try:
+                parse_selector(self.rule)
+            except ValueError as e:
+                raise ValidationError({'rule': 'Selector not valid: ' + str(e)})
+        else:
+            try:
+                validate_regex(self.rule)
+            except ValidationError as e:
+                raise ValidationError({'rule': e.messages})
+
     def rule_match_host(self, hostname):
-        if re.search(r'%s' % self.rule, hostname):
+        if self.rule_type == 'selector':
+            return HostLabel.select(self.rule).filter(name=hostname).exists()
+        if RuleMatcher.compile(self.rule).search(hostname):
             return True
         return False
 
     def __str__(self):
         return self.rule
 
+    def matcher():
+        """
+        RuleMatcher of all rules, compiled again only after the rules changed
+        """
+        signature = GroupRule.objects.aggregate(Count('id'), Max('updated'))
+        signature = (signature['id__count'], signature['updated__max'])
+        with RuleMatcher.lock:
+            if RuleMatcher.cached is not None and RuleMatcher.cached[0] == signature:
+                return RuleMatcher.cached[1]
+        matcher = RuleMatcher.for_rules(GroupRule.objects.all())
+        with RuleMatcher.lock:
+            RuleMatcher.cached = (signature, matcher)
+            RuleMatcher.patterns = matcher.patterns
+        return matcher
+
+    def apply_to_hosts(hosts):
+        """
+        add the hosts to the groups of all matching rules. The new
+        memberships are written with one bulk insert and announced with
+        m2m_changed, once per host or once per group, whatever is less.
+        Returns the number of new memberships.
+        """
+        matcher = GroupRule.matcher()
+        if len(matcher.rules) == 0 and len(matcher.selectors) == 0:
+            return 0
+        wanted = set()
+        for host in hosts:
+            for group_id in matcher.groups_for(host.name):
+                wanted.add((group_id, host.pk))
+        if len(matcher.selectors) > 0:
+            host_ids = [host.pk for host in hosts]
+            for i in range(0, len(host_ids), 500):
+                wanted.update(matcher.selected(Host.objects.filter(id__in=host_ids[i:i + 500])))
+        if len(wanted) == 0:
+            return 0
+
+        through = Group.hosts.through
+        host_ids = list(set(host_id for group_id, host_id in wanted))
+        for i in range(0, len(host_ids), 500):
+            existing = through.objects.filter(host_id__in=host_ids[i:i + 500]).values_list('group_id', 'host_id')
+            wanted.difference_update(existing)
+        if len(wanted) == 0:
+            return 0
+
+        by_group = {}
+        by_host = {}
+        for group_id, host_id in wanted:
+            by_group.setdefault(group_id, set()).add(host_id)
+            by_host.setdefault(host_id, set()).add(group_id)
+        if len(by_host) <= len(by_group):
+            instances = dict((host.pk, host) for host in hosts)
+            changes = [(instances[host_id], True, Group, ids) for host_id, ids in by_host.items()]
+        else:
+            instances = Group.objects.in_bulk(list(by_group.keys()))
+            changes = [(instances[group_id], False, Host, ids) for group_id, ids in by_group.items()]
+
+        using = router.db_for_write(through)
+        with transaction.atomic(using=using):
+            for instance, reverse, model, pk_set in changes:
+                m2m_changed.send(sender=through, action='pre_add', instance=instance, reverse=reverse,
+                                 model=model, pk_set=pk_set, using=using)
+            through.objects.bulk_create(
+                [through(group_id=group_id, host_id=host_id) for group_id, host_id in wanted],
+                batch_size=500
+            )
+            RuleMembership.record(wanted)
+            for instance, reverse, model, pk_set in changes:
+                m2m_changed.send(sender=through, action='post_add', instance=instance, reverse=reverse,
+                                 model=model, pk_set=pk_set, using=using)
+        return len(wanted)
+
+
+class RuleMembership(models.Model):
+    """
+    RuleMembership model.
+    membership of a host in a group added by a GroupRule. Only these
+    memberships are removed again when no rule of the group matches the
+    host anymore, hosts added by hand stay in the group.
+    """
+    group = models.ForeignKey(Group)
+    host = models.ForeignKey(Host)
+
+    class Meta:
+        unique_together = (('group', 'host'),)
+
+    def record(pairs):
+        """ remember the (group id, host id) memberships added by rules """
+        RuleMembership.objects.bulk_create(
+            [RuleMembership(group_id=group_id, host_id=host_id) for group_id, host_id in pairs],
+            batch_size=500
+        )
+
+    def forget(pairs):
+        """ drop the (group id, host id) memberships, one query per group """
+        by_group = {}
+        for group_id, host_id in pairs:
+            by_group.setdefault(group_id, []).append(host_id)
+        for group_id, host_ids in by_group.items():
+            for i in range(0, len(host_ids), 500):
+                RuleMembership.objects.filter(group_id=group_id, host_id__in=host_ids[i:i + 500]).delete()
+
+
+class RuleMatcher:
+    """
+    All GroupRules compiled once. groups_for() finds the groups of a
+    host name in one pass over the rules, every pattern is evaluated
+    once even if several groups use it.
+
+    Rules anchored with ^ and a literal text like ^web or ^db[0-9] are
+    indexed by that text, they are only evaluated for host names
+    starting with it.
+
+    Selector rules are evaluated in the database by selected().
+
+    A matcher is built completely before GroupRule.matcher() publishes
+    it under the lock and never changed afterwards, so threads share it
+    without locking.
+    """
+    lock = threading.Lock()
+    cached = None
+    patterns = {}
+
+    def __init__(self, rules, selectors=()):
+        groups = OrderedDict()
+        for rule, group_id in rules:
+            groups.setdefault(rule, set()).add(group_id)
+        self.patterns = dict((rule, RuleMatcher.compile(rule)) for rule in groups.keys())
+        self.rules = [(self.patterns[rule], group_ids) for rule, group_ids in groups.items()]
+        self.selectors = OrderedDict()
+        for selector, group_id in selectors:
+            self.selectors.setdefault(selector, set()).add(group_id)
+
+        self.unindexed = []
+        self.indexed = {}
+        for pattern, group_ids in self.rules:
+            prefix = RuleMatcher.literal_prefix(pattern.pattern)
+            if prefix == '':
+                self.unindexed.append((pattern, group_ids))
+            else:
+                self.indexed.setdefault(prefix, []).append((pattern, group_ids))
+        self.prefix_lengths = sorted(set(len(prefix) for prefix in self.indexed.keys()))
+
+    def for_rules(rules):
+        """
+        RuleMatcher of a GroupRule queryset
+        """
+        regex = []
+        selectors = []
+        for rule, group_id, rule_type in rules.values_list('rule', 'group_id', 'rule_type'):
+            if rule_type == 'selector':
+                selectors.append((rule, group_id))
+            else:
+                regex.append((rule, group_id))
+        return RuleMatcher(regex, selectors)
+
+    def compile(rule):
+        """
+        compiled pattern of a rule. The patterns of the last published
+        matcher are reused, the cache of re is too small for thousands of
+        rules. The published patterns are never changed.
+        """
+        pattern = RuleMatcher.patterns.get(rule)
+        if pattern is None:
+            pattern = re.compile(rule)
+        return pattern
+
+    def literal_prefix(rule):
+        """
+        text every host name matching the rule starts with, '' if unknown
+        """
+        if not rule.startswith('^') or '|' in rule:
+            return ''
+        prefix = []
+        for char in rule[1:]:
+            if char in '.^$*+?{}[]\\|()':
+                if char in '*+?{' and len(prefix) > 0:
+                    prefix.pop()
+                break
+            prefix.append(char)
+        return ''.join(prefix)
+
+    def candidates(self, hostname):
+        for length in self.prefix_lengths:
+            if length > len(hostname):
+                break
+            for rule in self.indexed.get(hostname[:length], []):
+                yield rule
+        for rule in self.unindexed:
+            yield rule
+
+    def groups_for(self, hostname):
+        groups = set()
+        for pattern, group_ids in self.candidates(hostname):
+            if group_ids <= groups:
+                continue
+            if pattern.search(hostname):
+                groups |= group_ids
+        return groups
+
+    def selected(self, hosts=None):
+        """
+        (group id, host id) tuples of all hosts matching a selector rule,
+        with one query per selector. hosts limits them to a Host queryset.
+        """
+        pairs = set()
+        for selector, group_ids in self.selectors.items():
+            for host_id in HostLabel.select(selector, hosts).values_list('id', flat=True):
+                for group_id in group_ids:
+                    pairs.add((group_id, host_id))
+        return pairs
+
 
 class SSHKey(models.Model):
     """
@@ -247,6 +627,8 @@ class SSHKey(models.Model):
                                         RegexValidator(regex='^[0-9A-Za-z\s_.-]+$', message=_('Only A-Za-z0-9\s_-. are allowed!'))
                                     ])
     sshkey = models.TextField(_('SSH Key'), null=False, validators=[validate_sshkey])
+    # SHA256 of the key material, one key per material
+    fingerprint = models.CharField(_('Fingerprint'), unique=True, null=True, max_length=64, editable=False)
     created = AutoCreatedField(_('created'))
     updated = AutoLastModifiedField(_('updated'))
 
@@ -257,9 +639,40 @@ class SSHKey(models.Model):
         self.name = self.name.strip()
         if self.sshkey:
             self.sshkey = self.sshkey.strip().rstrip()
+            try:
+                self.fingerprint = sshkey_fingerprint(self.sshkey)
+            except ValueError as e:
+                raise ValidationError({'sshkey': str(e)})
+
+    def validate_unique(self, exclude=None):
+        """
+        the fingerprint is not editable, so forms exclude it from the unique
+        checks. A key with the same material is reported on the sshkey field.
+        """
+        super(SSHKey, self).validate_unique(exclude=exclude)
+        if self.fingerprint is None:
+            return
+        names = SSHKey.objects.filter(fingerprint=self.fingerprint).exclude(pk=self.pk).values_list('name', flat=True)
+        if len(names) > 0:
+            raise ValidationError({'sshkey': _('Key material already used by SSH Key ') + names[0]})
+
+    def save(self, force_insert=False, force_update=False, using=None):
+        """ the fingerprint always belongs to the stored key material """
+        try:
+            self.fingerprint = sshkey_fingerprint(self.sshkey)
+        except ValueError:
+            self.fingerprint = None
+        super(SSHKey, self).save(force_insert=force_insert, force_update=force_update, using=using)
 
     def ssh_key_entry(self):
-        return self.sshkey + " " + self.name
+        return SSHKey.key_entry(self.sshkey, self.name)
+
+    def key_entry(sshkey, name):
+        """
+        authorized_keys line for the raw key and its name, used where
+        only the column values are loaded instead of the SSHKey object.
+        """
+        return sshkey + " " + name
 
     def __str__(self):
         return self.name
@@ -288,6 +701,27 @@ class SSHKey(models.Model):
         return name.title()
 
 
+def set_by_names(related, model, names):
+    """
+    set the objects of a many-to-many manager to the objects of model named
+    in the comma separated string names. Only the difference to the current
+    objects is removed and added, in one transaction.
+    Returns the sorted list of names without an object.
+    """
+    names = set(name.strip() for name in names.split(',')) - set([''])
+    found = dict(model.objects.filter(name__in=names).order_by().values_list('name', 'id'))
+    with transaction.atomic():
+        existing = set(related.order_by().values_list('id', flat=True))
+        wanted = set(found.values())
+        removed = existing - wanted
+        if removed:
+            related.remove(*removed)
+        added = wanted - existing
+        if added:
+            related.add(*added)
+    return sorted(names - set(found.keys()))
+
+
 class SSHKeyring(models.Model):
     """
     SSH Keyring model.
@@ -306,14 +740,8 @@ class SSHKeyring(models.Model):
         ordering = ['name']
 
     def add_keys(self, sshkeys):
-        for key in self.keys.all():
-            self.keys.remove(key)
-        for key in sshkeys.split(','):
-            try:
-                sshkey = SSHKey.objects.get(name=key)
-                self.keys.add(sshkey)
-            except ObjectDoesNotExist:
-                pass
+        """ set the keys to the comma separated key names, returns the unknown names """
+        return set_by_names(self.keys, SSHKey, sshkeys)
 
     def clean(self):
         self.name = self.name.strip()
@@ -358,6 +786,8 @@ class SSHAccount(models.Model):
 
     class Meta:
         unique_together = ('name', 'obj_name', 'obj_id')
+        # the unique index starts with name, lookups by parent need their own
+        index_together = [['obj_name', 'obj_id']]
         ordering = ['name']
 
     def clean(self):
@@ -393,27 +823,96 @@ class SSHAccount(models.Model):
         return list(OrderedDict.fromkeys(keys_merged))
 
     def get_object(self):
+        if getattr(self, '_object', None) is not None:
+            return self._object
         klass = apps.get_model(app_label='keymgmt', model_name=self.obj_name.capitalize())
-        return klass.objects.get(pk=self.obj_id)
+        self._object = klass.objects.get(pk=self.obj_id)
+        return self._object
 
-    def update_keyrings(self, sshkeyrings):
-        for ring in self.keyrings.all():
-            self.keyrings.remove(ring)
+    def with_objects(accounts):
+        """
+        the accounts as list with their parent objects loaded for
+        get_object(), one query per parent type instead of one per account
+        """
+        accounts = list(accounts)
+        obj_ids = {}
+        for account in accounts:
+            obj_ids.setdefault(account.obj_name, set()).add(account.obj_id)
+        objects = {}
+        for obj_name, ids in obj_ids.items():
+            klass = apps.get_model(app_label='keymgmt', model_name=obj_name.capitalize())
+            objects[obj_name] = klass.objects.in_bulk(list(ids))
+        for account in accounts:
+            account._object = objects[account.obj_name].get(account.obj_id)
+        return accounts
 
-        for ring in sshkeyrings.split(','):
-            try:
-                sshkeyring = SSHKeyring.objects.get(name=ring)
-                self.keyrings.add(sshkeyring)
-            except ObjectDoesNotExist:
-                pass
+    def update_keyrings(self, sshkeyrings):
+        """ set the keyrings to the comma separated keyring names, returns the unknown names """
+        return set_by_names(self.keyrings, SSHKeyring, sshkeyrings)
 
     def update_keys(self, keys):
-        for key in self.keys.all():
-            self.keys.remove(key)
+        """ set the keys to the comma separated key names, returns the unknown names """
+        return set_by_names(self.keys, SSHKey, keys)
 
-        for key in keys.split(','):
-            try:
-                sshkey = SSHKey.objects.get(name=key)
-                self.keys.add(sshkey)
-            except ObjectDoesNotExist:
-                pass
+
+
+class EffectiveAccess(models.Model):
+    """
+    EffectiveAccess model.
+    Materialized result of Host.get_account_merged(): one row for each key
+    of an account on a host, position is the index of the key inside the
+    merged list. Accounts without any key are stored as one row without sshkey.
+    The rows are kept up to date by the handlers in keymgmt.signals and
+    can be rebuilt with ./manage.py rebuild_access
+    """
+    host = models.ForeignKey(Host)
+    account_name = models.CharField(_('SSH Account Name'), null=False, max_length=100, blank=False)
+    sshkey = models.ForeignKey(SSHKey, null=True, blank=True)
+    position = models.IntegerField(_('Position'), null=False, default=0)
+
+    class Meta:
+        ordering = ['host', 'account_name', 'position']
+        index_together = [
+            ('host', 'account_name', 'position'),
+            ('account_name', 'host'),
+        ]
+
+    def __str__(self):
+        return self.account_name
+
+
+class AccessRevision(models.Model):
+    """
+    AccessRevision model.
+    Holds a single row with a counter that is increased on every change
+    of the keys deployed to any host. The API uses it as version of its
+    responses. HostChange rows older than baseline are removed, clients
+    that are behind the baseline have to fetch all hosts again.
+    """
+    revision = models.IntegerField(_('Revision'), null=False, default=0)
+    baseline = models.IntegerField(_('Baseline'), null=False, default=0)
+
+    def current():
+        return AccessRevision.objects.get(pk=1).revision
+
+    def bump():
+        """ increase the revision and return the new one """
+        AccessRevision.objects.filter(pk=1).update(revision=F('revision') + 1)
+        return AccessRevision.current()
+
+
+class HostChange(models.Model):
+    """
+    HostChange model.
+    Change log of the hosts: every revision that changed the access to a
+    host adds a row, removed is set if the host was deleted or renamed.
+    """
+    host_name = models.CharField(_('Host Name'), null=False, max_length=155, blank=False)
+    revision = models.IntegerField(_('Revision'), null=False, db_index=True)
+    removed = models.BooleanField(_('removed'), default=False)
+
+    class Meta:
+        ordering = ['revision', 'id']
+
+    def __str__(self):
+        return self.host_name
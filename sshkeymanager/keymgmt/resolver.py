@@ -0,0 +1,192 @@
+from collections import OrderedDict, defaultdict
+import itertools
+
+from django.db.models import Q
+
+from keymgmt.models import Environment, Group, GroupClosure, Host, SSHAccount, SSHKey, SSHKeyring
+
+
+class AccountResolver:
+    """
+    Resolve the merged accounts of many hosts at once.
+
+    Host.get_account_merged() fires queries per host, per group, per account
+    and per keyring. AccountResolver loads everything needed for a set of
+    hosts with a fixed number of queries and merges it in memory, keeping
+    the ordering and deduplication of Host.get_account_merged().
+    """
+
+    def __init__(self, hosts):
+        self.hosts = list(hosts.select_related('environment'))
+        host_ids = hosts.values('id')
+
+        memberships = Group.hosts.through.objects.filter(host__in=host_ids)
+        closure = GroupClosure.objects.filter(descendant__in=memberships.values('group_id'))
+        ancestors = defaultdict(list)
+        for group_id, ancestor_id, ancestor_name in closure.values_list('descendant_id', 'ancestor_id', 'ancestor__name'):
+            ancestors[group_id].append((ancestor_name, ancestor_id))
+
+        self.host_groups = defaultdict(set)
+        for host_id, group_id in memberships.values_list('host_id', 'group_id'):
+            self.host_groups[host_id].update(ancestors[group_id])
+        for host_id, groups in self.host_groups.items():
+            self.host_groups[host_id] = sorted(groups)
+
+        accounts = SSHAccount.objects.filter(
+            Q(obj_name='host', obj_id__in=host_ids) |
+            Q(obj_name='environment', obj_id__in=hosts.values('environment_id')) |
+            Q(obj_name='group', obj_id__in=closure.values('ancestor_id'))
+        )
+        self.accounts = defaultdict(list)
+        for account_id, name, obj_name, obj_id in accounts.order_by().values_list('id', 'name', 'obj_name', 'obj_id'):
+            self.accounts[(obj_name, obj_id)].append((name, account_id))
+        for parent_accounts in self.accounts.values():
+            parent_accounts.sort()
+
+        account_ids = accounts.values('id')
+        account_keys = SSHAccount.keys.through.objects.filter(sshaccount__in=account_ids)
+        account_keyrings = SSHAccount.keyrings.through.objects.filter(sshaccount__in=account_ids)
+        keyring_keys = SSHKeyring.keys.through.objects.filter(
+            sshkeyring__in=account_keyrings.values('sshkeyring_id')
+        )
+
+        self.sshkeys = {}
+        for key in SSHKey.objects.filter(
+                Q(id__in=account_keys.values('sshkey_id')) |
+                Q(id__in=keyring_keys.values('sshkey_id'))):
+            self.sshkeys[key.id] = key
+
+        self.account_keys = defaultdict(list)
+        for account_id, key_id in account_keys.values_list('sshaccount_id', 'sshkey_id'):
+            self.account_keys[account_id].append(self.sshkeys[key_id])
+
+        self.account_keyrings = defaultdict(list)
+        for account_id, keyring_id, keyring_name in account_keyrings.values_list(
+                'sshaccount_id', 'sshkeyring_id', 'sshkeyring__name'):
+            self.account_keyrings[account_id].append((keyring_name, keyring_id))
+
+        self.keyring_keys = defaultdict(list)
+        for keyring_id, key_id in keyring_keys.values_list('sshkeyring_id', 'sshkey_id'):
+            self.keyring_keys[keyring_id].append(self.sshkeys[key_id])
+
+        self._all_keys = {}
+
+    def get_all_keys(self, account_id):
+        """
+            same as SSHAccount.get_all_keys, but for a preloaded account id
+        """
+        if account_id not in self._all_keys:
+            keys = [sorted(self.account_keys[account_id], key=lambda k: k.name)]
+            for keyring_name, keyring_id in sorted(self.account_keyrings[account_id]):
+                keys.append(sorted(self.keyring_keys[keyring_id], key=lambda k: k.name))
+            keys_merged = list(itertools.chain(*keys))
+            self._all_keys[account_id] = list(OrderedDict.fromkeys(keys_merged))
+        return self._all_keys[account_id]
+
+    def get_account_merged(self, host):
+        """
+            same as Host.get_account_merged, without any database access
+        """
+        parents = [('host', host.id), ('environment', host.environment_id)]
+        for group_name, group_id in self.host_groups[host.id]:
+            parents.append(('group', group_id))
+
+        accounts = OrderedDict()
+        for parent in parents:
+            for name, account_id in self.accounts[parent]:
+                if name not in accounts:
+                    accounts[name] = []
+                accounts[name].append(self.get_all_keys(account_id))
+
+        accounts_merged = OrderedDict()
+        for account, keys in accounts.items():
+            merged = list(itertools.chain(*keys))
+            accounts_merged[account] = list(OrderedDict.fromkeys(merged))
+        return accounts_merged
+
+    def all(self):
+        """
+            list of (host, merged accounts) tuples
+        """
+        return [(host, self.get_account_merged(host)) for host in self.hosts]
+
+
+class KeyReach:
+    """
+    Reverse of AccountResolver: the hosts and accounts a set of keys is
+    deployed to, with the attachments that grant it.
+
+    A key reaches an account directly or through a keyring, the account
+    reaches the hosts of its environment, its group and all subgroups,
+    or its host. Every step is one query on the link tables, independent
+    of the number of hosts, accounts and keys.
+    """
+
+    def __init__(self, keys):
+        self.keys = dict((key.id, key) for key in keys)
+        key_ids = list(self.keys.keys())
+
+        # (account id, key id) -> keyring names, None for a direct link
+        self.links = defaultdict(set)
+        for account_id, key_id in SSHAccount.keys.through.objects.filter(
+                sshkey__in=key_ids).values_list('sshaccount_id', 'sshkey_id'):
+            self.links[(account_id, key_id)].add(None)
+        keyring_keys = defaultdict(list)
+        for keyring_id, key_id in SSHKeyring.keys.through.objects.filter(
+                sshkey__in=key_ids).values_list('sshkeyring_id', 'sshkey_id'):
+            keyring_keys[keyring_id].append(key_id)
+        for account_id, keyring_id, keyring_name in SSHAccount.keyrings.through.objects.filter(
+                sshkeyring__in=list(keyring_keys.keys())).values_list('sshaccount_id', 'sshkeyring_id', 'sshkeyring__name'):
+            for key_id in keyring_keys[keyring_id]:
+                self.links[(account_id, key_id)].add(keyring_name)
+
+        accounts = SSHAccount.objects.filter(
+            Q(keys__in=key_ids) | Q(keyrings__keys__in=key_ids)
+        ).distinct()
+        self.accounts = {}
+        for account_id, name, obj_name, obj_id in accounts.order_by().values_list('id', 'name', 'obj_name', 'obj_id'):
+            self.accounts[account_id] = (name, obj_name, obj_id)
+
+        # (obj_name, obj_id) -> names of the hosts
+        self.parent_hosts = defaultdict(set)
+        self.parent_names = {}
+        for host_id, host_name in Host.objects.filter(
+                id__in=accounts.filter(obj_name='host').values('obj_id')).order_by().values_list('id', 'name'):
+            self.parent_hosts[('host', host_id)].add(host_name)
+            self.parent_names[('host', host_id)] = host_name
+        for environment_id, host_name in Host.objects.filter(
+                environment__in=accounts.filter(obj_name='environment').values('obj_id')).order_by().values_list(
+                'environment_id', 'name'):
+            self.parent_hosts[('environment', environment_id)].add(host_name)
+        for group_id, host_name in Group.hosts.through.objects.filter(
+                group__ancestor_links__ancestor__in=accounts.filter(obj_name='group').values('obj_id')).values_list(
+                'group__ancestor_links__ancestor_id', 'host__name'):
+            self.parent_hosts[('group', group_id)].add(host_name)
+
+        for obj_name, model in (('environment', Environment), ('group', Group)):
+            for obj_id, name in model.objects.filter(
+                    id__in=accounts.filter(obj_name=obj_name).values('obj_id')).order_by().values_list('id', 'name'):
+                self.parent_names[(obj_name, obj_id)] = name
+
+    def reach(self, key):
+        """
+        where key is deployed, as list of (host name, account name, sources)
+        sorted by host and account. sources is a sorted list of
+        (parent type, parent name, keyring name or None) tuples.
+        """
+        access = defaultdict(set)
+        for (account_id, key_id), keyrings in self.links.items():
+            if key_id != key.id:
+                continue
+            name, obj_name, obj_id = self.accounts[account_id]
+            for host in self.parent_hosts[(obj_name, obj_id)]:
+                for keyring in keyrings:
+                    access[(host, name)].add((obj_name, self.parent_names[(obj_name, obj_id)], keyring))
+        return [(host, account, sorted(sources, key=lambda source: (source[0], source[1], source[2] or '')))
+                for (host, account), sources in sorted(access.items())]
+
+    def all(self):
+        """
+            list of (key, reach) tuples
+        """
+        return [(key, self.reach(key)) for key in sorted(self.keys.values(), key=lambda k: k.name)]
@@ -0,0 +1,72 @@
+"""
+Label selectors of GroupRules, e.g. ``role=db,dc in (fra1,ams2)``.
+
+A selector is a comma separated list of requirements, a host has to
+fulfill all of them:
+
+    key=value, key==value   label key has this value
+    key!=value              label key is missing or has another value
+    key in (a,b)            label key has one of the values
+    key notin (a,b)         label key is missing or has none of the values
+    key                     host has the label key
+    !key                    host has no label key
+"""
+import re
+
+KEY = r'[0-9A-Za-z_./-]+'
+VALUE = r'[^\s,()=!]+'
+
+EXISTS = re.compile(r'^(!?)\s*(' + KEY + r')$')
+EQUALS = re.compile(r'^(' + KEY + r')\s*(==|=|!=)\s*(' + VALUE + r')$')
+IN = re.compile(r'^(' + KEY + r')\s+(in|notin)\s*\(([^()]*)\)$')
+
+
+def split_terms(selector):
+    """ split at the commas outside of parentheses """
+    terms = []
+    depth = 0
+    term = ''
+    for char in selector:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                raise ValueError('unbalanced parentheses')
+        elif char == ',' and depth == 0:
+            terms.append(term.strip())
+            term = ''
+            continue
+        term += char
+    if depth != 0:
+        raise ValueError('unbalanced parentheses')
+    terms.append(term.strip())
+    return terms
+
+
+def parse_selector(selector):
+    """
+    requirements of a selector as list of (key, operator, values) tuples,
+    operator is one of in, notin, exists and !exists.
+    Raises ValueError if the selector is not valid.
+    """
+    requirements = []
+    for term in split_terms(selector):
+        match = EXISTS.match(term)
+        if match:
+            requirements.append((match.group(2), '!exists' if match.group(1) else 'exists', []))
+            continue
+        match = EQUALS.match(term)
+        if match:
+            requirements.append((match.group(1), 'notin' if match.group(2) == '!=' else 'in', [match.group(3)]))
+            continue
+        match = IN.match(term)
+        if match:
+            values = [value.strip() for value in match.group(3).split(',')]
+            for value in values:
+                if re.match('^' + VALUE + '$', value) is None:
+                    raise ValueError('invalid value in: ' + term)
+            requirements.append((match.group(1), match.group(2), values))
+            continue
+        raise ValueError('invalid requirement: ' + term)
+    return requirements
@@ -0,0 +1,220 @@
+"""
+Keep the EffectiveAccess table in sync with the models.
+
+Every handler computes the hosts affected by a change and recomputes
+only these hosts. For deletes the affected hosts are collected in
+pre_delete/pre_clear, because the relations are gone afterwards.
+"""
+from django.db.models.signals import post_save, pre_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from keymgmt import effective, stats
+from keymgmt.models import Environment, Group, GroupClosure, Host, RuleMembership, SSHAccount, SSHKey, SSHKeyring
+
+
+def _remember(instance, host_ids):
+    instance._access_hosts = set(host_ids)
+
+
+def _remembered(instance):
+    return getattr(instance, '_access_hosts', set())
+
+
+@receiver(pre_save, sender=Host)
+def host_pre_save(sender, instance, raw=False, **kwargs):
+    """ remember the old name, a renamed host is removed under its old name """
+    instance._old_name = None
+    if raw or instance.pk is None:
+        return
+    names = list(Host.objects.filter(pk=instance.pk).values_list('name', flat=True))
+    if len(names) > 0 and names[0] != instance.name:
+        instance._old_name = names[0]
+
+
+@receiver(post_save, sender=Host)
+def host_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if getattr(instance, '_old_name', None) is not None:
+        effective.record_removed([instance._old_name])
+    effective.refresh_hosts([instance.pk])
+
+
+@receiver(post_delete, sender=Host)
+def host_deleted(sender, instance, **kwargs):
+    effective.record_removed([instance.name])
+
+
+@receiver(post_save, sender=Environment)
+def environment_saved(sender, instance, created=False, raw=False, **kwargs):
+    """ the environment name is part of the API output """
+    if raw or created:
+        return
+    effective.refresh_hosts(effective.hosts_for_environments([instance.pk]))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created=False, raw=False, **kwargs):
+    """ the group name defines the merge order of the accounts """
+    if raw or created:
+        return
+    effective.refresh_hosts(effective.hosts_for_groups([instance.pk]))
+
+
+@receiver(pre_delete, sender=Group)
+def group_pre_delete(sender, instance, **kwargs):
+    """
+    subgroups become top level groups and the accounts of the group are
+    deleted, also when a queryset or the admin deletes the group
+    """
+    _remember(instance, effective.hosts_for_groups([instance.pk]))
+    for child in Group.objects.filter(parent=instance):
+        child.parent = None
+        GroupClosure.move(child)
+    SSHAccount.objects.filter(obj_name='group', obj_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    effective.refresh_hosts(_remembered(instance))
+
+
+@receiver(m2m_changed, sender=Group.hosts.through)
+def group_hosts_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            _remember(instance, [instance.pk])
+            RuleMembership.objects.filter(host=instance).delete()
+        else:
+            _remember(instance, effective.hosts_for_groups([instance.pk]))
+            RuleMembership.objects.filter(group=instance).delete()
+    elif action == 'post_clear':
+        effective.refresh_hosts(_remembered(instance))
+    elif action in ('post_add', 'post_remove'):
+        if action == 'post_remove':
+            # forget rule memberships removed by hand
+            if reverse:
+                RuleMembership.forget((group_id, instance.pk) for group_id in pk_set)
+            else:
+                RuleMembership.forget((instance.pk, host_id) for host_id in pk_set)
+        if reverse:
+            effective.refresh_hosts([instance.pk])
+        else:
+            effective.refresh_hosts(pk_set)
+
+
+@receiver(pre_save, sender=SSHAccount)
+def account_pre_save(sender, instance, raw=False, **kwargs):
+    """ the account could move to another environment, group or host """
+    if raw or instance.pk is None:
+        return
+    _remember(instance, effective.hosts_for_accounts(SSHAccount.objects.filter(pk=instance.pk)))
+
+
+@receiver(post_save, sender=SSHAccount)
+def account_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    hosts = effective.hosts_for_accounts(SSHAccount.objects.filter(pk=instance.pk))
+    effective.refresh_hosts(hosts | _remembered(instance))
+
+
+@receiver(pre_delete, sender=SSHAccount)
+def account_pre_delete(sender, instance, **kwargs):
+    _remember(instance, effective.hosts_for_accounts(SSHAccount.objects.filter(pk=instance.pk)))
+
+
+@receiver(post_delete, sender=SSHAccount)
+def account_deleted(sender, instance, **kwargs):
+    effective.refresh_hosts(_remembered(instance))
+
+
+def _account_relation_changed(instance, action, reverse, pk_set, reverse_accounts):
+    if reverse:
+        if action == 'pre_clear':
+            _remember(instance, effective.hosts_for_accounts(reverse_accounts))
+        elif action == 'post_clear':
+            effective.refresh_hosts(_remembered(instance))
+        elif action in ('post_add', 'post_remove'):
+            effective.refresh_hosts(effective.hosts_for_accounts(SSHAccount.objects.filter(pk__in=pk_set)))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        effective.refresh_hosts(effective.hosts_for_accounts(SSHAccount.objects.filter(pk=instance.pk)))
+
+
+@receiver(m2m_changed, sender=SSHAccount.keys.through)
+def account_keys_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    accounts = SSHAccount.objects.filter(keys=instance) if reverse else None
+    _account_relation_changed(instance, action, reverse, pk_set, accounts)
+
+
+@receiver(m2m_changed, sender=SSHAccount.keyrings.through)
+def account_keyrings_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    accounts = SSHAccount.objects.filter(keyrings=instance) if reverse else None
+    _account_relation_changed(instance, action, reverse, pk_set, accounts)
+
+
+@receiver(post_save, sender=SSHKey)
+def sshkey_saved(sender, instance, created=False, raw=False, **kwargs):
+    """ the key name defines the order of the keys """
+    if raw or created:
+        return
+    effective.refresh_hosts(effective.hosts_for_keys([instance.pk]))
+
+
+@receiver(pre_delete, sender=SSHKey)
+def sshkey_pre_delete(sender, instance, **kwargs):
+    _remember(instance, effective.hosts_for_keys([instance.pk]))
+
+
+@receiver(post_delete, sender=SSHKey)
+def sshkey_deleted(sender, instance, **kwargs):
+    effective.refresh_hosts(_remembered(instance))
+
+
+@receiver(post_save, sender=SSHKeyring)
+def sshkeyring_saved(sender, instance, created=False, raw=False, **kwargs):
+    """ the keyring name defines the order of the keyrings """
+    if raw or created:
+        return
+    effective.refresh_hosts(effective.hosts_for_keyrings([instance.pk]))
+
+
+@receiver(pre_delete, sender=SSHKeyring)
+def sshkeyring_pre_delete(sender, instance, **kwargs):
+    _remember(instance, effective.hosts_for_keyrings([instance.pk]))
+
+
+@receiver(post_delete, sender=SSHKeyring)
+def sshkeyring_deleted(sender, instance, **kwargs):
+    effective.refresh_hosts(_remembered(instance))
+
+
+@receiver(m2m_changed, sender=SSHKeyring.keys.through)
+def sshkeyring_keys_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action == 'pre_clear':
+            _remember(instance, effective.hosts_for_keys([instance.pk]))
+        elif action == 'post_clear':
+            effective.refresh_hosts(_remembered(instance))
+        elif action in ('post_add', 'post_remove'):
+            effective.refresh_hosts(effective.hosts_for_keyrings(pk_set))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        effective.refresh_hosts(effective.hosts_for_keyrings([instance.pk]))
+
+
+STATS_MODELS = (Environment, Group, Host, SSHAccount, SSHKey, SSHKeyring)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def stats_changed(sender, **kwargs):
+    """ a changed key may change its type, a changed host its environment """
+    if sender in STATS_MODELS:
+        stats.invalidate()
+
+
+@receiver(m2m_changed, sender=SSHAccount.keys.through)
+@receiver(m2m_changed, sender=SSHAccount.keyrings.through)
+def stats_account_keys_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        stats.invalidate()
@@ -0,0 +1,115 @@
+"""
+Counts for the overview page. All totals are read with one query of
+scalar subqueries and the hosts per environment with a grouped query.
+Databases that do not allow a SELECT without FROM read every total with
+its own ORM query.
+The result is kept in the Django cache STATS_CACHE for STATS_CACHE_TTL
+seconds, the handlers in keymgmt.signals drop it on every change. The
+drop only reaches other processes if STATS_CACHE is shared by all of
+them, a per-process cache like locmem shows outdated counts up to the TTL.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count
+
+from keymgmt.models import Environment, Group, Host, SSHAccount, SSHKey, SSHKeyring
+
+CACHE_KEY = 'skm:stats'
+
+KEY_TYPES = ['ssh-rsa', 'ssh-dss', 'ecdsa-sha2-nistp256']
+
+# databases reading all totals with one SELECT without FROM
+SINGLE_QUERY_VENDORS = ['sqlite', 'postgresql', 'mysql']
+
+MODELS = [
+    ('account_count', SSHAccount),
+    ('environment_count', Environment),
+    ('host_count', Host),
+    ('group_count', Group),
+    ('sshkey_count', SSHKey),
+    ('sshkeyring_count', SSHKeyring),
+]
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def column(model, name):
+    return connection.ops.quote_name(model._meta.get_field(name).column)
+
+
+def without_keys_sql():
+    """ accounts without any key or keyring """
+    conditions = []
+    for through in [SSHAccount.keys.through, SSHAccount.keyrings.through]:
+        conditions.append('NOT EXISTS (SELECT 1 FROM %s WHERE %s.%s = a.%s)' % (
+            table(through), table(through), column(through, 'sshaccount'), column(SSHAccount, 'id')))
+    return 'SELECT COUNT(*) FROM %s a WHERE %s' % (table(SSHAccount), ' AND '.join(conditions))
+
+
+def totals():
+    """
+    the count of every model, of the accounts without keys and of the
+    keys per type, read with one query
+    """
+    if connection.vendor not in SINGLE_QUERY_VENDORS:
+        return orm_totals()
+    selects = ['SELECT COUNT(*) FROM %s' % table(model) for name, model in MODELS]
+    selects.append(without_keys_sql())
+    for key_type in KEY_TYPES:
+        selects.append('SELECT COUNT(*) FROM %s WHERE %s LIKE %%s' % (table(SSHKey), column(SSHKey, 'sshkey')))
+    sql = 'SELECT ' + ', '.join('(' + select + ')' for select in selects)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [key_type + ' %' for key_type in KEY_TYPES])
+        row = cursor.fetchone()
+
+    result = dict((name, count) for (name, model), count in zip(MODELS, row))
+    result['accounts_without_keys'] = row[len(MODELS)]
+    result['keys_per_type'] = list(zip(KEY_TYPES, row[len(MODELS) + 1:]))
+    return result
+
+
+def orm_totals():
+    """ the same counts as totals, one ORM query per count """
+    result = dict((name, model.objects.count()) for name, model in MODELS)
+    result['accounts_without_keys'] = SSHAccount.objects.filter(keys=None, keyrings=None).count()
+    result['keys_per_type'] = [(key_type, SSHKey.objects.filter(sshkey__startswith=key_type + ' ').count())
+                               for key_type in KEY_TYPES]
+    return result
+
+
+def compute():
+    """ totals and the number of hosts per environment, 2 queries on the SINGLE_QUERY_VENDORS """
+    result = totals()
+    result['hosts_per_environment'] = list(
+        Environment.objects.annotate(host_count=Count('host')).values_list('name', 'host_count').order_by('name')
+    )
+    return result
+
+
+def cache():
+    alias = getattr(settings, 'STATS_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def get_stats():
+    """ the counts from the cache, computed again if missing """
+    stats_cache = cache()
+    if stats_cache is None:
+        return compute()
+    result = stats_cache.get(CACHE_KEY)
+    if result is None:
+        result = compute()
+        stats_cache.set(CACHE_KEY, result, getattr(settings, 'STATS_CACHE_TTL', 30))
+    return result
+
+
+def invalidate():
+    stats_cache = cache()
+    if stats_cache is not None:
+        stats_cache.delete(CACHE_KEY)
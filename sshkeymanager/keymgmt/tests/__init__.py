@@ -1,4 +1,12 @@
 from keymgmt.tests.test_models import *
 from keymgmt.tests.test_validators import *
 from keymgmt.tests.test_importers import *
-from keymgmt.tests.test_key import *
\ No newline at end of file
+from keymgmt.tests.test_key import *
+from keymgmt.tests.test_resolver import *
+from keymgmt.tests.test_effective import *
+from keymgmt.tests.test_api import *
+from keymgmt.tests.test_accesscache import *
+from keymgmt.tests.test_grouprules import *
+from keymgmt.tests.test_selector import *
+from keymgmt.tests.test_audit import *
+from keymgmt.tests.test_stats import *
\ No newline at end of file
@@ -0,0 +1,72 @@
+import shutil
+import tempfile
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from keymgmt.models import *
+from keymgmt.key import KeyAccess
+from keymgmt import effective
+from keymgmt.accesscache import access_cache
+from keymgmt.tests.test_resolver import create_fleet
+
+
+ACCESS_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'access': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'access'},
+}
+
+
+@override_settings(CACHES=ACCESS_CACHES, ACCESS_CACHE='access')
+class AccessCacheTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+        caches['access'].clear()
+        access_cache.reset_stats()
+
+    def uncached_export(self):
+        with self.settings(ACCESS_CACHE=None):
+            return KeyAccess().export()
+
+    def test_export(self):
+        self.assertEqual(KeyAccess().export(), self.uncached_export())
+        self.assertEqual(access_cache.stats()['misses'], 3)
+        expected = self.uncached_export()
+        with self.assertNumQueries(1):
+            self.assertEqual(KeyAccess().export(), expected)
+        self.assertEqual(access_cache.stats()['hits'], 3)
+
+        hosts = KeyAccess(filter_type='host', filter_value='db1.example.com').export()
+        self.assertEqual(list(hosts.keys()), ['db1.example.com'])
+
+    def test_targeted_invalidation(self):
+        KeyAccess().export()
+        developers = SSHKeyring.objects.filter(name='Developers')
+        affected = effective.hosts_for_keyrings(developers)
+        self.assertGreater(len(affected), 0)
+        self.assertLess(len(affected), 3)
+
+        developers[0].keys.remove(SSHKey.objects.get(name='Bob'))
+        self.assertEqual(KeyAccess().export(), self.uncached_export())
+        stats = access_cache.stats()
+        self.assertEqual(stats['invalidations'], len(affected))
+        self.assertEqual(stats['hits'], 3 - len(affected))
+
+        effective.rebuild()
+        KeyAccess().export()
+        self.assertEqual(access_cache.stats()['invalidations'], len(affected) + 3)
+
+    def test_eviction(self):
+        KeyAccess().export()
+        caches['access'].clear()
+        KeyAccess().export()
+        self.assertEqual(access_cache.stats()['evictions'], 3)
+
+    def test_file_based(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}
+            with self.settings(CACHES=dict(ACCESS_CACHES, access=cache)):
+                KeyAccess().export()
+                self.assertEqual(KeyAccess().export(), self.uncached_export())
+                self.assertEqual(access_cache.stats()['hits'], 3)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,349 @@
+import json
+import threading
+import time
+from django.test import TestCase, override_settings
+from keymgmt.models import *
+from keymgmt.key import *
+from keymgmt import effective
+from keymgmt.authkeys import *
+from keymgmt.coalesce import *
+from keymgmt.tests.test_resolver import create_fleet
+
+
+API_KEY = 'RwWjFPxn1bj.Q'
+
+
+@override_settings(API_KEYS=[API_KEY])
+class ApiGetKeysTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+        get_keys_flight.clear()
+
+    def get_keys(self, **data):
+        data['API_KEY'] = API_KEY
+        return self.client.post('/api/getkeys/', data)
+
+    def expected(self, hosts):
+        result = {}
+        for host in hosts:
+            accounts = {}
+            for name, keys in host.get_account_merged().items():
+                accounts[name] = [key.ssh_key_entry() for key in keys]
+            result[host.name] = {
+                'ip': host.ipaddress,
+                'environment': host.environment.name,
+                'accounts': accounts
+            }
+        return json.dumps(result, sort_keys=True, indent=4)
+
+    def test_access_token(self):
+        self.assertEqual(self.client.post('/api/getkeys/', {}).status_code, 401)
+        self.assertEqual(self.client.post('/api/getkeys/', {'API_KEY': 'foo'}).status_code, 401)
+
+    def test_get_keys(self):
+        response = self.get_keys()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode(), self.expected(Host.objects.all()))
+
+        response = self.get_keys(filter_type='group', filter_value='databases')
+        self.assertEqual(response.content.decode(), self.expected(Host.objects.filter(group__name='databases')))
+
+    @override_settings(API_STREAMING=True)
+    def test_get_keys_streaming(self):
+        response = self.get_keys()
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.expected(Host.objects.all()))
+
+        response = self.get_keys(filter_type='host', filter_value='nonexistent')
+        self.assertEqual(b''.join(response.streaming_content), b'{}')
+
+    def test_etag(self):
+        response = self.get_keys()
+        etag = response['ETag']
+        response = self.client.post('/api/getkeys/', {'API_KEY': API_KEY}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.get_keys(filter_type='group', filter_value='databases')
+        self.assertNotEqual(response['ETag'], etag)
+
+        key = SSHKey.objects.get(name='Alice')
+        key.sshaccount_set.clear()
+        response = self.client.post('/api/getkeys/', {'API_KEY': API_KEY}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_host_delete(self):
+        etag = self.get_keys()['ETag']
+        self.hosts[0].delete()
+        response = self.client.post('/api/getkeys/', {'API_KEY': API_KEY}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_pages(self):
+        hosts = {}
+        after = None
+        pages = 0
+        while True:
+            data = {'limit': 2}
+            if after is not None:
+                data['after'] = after
+            response = self.get_keys(**data)
+            self.assertIn('X-SKM-Revision', response)
+            page = json.loads(response.content.decode())
+            self.assertLessEqual(len(page['hosts']), 2)
+            hosts.update(page['hosts'])
+            pages += 1
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(pages, 2)
+        self.assertEqual(json.dumps(hosts, sort_keys=True, indent=4), self.expected(Host.objects.all()))
+
+        page = json.loads(self.get_keys(limit=1, filter_type='group', filter_value='databases').content.decode())
+        self.assertEqual(list(page['hosts'].keys()), ['db1.example.com'])
+        self.assertEqual(page['next'], 'db1.example.com')
+        page = json.loads(self.get_keys(limit=10, after='zzz').content.decode())
+        self.assertEqual(page, {'hosts': {}, 'next': None})
+
+        self.assertEqual(self.get_keys(limit=0).status_code, 400)
+        self.assertEqual(self.get_keys(limit='foo').status_code, 400)
+
+    def test_shared_result(self):
+        before = get_keys_flight.stats()
+        content = self.get_keys().content
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_keys().content, content)
+        self.assertNotEqual(self.get_keys(filter_type='host', filter_value='db1.example.com').content, content)
+
+        SSHKey.objects.get(name='Alice').delete()
+        self.assertEqual(self.get_keys().content.decode(), self.expected(Host.objects.all()))
+
+        stats = json.loads(self.client.post('/api/stats/', {'API_KEY': API_KEY}).content.decode())
+        self.assertEqual(stats['getkeys']['computed'] - before['computed'], 3)
+        self.assertEqual(stats['getkeys']['cached'] - before['cached'], 1)
+
+
+@override_settings(API_KEYS=[API_KEY])
+class ApiChangesTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def changes(self, since, **data):
+        data['API_KEY'] = API_KEY
+        data['since'] = since
+        return self.client.post('/api/changes/', data)
+
+    def test_changes(self):
+        revision = int(self.client.post('/api/getkeys/', {'API_KEY': API_KEY})['X-SKM-Revision'])
+        result = json.loads(self.changes(revision).content.decode())
+        self.assertEqual(result, {'revision': revision, 'hosts': {}, 'removed': []})
+
+        SSHKey.objects.get(name='Bob').delete()
+        self.hosts[0].name = 'web01.example.com'
+        self.hosts[0].save()
+        self.hosts[2].delete()
+
+        result = json.loads(self.changes(revision).content.decode())
+        self.assertGreater(result['revision'], revision)
+        self.assertEqual(sorted(result['hosts'].keys()), ['web01.example.com', 'webdb1.example.com'])
+        self.assertEqual(result['hosts'], KeyAccess(filter_type='environment', filter_value='production').export())
+        self.assertEqual(result['removed'], ['db1.example.com', 'web1.example.com'])
+
+        result = json.loads(self.changes(revision, filter_type='host', filter_value='webdb1.example.com').content.decode())
+        self.assertEqual(list(result['hosts'].keys()), ['webdb1.example.com'])
+
+    def test_changes_filter(self):
+        revision = AccessRevision.current()
+        staging = Environment.objects.get(name='staging')
+        self.hosts[0].environment = staging
+        self.hosts[0].save()
+
+        result = json.loads(self.changes(revision, filter_type='environment', filter_value='production').content.decode())
+        self.assertEqual(result['hosts'], {})
+        self.assertEqual(result['removed'], ['web1.example.com'])
+        result = json.loads(self.changes(revision, filter_type='environment', filter_value='staging').content.decode())
+        self.assertEqual(list(result['hosts'].keys()), ['web1.example.com'])
+        self.assertEqual(result['removed'], [])
+
+        revision = AccessRevision.current()
+        self.hosts[2].delete()
+        result = json.loads(self.changes(revision, filter_type='host', filter_value='web1.example.com').content.decode())
+        self.assertEqual(result['removed'], [])
+        result = json.loads(self.changes(revision, filter_type='host', filter_value='db1.example.com').content.decode())
+        self.assertEqual(result['removed'], ['db1.example.com'])
+
+    def test_changes_baseline(self):
+        self.assertEqual(self.changes('foo').status_code, 400)
+        revision = AccessRevision.current()
+        effective.rebuild()
+        self.assertEqual(self.changes(revision).status_code, 410)
+        self.assertEqual(self.changes(AccessRevision.current()).status_code, 200)
+
+        revision = AccessRevision.current()
+        SSHKey.objects.get(name='Bob').delete()
+        effective.prune_changes(0)
+        self.assertEqual(self.changes(revision).status_code, 410)
+        self.assertEqual(HostChange.objects.count(), 0)
+
+
+@override_settings(API_KEYS=[API_KEY])
+class ApiAuthorizedKeysTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+        authorized_keys_cache.clear()
+
+    def authorized_keys(self, host, account):
+        return self.client.post('/api/authorized_keys/' + host + '/' + account, {'API_KEY': API_KEY})
+
+    def expected(self, host, account):
+        keys = host.get_account_merged()[account]
+        return ''.join(key.ssh_key_entry() + "\n" for key in keys)
+
+    def test_authorized_keys(self):
+        response = self.authorized_keys('webdb1.example.com', 'root')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response.content.decode(), self.expected(self.hosts[1], 'root'))
+        self.assertEqual(self.authorized_keys('db1.example.com', 'nobody').content, b'')
+        self.assertEqual(self.authorized_keys('db1.example.com', 'root').status_code, 404)
+        self.assertEqual(self.authorized_keys('unknown.example.com', 'root').status_code, 404)
+        self.assertEqual(self.client.post('/api/authorized_keys/db1.example.com/nobody', {}).status_code, 401)
+
+    def test_cache(self):
+        self.authorized_keys('webdb1.example.com', 'root')
+        self.authorized_keys('db1.example.com', 'deploy')
+        with self.assertNumQueries(1):
+            self.authorized_keys('webdb1.example.com', 'root')
+        self.assertEqual(authorized_keys_cache.stats()['hits'], 1)
+
+        SSHKeyring.objects.get(name='Developers').keys.remove(SSHKey.objects.get(name='Bob'))
+        self.assertEqual(self.authorized_keys('webdb1.example.com', 'root').content.decode(),
+                         self.expected(self.hosts[1], 'root'))
+        self.assertEqual(authorized_keys_cache.stats()['invalidations'], 1)
+        with self.assertNumQueries(1):
+            self.authorized_keys('db1.example.com', 'deploy')
+
+    def test_cache_other_process(self):
+        """ a second cache sees changes made by others through the change log """
+        cache = AuthorizedKeysCache()
+        self.assertEqual(len(cache.get('web1.example.com', 'www-data')), 2)
+        SSHKey.objects.get(name='Dave').delete()
+        self.assertEqual(len(cache.get('web1.example.com', 'www-data')), 1)
+
+    def test_cache_size(self):
+        cache = AuthorizedKeysCache(max_entries=2)
+        cache.get('web1.example.com', 'root')
+        cache.get('web1.example.com', 'www-data')
+        cache.get('db1.example.com', 'deploy')
+        self.assertEqual(list(cache.entries.keys()), [('web1.example.com', 'www-data'), ('db1.example.com', 'deploy')])
+
+
+@override_settings(API_KEYS=[API_KEY])
+class ApiSSHKeyTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def sshkey(self, **data):
+        data['API_KEY'] = API_KEY
+        return self.client.post('/api/sshkey/', data)
+
+    def test_lookup(self):
+        key = SSHKey.objects.get(name='Alice')
+        response = self.sshkey(fingerprint=key.fingerprint)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode()), {
+            'name': 'Alice', 'fingerprint': key.fingerprint, 'sshkey': key.sshkey
+        })
+        response = self.sshkey(sshkey=key.sshkey.replace(' alice', ' alice@laptop'))
+        self.assertEqual(json.loads(response.content.decode())['name'], 'Alice')
+
+        self.assertEqual(self.sshkey(fingerprint='SHA256:unknown').status_code, 404)
+        self.assertEqual(self.sshkey(sshkey='foo').status_code, 400)
+        self.assertEqual(self.client.post('/api/sshkey/', {'fingerprint': key.fingerprint}).status_code, 401)
+        with self.assertNumQueries(1):
+            self.sshkey(fingerprint=key.fingerprint)
+
+    def test_reach(self):
+        key = SSHKey.objects.get(name='Bob')
+        response = self.client.post('/api/sshkey/reach/', {'API_KEY': API_KEY, 'fingerprint': key.fingerprint})
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.content.decode())
+        self.assertEqual(result['name'], 'Bob')
+        self.assertEqual(result['access'][0], {
+            'host': 'db1.example.com',
+            'account': 'deploy',
+            'sources': [{'type': 'environment', 'name': 'staging', 'keyring': None}]
+        })
+        self.assertEqual(len(result['access']), 5)
+        response = self.client.post('/api/sshkey/reach/', {'API_KEY': API_KEY, 'fingerprint': 'SHA256:unknown'})
+        self.assertEqual(response.status_code, 404)
+
+
+class SingleFlightTests(TestCase):
+    def test_coalesce(self):
+        flight = SingleFlight(ttl=0)
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b'result'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', compute)))
+        leader.start()
+        started.wait()
+        waiters = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for i in range(3)]
+        for thread in waiters:
+            thread.start()
+        while flight.stats()['coalesced'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + waiters:
+            thread.join()
+
+        self.assertEqual(results, [b'result'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats()['computed'], 1)
+        self.assertEqual(flight.stats()['entries'], 0)
+
+    def test_cache(self):
+        flight = SingleFlight(ttl=60, max_bytes=10)
+        self.assertEqual(flight.do('a', lambda: b'1111'), b'1111')
+        self.assertEqual(flight.do('a', lambda: b'2222'), b'1111')
+        flight.do('b', lambda: b'3333')
+        flight.do('c', lambda: b'4444')
+        self.assertEqual(list(flight.results.keys()), ['b', 'c'])
+        self.assertEqual(flight.stats()['bytes'], 8)
+        self.assertEqual(flight.do('d', lambda: b'x' * 11), b'x' * 11)
+        self.assertEqual(list(flight.results.keys()), ['b', 'c'])
+        flight.expire(time.monotonic() + 61)
+        self.assertEqual(flight.stats()['entries'], 0)
+        self.assertEqual(flight.stats()['bytes'], 0)
+
+    def test_error(self):
+        flight = SingleFlight(ttl=60)
+
+        def fail():
+            raise ValueError('fail')
+
+        self.assertRaises(ValueError, flight.do, 'a', fail)
+        self.assertEqual(flight.do('a', lambda: b'1'), b'1')
+        self.assertEqual(flight.stats()['errors'], 1)
+
+
+class JsonStreamTests(TestCase):
+    def test_json_stream(self):
+        items = [('a', {'x': [1, 2], 'b': None}), ('b', {}), ('c"', {'y': 'z'})]
+        self.assertEqual(''.join(json_stream(items)), json.dumps(dict(items), sort_keys=True, indent=4))
+        self.assertEqual(''.join(json_stream([])), json.dumps({}, sort_keys=True, indent=4))
+
+    def test_iter_export_chunks(self):
+        create_fleet()
+        hosts = list(KeyAccess().iter_export(chunk_size=2))
+        self.assertEqual([name for name, host in hosts], ['db1.example.com', 'web1.example.com', 'webdb1.example.com'])
+        self.assertEqual(dict(hosts), KeyAccess().export())
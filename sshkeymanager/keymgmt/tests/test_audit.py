@@ -0,0 +1,60 @@
+import csv
+from django.test import TestCase
+from keymgmt.models import *
+from keymgmt.audit import *
+from keymgmt.tests.test_resolver import create_fleet
+
+
+class AccessAuditTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def test_page(self):
+        with self.assertNumQueries(3):
+            page = AccessAudit().page(1, per_page=2)
+            self.assertEqual([host.name for host in page.object_list], ['db1.example.com', 'web1.example.com'])
+        self.assertEqual(page.paginator.num_pages, 2)
+        for host in page.object_list:
+            merged = host.get_account_merged()
+            self.assertEqual(list(host.accounts.keys()), sorted(merged.keys()))
+            for name, keys in merged.items():
+                self.assertEqual(host.accounts[name], [(key.name, key.fingerprint) for key in keys])
+
+        for i in range(10):
+            Host.objects.create(name='web%d.example.org' % i, environment=self.hosts[0].environment)
+        with self.assertNumQueries(3):
+            AccessAudit().page(1, per_page=10)
+
+    def test_filters(self):
+        def names(audit):
+            return [host.name for host in audit.page(1).object_list]
+
+        self.assertEqual(names(AccessAudit(environment='staging')), ['db1.example.com'])
+        self.assertEqual(names(AccessAudit(group='databases')), ['db1.example.com', 'webdb1.example.com'])
+        self.assertEqual(names(AccessAudit(account='www-data')), ['web1.example.com', 'webdb1.example.com'])
+
+        page = AccessAudit(key='Carol', environment='production').page(1)
+        self.assertEqual([host.name for host in page.object_list], ['web1.example.com', 'webdb1.example.com'])
+        self.assertEqual(list(page.object_list[1].accounts.keys()), ['postgres', 'root'])
+        carol = SSHKey.objects.get(name='Carol')
+        self.assertEqual(page.object_list[1].accounts['root'], [('Carol', carol.fingerprint)])
+
+    def test_csv(self):
+        rows = list(csv.reader(''.join(csv_lines(AccessAudit().iter_rows(chunk_size=1))).splitlines()))
+        self.assertEqual(rows[0], CSV_HEADER)
+        self.assertEqual(rows[1], ['db1.example.com', 'staging', 'deploy', 'Bob', SSHKey.objects.get(name='Bob').fingerprint])
+        self.assertIn(['db1.example.com', 'staging', 'nobody', '', ''], rows)
+        self.assertEqual(len(rows) - 1, EffectiveAccess.objects.count())
+
+    def test_views(self):
+        response = self.client.get('/audit/key2access/', {'group': 'webservers', 'per_page': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'web1.example.com')
+        self.assertNotContains(response, 'db1.example.com')
+        self.assertContains(response, 'page=2')
+        self.assertEqual(self.client.get('/audit/key2access/', {'page': 5}).status_code, 404)
+
+        response = self.client.get('/audit/key2access/csv/', {'account': 'postgres'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 5)
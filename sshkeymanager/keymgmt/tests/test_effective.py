@@ -0,0 +1,179 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase, TransactionTestCase
+import keymgmt.models
+from keymgmt.models import *
+from keymgmt.key import KeyAccess
+from keymgmt import effective
+from keymgmt.tests.test_resolver import create_fleet, ssh_key
+
+
+class EffectiveAccessTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def assertConsistent(self):
+        self.assertEqual(effective.check_consistency(Host.objects.all()), [])
+
+    def test_initial(self):
+        self.assertConsistent()
+        self.assertTrue(EffectiveAccess.objects.filter(account_name='nobody', sshkey=None).exists())
+
+    def test_keyring_changes(self):
+        admins = SSHKeyring.objects.get(name='Admins')
+        admins.keys.add(SSHKey.objects.get(name='Bob'))
+        self.assertConsistent()
+        admins.keys.remove(SSHKey.objects.get(name='Alice'))
+        self.assertConsistent()
+        SSHKey.objects.get(name='Carol').sshkeyring_set.clear()
+        self.assertConsistent()
+        admins.name = 'ZZ Admins'
+        admins.save()
+        self.assertConsistent()
+        admins.delete()
+        self.assertConsistent()
+
+    def test_key_changes(self):
+        key = SSHKey.objects.get(name='Alice')
+        key.name = 'Zoe'
+        key.save()
+        self.assertConsistent()
+        key.delete()
+        self.assertConsistent()
+        key = SSHKey.objects.create(name='Eve', sshkey=ssh_key('eve'))
+        key.sshaccount_set.add(SSHAccount.objects.get(name='nobody'))
+        self.assertConsistent()
+
+    def test_account_changes(self):
+        account = SSHAccount.objects.get(name='deploy')
+        account.obj_name = 'host'
+        account.obj_id = self.hosts[0].id
+        account.save()
+        self.assertConsistent()
+        account.keys.clear()
+        self.assertConsistent()
+        account.delete()
+        self.assertConsistent()
+
+    def test_host_and_group_changes(self):
+        host = self.hosts[2]
+        host.environment = Environment.objects.get(name='production')
+        host.save()
+        self.assertConsistent()
+        Host.objects.create(name='web2.example.com', environment=host.environment)
+        self.assertConsistent()
+        group = Group.objects.get(name='webservers')
+        group.hosts.remove(self.hosts[0])
+        self.assertConsistent()
+        group.name = 'aaa webservers'
+        group.save()
+        self.assertConsistent()
+        group.hosts.clear()
+        self.assertConsistent()
+        Group.objects.get(name='databases').delete()
+        self.assertConsistent()
+        self.hosts[1].delete()
+        self.assertConsistent()
+
+    def test_nested_groups(self):
+        root = Group.objects.create(name='all')
+        account = SSHAccount.objects.create(name='backup', obj_name='group', obj_id=root.id)
+        self.assertConsistent()
+        web = Group.objects.get(name='webservers')
+        web.parent = root
+        web.save()
+        self.assertConsistent()
+        self.assertTrue(EffectiveAccess.objects.filter(host=self.hosts[0], account_name='backup').exists())
+        account.keys.add(SSHKey.objects.get(name='Alice'))
+        self.assertConsistent()
+        databases = Group.objects.get(name='databases')
+        databases.parent = web
+        databases.save()
+        self.assertConsistent()
+        web.delete()
+        self.assertConsistent()
+        self.assertFalse(EffectiveAccess.objects.filter(account_name='backup').exists())
+
+    def test_rebuild(self):
+        EffectiveAccess.objects.all().delete()
+        self.assertEqual(len(effective.check_consistency(Host.objects.all())), 3)
+        self.assertEqual(effective.rebuild(), 3)
+        self.assertConsistent()
+
+    def test_export(self):
+        with self.assertNumQueries(1):
+            hosts = KeyAccess().export()
+        self.assertEqual(sorted(hosts.keys()), ['db1.example.com', 'web1.example.com', 'webdb1.example.com'])
+        for host in Host.objects.all():
+            accounts = {}
+            for name, keys in host.get_account_merged().items():
+                accounts[name] = [key.ssh_key_entry() for key in keys]
+            self.assertEqual(hosts[host.name]['accounts'], accounts)
+            self.assertEqual(hosts[host.name]['environment'], host.environment.name)
+        Host.objects.create(name='empty.example.com', environment=Environment.objects.create(name='empty'))
+        hosts = KeyAccess(filter_type='environment', filter_value='empty').export()
+        self.assertEqual(hosts, {'empty.example.com': {'ip': None, 'environment': 'empty', 'accounts': {}}})
+
+
+class MigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('keymgmt', target)])
+        return executor.loader.project_state([('keymgmt', target)]).apps
+
+    def tearDown(self):
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes('keymgmt')[0][1])
+
+    def test_fill_effective_access(self):
+        old = self.migrate('0002_auto_20150501_1914')
+        Environment = old.get_model('keymgmt', 'Environment')
+        Host = old.get_model('keymgmt', 'Host')
+        Group = old.get_model('keymgmt', 'Group')
+        SSHKey = old.get_model('keymgmt', 'SSHKey')
+        SSHKeyring = old.get_model('keymgmt', 'SSHKeyring')
+        SSHAccount = old.get_model('keymgmt', 'SSHAccount')
+
+        prod = Environment.objects.create(name='production')
+        hosts = [Host.objects.create(name='web%d.example.com' % i, environment=prod) for i in range(3)]
+        keys = dict((name, SSHKey.objects.create(name=name, sshkey=ssh_key(name))) for name in ['Alice', 'Bob', 'Carol'])
+        admins = SSHKeyring.objects.create(name='Admins')
+        admins.keys.add(keys['Carol'], keys['Alice'])
+        web = Group.objects.create(name='webservers')
+        web.hosts.add(hosts[0], hosts[1])
+        account = SSHAccount.objects.create(name='root', obj_name='environment', obj_id=prod.id)
+        account.keys.add(keys['Bob'])
+        account = SSHAccount.objects.create(name='root', obj_name='group', obj_id=web.id)
+        account.keyrings.add(admins)
+        account.keys.add(keys['Bob'])
+        SSHAccount.objects.create(name='nobody', obj_name='host', obj_id=hosts[2].id)
+
+        self.migrate(MigrationLoader(connection).graph.leaf_nodes('keymgmt')[0][1])
+        self.assertEqual(effective.check_consistency(keymgmt.models.Host.objects.all()), [])
+        self.assertEqual(keymgmt.models.EffectiveAccess.objects.filter(host_id=hosts[0].id).count(), 3)
+        revision = keymgmt.models.AccessRevision.current()
+        self.assertEqual(set(keymgmt.models.Host.objects.values_list('access_revision', flat=True)), set([revision]))
+
+    def test_record_rule_memberships(self):
+        old = self.migrate('0011_effectiveaccess_account_index')
+        Environment = old.get_model('keymgmt', 'Environment')
+        Host = old.get_model('keymgmt', 'Host')
+        HostLabel = old.get_model('keymgmt', 'HostLabel')
+        Group = old.get_model('keymgmt', 'Group')
+        GroupRule = old.get_model('keymgmt', 'GroupRule')
+
+        prod = Environment.objects.create(name='production')
+        web1, web2, db1 = [Host.objects.create(name=name, environment=prod)
+                           for name in ['web1.example.com', 'web2.example.com', 'db1.example.com']]
+        HostLabel.objects.create(host=db1, key='role', value='db')
+        web = Group.objects.create(name='webservers')
+        db = Group.objects.create(name='databases')
+        GroupRule.objects.create(group=web, rule='^web1')
+        GroupRule.objects.create(group=db, rule='role=db', rule_type='selector')
+        web.hosts.add(web1, web2)
+        db.hosts.add(db1, web1)
+
+        self.migrate('0012_rulemembership')
+        self.assertEqual(sorted(keymgmt.models.RuleMembership.objects.values_list('group_id', 'host_id')),
+                         sorted([(web.id, web1.id), (db.id, db1.id)]))
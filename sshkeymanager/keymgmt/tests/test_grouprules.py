@@ -0,0 +1,97 @@
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+from keymgmt.models import *
+from keymgmt import effective
+from keymgmt import grouprules
+
+
+class GroupRuleReconcileTests(TestCase):
+    def setUp(self):
+        self.env = Environment.objects.create(name='production')
+        for name in ['web1.example.com', 'web2.example.com', 'db1.example.com', 'mail1.example.com']:
+            Host.objects.create(name=name, environment=self.env)
+        self.web = Group.objects.create(name='webservers')
+        self.db = Group.objects.create(name='databases')
+
+    def members(self, group):
+        return sorted(group.hosts.values_list('name', flat=True))
+
+    def test_backfill(self):
+        GroupRule.objects.create(group=self.web, rule='^web')
+        GroupRule.objects.create(group=self.db, rule='^db')
+        self.assertEqual(self.members(self.web), [])
+
+        self.assertEqual(grouprules.reconcile(dry_run=True), (3, 0))
+        self.assertEqual(self.members(self.web), [])
+        self.assertEqual(grouprules.reconcile(), (3, 0))
+        self.assertEqual(self.members(self.web), ['web1.example.com', 'web2.example.com'])
+        self.assertEqual(self.members(self.db), ['db1.example.com'])
+        self.assertEqual(grouprules.reconcile(), (0, 0))
+        self.assertEqual(effective.check_consistency(Host.objects.all()), [])
+
+    def test_rule_changes(self):
+        rule = GroupRule.objects.create(group=self.web, rule='^web')
+        GroupRule.objects.create(group=self.db, rule='^db')
+        grouprules.reconcile()
+        SSHAccount.objects.create(name='www-data', obj_name='group', obj_id=self.web.id)
+
+        rule.rule = '^web1'
+        rule.save()
+        self.assertEqual(grouprules.reconcile([self.web.id]), (0, 1))
+        self.assertEqual(self.members(self.web), ['web1.example.com'])
+
+        self.assertTrue(EffectiveAccess.objects.filter(account_name='www-data').exists())
+        rule.delete()
+        self.assertEqual(grouprules.reconcile([self.web.id]), (0, 1))
+        self.assertEqual(self.members(self.web), [])
+        self.assertEqual(self.members(self.db), ['db1.example.com'])
+        self.assertEqual(effective.check_consistency(Host.objects.all()), [])
+        self.assertFalse(EffectiveAccess.objects.filter(account_name='www-data').exists())
+        self.assertFalse(RuleMembership.objects.filter(group=self.web).exists())
+
+    def test_hosts_added_by_hand(self):
+        GroupRule.objects.create(group=self.db, rule='^db')
+        mail = Host.objects.get(name='mail1.example.com')
+        self.web.hosts.add(mail)
+        self.db.hosts.add(mail)
+        self.assertEqual(grouprules.reconcile([self.web.id, self.db.id]), (1, 0))
+        self.assertEqual(self.members(self.web), ['mail1.example.com'])
+        self.assertEqual(self.members(self.db), ['db1.example.com', 'mail1.example.com'])
+
+        db1 = Host.objects.get(name='db1.example.com')
+        self.db.hosts.remove(db1)
+        self.assertFalse(RuleMembership.objects.exists())
+        GroupRule.objects.all().delete()
+        self.assertEqual(grouprules.reconcile(), (0, 0))
+        self.assertEqual(self.members(self.db), ['mail1.example.com'])
+
+    def test_batches(self):
+        GroupRule.objects.create(group=self.web, rule='^web')
+        GroupRule.objects.create(group=self.db, rule='1')
+        added, removed = grouprules.membership_diff([self.web.id, self.db.id], batch_size=1)
+        self.assertEqual(len(added), 5)
+        self.assertEqual(removed, [])
+
+    def test_views(self):
+        response = self.client.post('/group/%d/rule/add/' % self.web.id, {'rule': '^web', 'rule_type': 'regex', 'group': self.web.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.members(self.web), ['web1.example.com', 'web2.example.com'])
+
+        rule = GroupRule.objects.get(group=self.web)
+        self.client.post('/group/%d/rule/%d/update/' % (self.web.id, rule.id), {'rule': '^web1', 'rule_type': 'regex', 'group': self.web.id})
+        self.assertEqual(self.members(self.web), ['web1.example.com'])
+
+        self.client.post('/group/%d/rule/%d/update/' % (self.web.id, rule.id), {'rule': '^web', 'rule_type': 'regex', 'group': self.db.id})
+        self.assertEqual(self.members(self.web), [])
+        self.assertEqual(self.members(self.db), ['web1.example.com', 'web2.example.com'])
+
+        self.client.post('/group/%d/rule/%d/delete/' % (self.db.id, rule.id))
+        self.assertEqual(self.members(self.db), [])
+
+    def test_command(self):
+        GroupRule.objects.create(group=self.web, rule='^web')
+        stdout = StringIO()
+        call_command('apply_group_rules', group=['webservers'], stdout=stdout)
+        self.assertEqual(self.members(self.web), ['web1.example.com', 'web2.example.com'])
+        self.assertIn('Added 2 and removed 0 memberships.', stdout.getvalue())
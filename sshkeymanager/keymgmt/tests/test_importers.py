@@ -1,6 +1,23 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+import requests
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from keymgmt.importer import *
+from keymgmt import importer as importer_module
 from keymgmt.models import *
+from keymgmt.validators import sshkey_fingerprint
+from keymgmt.tests.test_resolver import ssh_key
 
 
 class ImportHostTests(TestCase):
@@ -27,6 +44,78 @@ class ImportHostTests(TestCase):
         self.assertEqual(None, importer.create_host('fsdf#dsafs', env, None))
         self.assertIsNotNone(importer.create_host('fsdfdsafs', env, None))
 
+    def import_lines(self, lines, batch_size=500):
+        importer = ImportHost('tmp/foobar')
+        importer.content = [ImportHost.split_line(line) for line in lines]
+        importer.import_host(batch_size=batch_size)
+        return importer
+
+    def test_import_host(self):
+        prod = Environment.objects.create(name='production')
+        Host.objects.create(name='web1.example.com', environment=prod)
+        web = Group.objects.create(name='webservers')
+        GroupRule.objects.create(group=web, rule='^web')
+        SSHAccount.objects.create(name='deploy', obj_name='group', obj_id=web.id)
+        SSHAccount.objects.create(name='root', obj_name='environment', obj_id=prod.id)
+
+        importer = self.import_lines([
+            'web1.example.com', 'web2.example.com,,10.0.0.2', 'db1.example.com,staging', '',
+            'web2.example.com,staging', 'in#valid', 'db2.example.com,in#valid', 'db3.example.com,,10.0.0.300',
+            'web3.example.com,staging'
+        ], batch_size=2)
+        self.assertEqual(importer.import_ok, ['web2.example.com', 'db1.example.com', 'web3.example.com'])
+        self.assertEqual(importer.import_already, ['web1.example.com', 'web2.example.com'])
+        self.assertEqual(importer.import_errors, ['in#valid', 'db2.example.com', 'db3.example.com'])
+
+        self.assertEqual(Host.objects.get(name='web2.example.com').ipaddress, '10.0.0.2')
+        self.assertEqual(Host.objects.get(name='web3.example.com').environment.name, 'staging')
+        self.assertEqual(sorted(web.hosts.values_list('name', flat=True)), ['web2.example.com', 'web3.example.com'])
+        self.assertFalse(Environment.objects.filter(name='in#valid').exists())
+        for host in Host.objects.exclude(name='web1.example.com'):
+            expected = host.get_account_merged()
+            self.assertEqual(sorted(expected.keys()), sorted(
+                set(EffectiveAccess.objects.filter(host=host).values_list('account_name', flat=True))))
+            self.assertTrue(HostChange.objects.filter(host_name=host.name).exists())
+        self.assertEqual(sorted(Host.objects.get(name='web2.example.com').get_account_merged().keys()),
+                         ['deploy', 'root'])
+
+    def test_import_stream(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'hosts.csv.gz')
+            with gzip.open(filename, 'wt') as f:
+                for i in range(7):
+                    f.write('web%d.example.com,staging\n\n' % (i % 5))
+            importer = ImportHost(filename, keep_names=False)
+            progress = []
+            importer.import_stream(importer.read_lines(), batch_size=2, progress=progress.append)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(progress, [2, 4, 6, 7])
+        self.assertEqual(importer.counts, {'ok': 5, 'already': 2, 'errors': 0})
+        self.assertEqual(importer.import_ok, [])
+        self.assertEqual(Host.objects.filter(environment__name='staging').count(), 5)
+
+    def test_read_stdin(self):
+        stdin = sys.stdin
+        sys.stdin = io.StringIO('web1.example.com\n\n  \ndb1.example.com,staging,10.0.0.1\n')
+        try:
+            hosts = list(ImportHost('-').read_lines())
+        finally:
+            sys.stdin = stdin
+        self.assertEqual(hosts, [{'name': 'web1.example.com', 'env': 'production', 'ip': None},
+                                 {'name': 'db1.example.com', 'env': 'staging', 'ip': '10.0.0.1'}])
+
+    def test_import_host_queries(self):
+        Environment.objects.create(name='production')
+        GroupRule.objects.create(group=Group.objects.create(name='webservers'), rule='^web')
+        with CaptureQueriesContext(connection) as small:
+            self.import_lines(['web%d.example.com' % i for i in range(5)])
+        with CaptureQueriesContext(connection) as large:
+            self.import_lines(['web%d.example.org' % i for i in range(100)])
+        self.assertEqual(Host.objects.count(), 105)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
 
 class ImportSSHKeyTests(TestCase):
     def test_check_option(self):
@@ -37,6 +126,207 @@ class ImportSSHKeyTests(TestCase):
         self.assertEqual(importer.check_option_mode('/tmp'), 'directory')
         self.assertEqual(importer.check_option_mode('/etc/passwd'), 'file')
 
+    def test_duplicate_key_material(self):
+        SSHKey.objects.create(name='Alice', sshkey=ssh_key('alice'))
+        directory = tempfile.mkdtemp()
+        try:
+            for name, content in [('alice_work.pub', ssh_key('alice') + '@work'), ('bob.pub', ssh_key('bob')),
+                                  ('bob_laptop.pub', ssh_key('bob') + '@laptop')]:
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(content + "\n")
+            importer = ImportSSHKey([directory])
+            importer.add_keys_to_db()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([os.path.basename(key) for key in importer.sshkeys_added], ['bob.pub'])
+        self.assertEqual([os.path.basename(key) for key in importer.sshkeys_duplicates], [
+            'alice_work.pub (same key as Alice)', 'bob_laptop.pub (same key as Bob)'
+        ])
+
+    def test_workers(self):
+        SSHKey.objects.create(name='Alice', sshkey=ssh_key('alice'))
+        directory = tempfile.mkdtemp()
+        try:
+            files = [('alice.pub', ssh_key('alice2')), ('broken.pub', 'ssh-rsa no-base64 broken'),
+                     ('in#valid.pub', ssh_key('invalid'))]
+            files += [('user_%02d.pub' % i, ssh_key('user%d' % i)) for i in range(20)]
+            files += [('user_%02d_copy.pub' % i, ssh_key('user%d' % i) + '@copy') for i in range(0, 20, 5)]
+            for name, content in files:
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(content + "\n")
+            importer = ImportSSHKey([directory])
+            with CaptureQueriesContext(connection) as queries:
+                importer.add_keys_to_db(workers=4, batch_size=10)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(queries.captured_queries), 3 * 3)
+        self.assertEqual([os.path.basename(key) for key in importer.sshkeys_added_already], ['alice.pub'])
+        self.assertEqual([os.path.basename(key) for key in importer.sshkeys_added_errors], [
+            'broken.pub', 'in#valid.pub'])
+        self.assertEqual(len(importer.sshkeys_added), 20)
+        self.assertEqual(len(importer.sshkeys_duplicates), 4)
+        self.assertEqual(SSHKey.objects.get(name='User 07').fingerprint,
+                         sshkey_fingerprint(ssh_key('user7')))
+        self.assertEqual(SSHKey.objects.count(), 21)
+
+
+class StubPuppetdb(BaseHTTPRequestHandler):
+    """ answers the queries of ImportPuppetdb from the dict responses """
+    protocol_version = 'HTTP/1.1'
+    responses = {}
+    requests = []
+    queries = []
+    connections = 0
+    failures = 0
+    status = 503
+    totals = True
+
+    def setup(self):
+        StubPuppetdb.connections += 1
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        StubPuppetdb.requests.append(url.path)
+        if StubPuppetdb.failures > 0:
+            StubPuppetdb.failures -= 1
+            self.send_response(StubPuppetdb.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        rows = StubPuppetdb.responses.get(url.path, [])
+        if 'query' in params:
+            query = json.loads(params['query'][0])
+            StubPuppetdb.queries.append(query)
+            rows = [row for row in rows if StubPuppetdb.matches(query, row)]
+        total = len(rows)
+        if 'limit' in params:
+            offset = int(params['offset'][0])
+            rows = rows[offset:offset + int(params['limit'][0])]
+        body = json.dumps(rows).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if 'include_total' in params and StubPuppetdb.totals:
+            self.send_header('X-Records', str(total))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def matches(query, row):
+        """ the and, or, = and in operators of the PuppetDB query language """
+        if query[0] == 'and':
+            return all(StubPuppetdb.matches(part, row) for part in query[1:])
+        if query[0] == 'or':
+            return any(StubPuppetdb.matches(part, row) for part in query[1:])
+        if query[0] == 'in':
+            return row[query[1]] in query[2][1]
+        return row[query[1]] == query[2]
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ImportPuppetdbTests(TestCase):
+    def setUp(self):
+        self.server = StubServer(('127.0.0.1', 0), StubPuppetdb)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        StubPuppetdb.requests = []
+        StubPuppetdb.queries = []
+        StubPuppetdb.connections = 0
+        StubPuppetdb.failures = 0
+        StubPuppetdb.status = 503
+        StubPuppetdb.totals = True
+        nodes = ['node%d.example.com' % i for i in range(50)]
+        StubPuppetdb.responses = {
+            '/v4/nodes': [{'certname': node, 'catalog-environment': 'production'} for node in nodes],
+            '/v4/facts': [{'certname': node, 'name': 'ipaddress', 'value': '10.0.0.%d' % i}
+                          for i, node in enumerate(nodes) if i != 7] +
+                         [{'certname': 'node1.example.com', 'name': 'role', 'value': 'db'},
+                          {'certname': 'node1.example.com', 'name': 'kernel', 'value': 'Linux'}],
+            '/v4/resources/User': [{'certname': node, 'title': user} for node in nodes for user in ['root', 'app']],
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def importer(self, **options):
+        puppetdb = {'HOST': '127.0.0.1', 'PORT': self.server.server_address[1], 'SSL_VERIFY': True,
+                    'SSL_KEY': None, 'SSL_CERT': None, 'TIMEOUT': 5, 'LABEL_FACTS': ['role']}
+        puppetdb.update(options)
+        with self.settings(PUPPETDB=puppetdb):
+            return ImportPuppetdb()
+
+    def test_nodes(self):
+        nodes = self.importer().nodes()
+        self.assertEqual(len(nodes), 50)
+        self.assertEqual(nodes[1], {'name': 'node1.example.com', 'ip': '10.0.0.1', 'env': 'production',
+                                    'labels': {'role': 'db'}})
+        self.assertIsNone(nodes[7]['ip'])
+        self.assertEqual(sorted(StubPuppetdb.requests), ['/v4/facts', '/v4/nodes'])
+        self.assertEqual(StubPuppetdb.connections, 1)
+
+    def test_pages(self):
+        expected = self.importer().nodes()
+        StubPuppetdb.requests = []
+        importer = self.importer(PAGE_SIZE=7, WORKERS=3)
+        self.assertEqual(importer.nodes(), expected)
+        self.assertEqual(StubPuppetdb.requests.count('/v4/nodes'), 8)
+        self.assertEqual(StubPuppetdb.requests.count('/v4/facts'), 8)
+        self.assertEqual(importer.timings['/nodes']['requests'], 8)
+        self.assertEqual(importer.timings['/facts']['rows'], 50)
+        certnames = [query[2][2][1] for query in StubPuppetdb.queries[1:]]
+        self.assertEqual(sorted(len(names) for names in certnames), [1] + [7] * 7)
+        self.assertEqual(importer.timings['/nodes']['rows'], 50)
+        self.assertEqual(importer.users(), ['root', 'app'])
+        self.assertEqual(importer.timings['/resources/User']['rows'], 100)
+
+        StubPuppetdb.totals = False
+        StubPuppetdb.requests = []
+        self.assertEqual(self.importer(PAGE_SIZE=10).nodes(), expected)
+        self.assertEqual(StubPuppetdb.requests.count('/v4/nodes'), 6)
+
+        fact_nodes = importer_module.FACT_NODES
+        importer_module.FACT_NODES = 3
+        try:
+            StubPuppetdb.requests = []
+            self.assertEqual(self.importer(PAGE_SIZE=7, WORKERS=3).nodes(), expected)
+            self.assertEqual(StubPuppetdb.requests.count('/v4/facts'), 7 * 3 + 1)
+        finally:
+            importer_module.FACT_NODES = fact_nodes
+
+    def test_retries(self):
+        delay = importer_module.RETRY_DELAY
+        importer_module.RETRY_DELAY = 0
+        try:
+            StubPuppetdb.failures = 2
+            self.assertEqual(len(self.importer(RETRIES=2).nodes()), 50)
+            StubPuppetdb.failures = 2
+            stderr = sys.stderr
+            sys.stderr = io.StringIO()
+            try:
+                with self.assertRaises(requests.HTTPError):
+                    self.importer(RETRIES=1).users()
+                self.assertEqual(sys.stderr.getvalue(), 'Error: with connecting to PuppetDB\n')
+
+                StubPuppetdb.requests = []
+                StubPuppetdb.failures = 1
+                StubPuppetdb.status = 403
+                with self.assertRaises(requests.HTTPError):
+                    self.importer(RETRIES=3).users()
+                self.assertEqual(StubPuppetdb.requests, ['/v4/resources/User'])
+            finally:
+                sys.stderr = stderr
+        finally:
+            importer_module.RETRY_DELAY = delay
+
 
 class ImportSSHAccountAvailableTest(TestCase):   
     def test_import(self):
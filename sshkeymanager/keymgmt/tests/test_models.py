@@ -1,6 +1,9 @@
+import re
 from django.test import TestCase
 from django.core.exceptions import ValidationError
 from keymgmt.models import *
+from keymgmt import effective
+from keymgmt.tests.test_resolver import ssh_key
 
 
 SSH_KEY_RSA='ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDIsM1GrbmWR+3jzd2njnmimjrlmPcG5CDFIZMq/AHAckbhLD+ja5Kdw0SO8jxIKiojoqlwHBiMCKN/6MjXW/4O5h4KA0fyRSL1d1pT645Psf9FLWjThoYjGrac6eJ3uFYfDjeYvJZyPtADZtwfTCi7SyuRXfwK8OMsfK1QbZEIEDrLC7Yy5/mtXWIHwQjX2OyAz4YHlPe03L0ZdIJz6juKa4aei41G+tkWzx/O35CT5vXr2hXJWIeKDhu8jS7s7OcBiv2jq/HQt87CqoSrLL1gEErL10HJpF819iAOR79mHy+0DS7eN/jb7fi4lVhCpBnB9AtaUMc65CzP7yhUTgOJ Foo Bar'
@@ -172,6 +175,71 @@ class GroupTests(TestCase):
         self.assertIsNone(group.delete())
         self.assertEqual(len(SSHAccount.objects.all()), 0)
 
+    def closure(self):
+        return sorted(GroupClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def test_closure(self):
+        root = Group.objects.create(name='all')
+        web = Group.objects.create(name='web', parent=root)
+        frontend = Group.objects.create(name='frontend', parent=web)
+        db = Group.objects.create(name='db', parent=root)
+        self.assertEqual(self.closure(), [
+            ('all', 'all', 0), ('all', 'db', 1), ('all', 'frontend', 2), ('all', 'web', 1),
+            ('db', 'db', 0), ('frontend', 'frontend', 0), ('web', 'frontend', 1), ('web', 'web', 0)
+        ])
+        self.assertEqual([group.name for group in frontend.get_ancestors()], ['web', 'all'])
+
+        web.parent = db
+        web.save()
+        self.assertEqual([group.name for group in frontend.get_ancestors()], ['web', 'db', 'all'])
+        incremental = self.closure()
+        GroupClosure.rebuild()
+        self.assertEqual(self.closure(), incremental)
+
+        root.parent = frontend
+        with self.assertRaises(ValidationError):
+            root.full_clean()
+
+        db.delete()
+        self.assertIsNone(Group.objects.get(name='web').parent)
+        self.assertEqual([group.name for group in frontend.get_ancestors()], ['web'])
+        self.assertEqual(self.closure(), [
+            ('all', 'all', 0), ('frontend', 'frontend', 0), ('web', 'frontend', 1), ('web', 'web', 0)
+        ])
+
+    def test_closure_bulk_delete(self):
+        env = Environment.objects.create(name='production')
+        root = Group.objects.create(name='all')
+        web = Group.objects.create(name='web', parent=root)
+        frontend = Group.objects.create(name='frontend', parent=web)
+        host = Host.objects.create(name='web1.example.com', environment=env)
+        frontend.hosts.add(host)
+        SSHAccount.objects.create(name='deploy', obj_name='group', obj_id=root.id)
+        self.assertTrue(EffectiveAccess.objects.filter(host=host, account_name='deploy').exists())
+
+        Group.objects.filter(name__in=['all', 'web']).delete()
+        self.assertIsNone(Group.objects.get(name='frontend').parent)
+        self.assertEqual(self.closure(), [('frontend', 'frontend', 0)])
+        self.assertEqual(SSHAccount.objects.count(), 0)
+        self.assertFalse(EffectiveAccess.objects.filter(host=host).exists())
+        self.assertEqual(effective.check_consistency(Host.objects.all()), [])
+
+    def test_hosts_and_groups(self):
+        env = Environment.objects.create(name='production')
+        root = Group.objects.create(name='all')
+        web = Group.objects.create(name='web', parent=root)
+        frontend = Group.objects.create(name='frontend', parent=web)
+        host = Host.objects.create(name='web1.example.com', environment=env)
+        other = Host.objects.create(name='web2.example.com', environment=env)
+        frontend.hosts.add(host)
+        web.hosts.add(host, other)
+
+        with self.assertNumQueries(1):
+            self.assertEqual([group.name for group in host.get_groups()], ['all', 'frontend', 'web'])
+        with self.assertNumQueries(1):
+            self.assertEqual([h.name for h in root.get_hosts()], ['web1.example.com', 'web2.example.com'])
+        self.assertEqual([h.name for h in frontend.get_hosts()], ['web1.example.com'])
+
         
 
 class GroupRuleTests(TestCase):
@@ -203,6 +271,64 @@ class GroupRuleTests(TestCase):
             grouprule.save()
 
 
+    def test_matcher(self):
+        web = Group.objects.create(name='webservers')
+        db = Group.objects.create(name='databases')
+        GroupRule.objects.create(group=web, rule='^web')
+        GroupRule.objects.create(group=db, rule='db[0-9]')
+        GroupRule.objects.create(group=web, rule='db[0-9]')
+
+        matcher = GroupRule.matcher()
+        self.assertEqual(len(matcher.rules), 2)
+        self.assertEqual(matcher.groups_for('webdb1.example.com'), set([web.id, db.id]))
+        self.assertEqual(matcher.groups_for('mail1.example.com'), set())
+        self.assertIs(GroupRule.matcher(), matcher)
+
+        patterns = RuleMatcher.patterns
+        self.assertEqual(sorted(patterns.keys()), ['^web', 'db[0-9]'])
+        rule = GroupRule.objects.create(group=db, rule='^mail')
+        matcher = GroupRule.matcher()
+        self.assertEqual(matcher.groups_for('mail1.example.com'), set([db.id]))
+        self.assertEqual(sorted(patterns.keys()), ['^web', 'db[0-9]'])
+        self.assertIs(RuleMatcher.patterns, matcher.patterns)
+        self.assertIs(matcher.patterns['^web'], patterns['^web'])
+        rule.delete()
+        self.assertEqual(GroupRule.matcher().groups_for('mail1.example.com'), set())
+
+    def test_matcher_index(self):
+        self.assertEqual(RuleMatcher.literal_prefix('^web[0-9]+'), 'web')
+        self.assertEqual(RuleMatcher.literal_prefix('^webs?'), 'web')
+        self.assertEqual(RuleMatcher.literal_prefix('^db.example'), 'db')
+        self.assertEqual(RuleMatcher.literal_prefix('^db|web'), '')
+        self.assertEqual(RuleMatcher.literal_prefix('db1'), '')
+
+        rules = ['^web', '^web1', '^webs?1', '^web+1', '^w{2}', 'db', '^db|mail', '^mail\\.', '^(db|web)2', '1$', '^$']
+        matcher = RuleMatcher((rule, i) for i, rule in enumerate(rules))
+        for hostname in ['web1.example.com', 'wb1', 'db2.example.com', 'mail.example.com', 'mail1', 'ww', 'w', '']:
+            expected = set(i for i, rule in enumerate(rules) if re.search(rule, hostname))
+            self.assertEqual(matcher.groups_for(hostname), expected, hostname)
+
+    def test_apply_to_hosts(self):
+        env = Environment.objects.create(name='production')
+        web = Group.objects.create(name='webservers')
+        db = Group.objects.create(name='databases')
+        GroupRule.objects.create(group=web, rule='^web')
+        GroupRule.objects.create(group=db, rule='db')
+
+        host = Host.objects.create(name='webdb1.example.com', environment=env)
+        self.assertEqual(sorted(host.group_set.values_list('name', flat=True)), ['databases', 'webservers'])
+        with self.assertNumQueries(2):
+            self.assertEqual(GroupRule.apply_to_hosts([host]), 0)
+
+        hosts = [Host(name='web%d.example.com' % i, environment=env) for i in range(5)]
+        Host.objects.bulk_create(hosts)
+        hosts = list(Host.objects.filter(name__startswith='web'))
+        self.assertEqual(GroupRule.apply_to_hosts(hosts), 5)
+        self.assertEqual(web.hosts.count(), 6)
+        self.assertEqual(db.hosts.count(), 1)
+        self.assertEqual(effective.check_consistency(Host.objects.all()), [])
+
+
 class SSHKeyTests(TestCase):
     def test_name(self):
         key = SSHKey(name='fsdf#+fds ', sshkey=SSH_KEY_RSA)
@@ -217,7 +343,38 @@ class SSHKeyTests(TestCase):
         self.assertIsNone(key.full_clean())
         self.assertIsNone(key.save())
         self.assertEqual(key.ssh_key_entry(),  SSH_KEY_RSA + ' Foo Bar')
-        
+
+    def test_fingerprint(self):
+        key = SSHKey.objects.create(name='Foo Bar', sshkey=SSH_KEY_RSA)
+        self.assertEqual(key.fingerprint, 'SHA256:9CEnYkd7IUGFQ/tqhG2Nuf23pVCYNW7dOV4snOa/vK0')
+        self.assertEqual(SSHKey.objects.get(fingerprint=key.fingerprint), key)
+
+        duplicate = SSHKey(name='Other', sshkey=SSH_KEY_RSA.replace('Foo Bar', 'other comment'))
+        with self.assertRaisesMessage(ValidationError, 'Fingerprint already exists'):
+            duplicate.full_clean()
+        invalid = SSHKey(name='Invalid', sshkey='ssh-rsa AAAA#B3Nz foo')
+        with self.assertRaisesMessage(ValidationError, 'not base64'):
+            invalid.full_clean()
+
+    def test_duplicate_key_views(self):
+        alice = SSHKey.objects.create(name='Alice', sshkey=SSH_KEY_RSA)
+        response = self.client.post('/sshkey/add/', {'name': 'Bob', 'sshkey': SSH_KEY_RSA.replace('Foo Bar', 'bob')})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Key material already used by SSH Key Alice')
+        self.assertFalse(SSHKey.objects.filter(name='Bob').exists())
+
+        # a duplicate left without fingerprint by migration 0010
+        legacy = SSHKey.objects.create(name='Legacy', sshkey=ssh_key('legacy'))
+        SSHKey.objects.filter(pk=legacy.pk).update(sshkey=SSH_KEY_RSA.replace('Foo Bar', 'legacy'), fingerprint=None)
+        response = self.client.post('/sshkey/%d/update/' % legacy.pk,
+                                    {'name': 'Legacy Key', 'sshkey': SSH_KEY_RSA.replace('Foo Bar', 'legacy')})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Key material already used by SSH Key Alice')
+        self.assertEqual(SSHKey.objects.get(pk=legacy.pk).name, 'Legacy')
+
+        response = self.client.post('/sshkey/%d/update/' % alice.pk, {'name': 'Alice A', 'sshkey': SSH_KEY_RSA})
+        self.assertEqual(response.status_code, 302)
+
 
     def test_filename2name(self):
         """
@@ -319,4 +476,61 @@ class SSHAccountTests(TestCase):
         account = SSHAccount(name='root', obj_name='group', obj_id=group.id)
         self.assertIsNone(account.clean())
         self.assertIsNone(account.full_clean())
-        self.assertIsNone(account.save())
\ No newline at end of file
+        self.assertIsNone(account.save())
+
+    def test_with_objects(self):
+        env = Environment.objects.create(name='production')
+        group = Group.objects.create(name='webservers')
+        hosts = [Host.objects.create(name='web%d.example.com' % i, environment=env) for i in range(3)]
+        SSHAccount.objects.create(name='root', obj_name='environment', obj_id=env.id)
+        SSHAccount.objects.create(name='root', obj_name='group', obj_id=group.id)
+        for host in hosts:
+            SSHAccount.objects.create(name='root', obj_name='host', obj_id=host.id)
+            SSHAccount.objects.create(name='app', obj_name='host', obj_id=host.id)
+
+        with self.assertNumQueries(4):
+            accounts = SSHAccount.with_objects(SSHAccount.objects.all())
+            names = sorted(account.get_object().name for account in accounts)
+        self.assertEqual(names, ['production', 'web0.example.com', 'web0.example.com', 'web1.example.com',
+                                 'web1.example.com', 'web2.example.com', 'web2.example.com', 'webservers'])
+        self.assertEqual(SSHAccount.with_objects([]), [])
+
+    def test_update_keys(self):
+        env = Environment.objects.create(name='production')
+        host = Host.objects.create(name='web1.example.com', environment=env)
+        account = SSHAccount.objects.create(name='root', obj_name='host', obj_id=host.id)
+        for name in ['Alice', 'Bob', 'Carol', 'Dave']:
+            SSHKey.objects.create(name=name, sshkey=ssh_key(name))
+        keyring = SSHKeyring.objects.create(name='admins')
+
+        self.assertEqual(account.update_keys('Alice,Bob,Mallory, ,Eve'), ['Eve', 'Mallory'])
+        self.assertEqual(sorted(account.keys.values_list('name', flat=True)), ['Alice', 'Bob'])
+        self.assertEqual(account.update_keyrings('admins,devs'), ['devs'])
+        self.assertEqual(list(account.keyrings.all()), [keyring])
+
+        through = SSHAccount.keys.through
+        bob = through.objects.get(sshaccount=account, sshkey__name='Bob')
+        self.assertEqual(account.update_keys('Bob, Carol,Dave'), [])
+        self.assertEqual(sorted(account.keys.values_list('name', flat=True)), ['Bob', 'Carol', 'Dave'])
+        self.assertTrue(through.objects.filter(id=bob.id).exists())
+        self.assertEqual(list(EffectiveAccess.objects.filter(host=host).values_list('sshkey__name', flat=True)),
+                         ['Bob', 'Carol', 'Dave'])
+
+        self.assertEqual(account.update_keys(''), [])
+        self.assertEqual(account.keys.count(), 0)
+        self.assertEqual(keyring.add_keys('Alice,Dave,Mallory'), ['Mallory'])
+        self.assertEqual(sorted(keyring.keys.values_list('name', flat=True)), ['Alice', 'Dave'])
+
+    def test_update_keys_queries(self):
+        account = SSHAccount.objects.create(name='root', obj_name='group', obj_id=Group.objects.create(name='web').id)
+        names = []
+        for i in range(50):
+            names.append('Key %d' % i)
+            SSHKey.objects.create(name=names[-1], sshkey=ssh_key(names[-1]))
+        account.update_keys(','.join(names[:5]))
+
+        with self.assertNumQueries(10):
+            account.update_keys(','.join(names[1:]))
+        self.assertEqual(account.keys.count(), 49)
+        with self.assertNumQueries(4):
+            account.update_keys(','.join(names[1:]))
@@ -0,0 +1,150 @@
+import base64
+from django.test import TestCase
+from keymgmt.models import *
+from keymgmt.resolver import *
+
+
+SSH_KEY_RSA='ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDIsM1GrbmWR+3jzd2njnmimjrlmPcG5CDFIZMq/AHAckbhLD+ja5Kdw0SO8jxIKiojoqlwHBiMCKN/6MjXW/4O5h4KA0fyRSL1d1pT645Psf9FLWjThoYjGrac6eJ3uFYfDjeYvJZyPtADZtwfTCi7SyuRXfwK8OMsfK1QbZEIEDrLC7Yy5/mtXWIHwQjX2OyAz4YHlPe03L0ZdIJz6juKa4aei41G+tkWzx/O35CT5vXr2hXJWIeKDhu8jS7s7OcBiv2jq/HQt87CqoSrLL1gEErL10HJpF819iAOR79mHy+0DS7eN/jb7fi4lVhCpBnB9AtaUMc65CzP7yhUTgOJ'
+
+
+def ssh_key(comment):
+    """ a public key with key material of its own for every comment """
+    blob = base64.b64decode(SSH_KEY_RSA.split()[1]) + comment.encode('utf-8')
+    return 'ssh-rsa ' + base64.b64encode(blob).decode('ascii') + ' ' + comment
+
+
+def create_fleet():
+    """
+    creates two environments, three hosts and two groups with accounts
+    on every level and keys that are reachable directly and via keyrings
+    """
+    prod = Environment.objects.create(name='production')
+    staging = Environment.objects.create(name='staging')
+    web = Group.objects.create(name='webservers')
+    db = Group.objects.create(name='databases')
+    GroupRule.objects.create(group=web, rule='^web')
+    GroupRule.objects.create(group=db, rule='^db')
+    GroupRule.objects.create(group=db, rule='^webdb')
+
+    hosts = [
+        Host.objects.create(name='web1.example.com', environment=prod),
+        Host.objects.create(name='webdb1.example.com', environment=prod),
+        Host.objects.create(name='db1.example.com', environment=staging),
+    ]
+
+    keys = {}
+    for name in ['Alice', 'Bob', 'Carol', 'Dave']:
+        keys[name] = SSHKey.objects.create(name=name, sshkey=ssh_key(name.lower()))
+
+    admins = SSHKeyring.objects.create(name='Admins')
+    admins.keys.add(keys['Carol'], keys['Alice'])
+    devs = SSHKeyring.objects.create(name='Developers')
+    devs.keys.add(keys['Dave'], keys['Bob'])
+
+    account = SSHAccount.objects.create(name='root', obj_name='environment', obj_id=prod.id)
+    account.keyrings.add(devs, admins)
+    account.keys.add(keys['Dave'])
+    account = SSHAccount.objects.create(name='deploy', obj_name='environment', obj_id=staging.id)
+    account.keys.add(keys['Bob'])
+    account = SSHAccount.objects.create(name='root', obj_name='group', obj_id=web.id)
+    account.keys.add(keys['Bob'], keys['Alice'])
+    account = SSHAccount.objects.create(name='www-data', obj_name='group', obj_id=web.id)
+    account.keyrings.add(devs)
+    account = SSHAccount.objects.create(name='postgres', obj_name='group', obj_id=db.id)
+    account.keyrings.add(admins)
+    account = SSHAccount.objects.create(name='root', obj_name='host', obj_id=hosts[1].id)
+    account.keys.add(keys['Carol'])
+    SSHAccount.objects.create(name='nobody', obj_name='host', obj_id=hosts[2].id)
+    return hosts
+
+
+class AccountResolverTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def test_same_as_get_account_merged(self):
+        resolver = AccountResolver(Host.objects.all())
+        self.assertEqual(len(resolver.all()), 3)
+        for host, accounts in resolver.all():
+            expected = host.get_account_merged()
+            self.assertEqual(list(accounts.keys()), list(expected.keys()))
+            for name, keys in expected.items():
+                self.assertEqual(accounts[name], keys)
+
+    def test_merge_order(self):
+        resolver = AccountResolver(Host.objects.filter(name='webdb1.example.com'))
+        accounts = resolver.get_account_merged(self.hosts[1])
+        self.assertEqual(list(accounts.keys()), ['root', 'postgres', 'www-data'])
+        self.assertEqual([key.name for key in accounts['root']], ['Carol', 'Dave', 'Alice', 'Bob'])
+        self.assertEqual([key.name for key in accounts['postgres']], ['Alice', 'Carol'])
+        accounts = AccountResolver(Host.objects.all()).get_account_merged(self.hosts[2])
+        self.assertEqual(accounts['nobody'], [])
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(8):
+            AccountResolver(Host.objects.all()).all()
+        for i in range(10):
+            Host.objects.create(name='web%d.example.org' % i, environment=self.hosts[0].environment)
+        with self.assertNumQueries(8):
+            AccountResolver(Host.objects.all()).all()
+
+    def test_filtered_hosts(self):
+        resolver = AccountResolver(Host.objects.filter(group__name='databases'))
+        self.assertEqual([host.name for host, accounts in resolver.all()], ['db1.example.com', 'webdb1.example.com'])
+        for host, accounts in resolver.all():
+            self.assertEqual(accounts, host.get_account_merged())
+
+    def test_nested_groups(self):
+        root = Group.objects.create(name='all')
+        account = SSHAccount.objects.create(name='backup', obj_name='group', obj_id=root.id)
+        account.keys.add(SSHKey.objects.get(name='Dave'))
+        account = SSHAccount.objects.create(name='root', obj_name='group', obj_id=root.id)
+        account.keys.add(SSHKey.objects.get(name='Carol'))
+        web = Group.objects.get(name='webservers')
+        web.parent = root
+        web.save()
+
+        accounts = AccountResolver(Host.objects.all()).get_account_merged(self.hosts[0])
+        self.assertEqual(list(accounts.keys()), ['root', 'backup', 'www-data'])
+        self.assertEqual([key.name for key in accounts['root']], ['Dave', 'Alice', 'Carol', 'Bob'])
+        self.assertEqual([key.name for key in accounts['backup']], ['Dave'])
+        self.assertNotIn('backup', AccountResolver(Host.objects.all()).get_account_merged(self.hosts[2]))
+        for host, accounts in AccountResolver(Host.objects.all()).all():
+            self.assertEqual(accounts, host.get_account_merged())
+
+
+class KeyReachTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+
+    def expected(self, key):
+        """ host and account of every EffectiveAccess row of the key """
+        return sorted(set(EffectiveAccess.objects.filter(sshkey=key).values_list('host__name', 'account_name')))
+
+    def test_same_as_effective_access(self):
+        root = Group.objects.create(name='all')
+        web = Group.objects.get(name='webservers')
+        web.parent = root
+        web.save()
+        SSHAccount.objects.create(name='backup', obj_name='group', obj_id=root.id).keys.add(
+            SSHKey.objects.get(name='Carol'))
+
+        reach = KeyReach(SSHKey.objects.all())
+        for key, access in reach.all():
+            self.assertEqual([(host, account) for host, account, sources in access], self.expected(key))
+
+    def test_sources(self):
+        alice = SSHKey.objects.get(name='Alice')
+        access = KeyReach([alice]).reach(alice)
+        self.assertEqual(access[0], ('db1.example.com', 'postgres', [('group', 'databases', 'Admins')]))
+        self.assertIn(('web1.example.com', 'root', [
+            ('environment', 'production', 'Admins'), ('group', 'webservers', None)
+        ]), access)
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(10):
+            KeyReach(SSHKey.objects.all()).all()
+        for i in range(10):
+            Host.objects.create(name='web%d.example.org' % i, environment=self.hosts[0].environment)
+        with self.assertNumQueries(10):
+            KeyReach(SSHKey.objects.all()).all()
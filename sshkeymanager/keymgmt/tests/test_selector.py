@@ -0,0 +1,78 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from keymgmt.models import *
+from keymgmt.selector import parse_selector, split_terms
+from keymgmt import grouprules
+
+
+class SelectorParserTests(TestCase):
+    def test_split_terms(self):
+        self.assertEqual(split_terms('role=db, dc in (fra1,ams2)'), ['role=db', 'dc in (fra1,ams2)'])
+        with self.assertRaises(ValueError):
+            split_terms('dc in (fra1')
+
+    def test_parse_selector(self):
+        self.assertEqual(parse_selector('role=db,role==web,env!=dev'), [
+            ('role', 'in', ['db']), ('role', 'in', ['web']), ('env', 'notin', ['dev'])
+        ])
+        self.assertEqual(parse_selector('dc in (fra1, ams2),dc notin (lon1)'), [
+            ('dc', 'in', ['fra1', 'ams2']), ('dc', 'notin', ['lon1'])
+        ])
+        self.assertEqual(parse_selector('virtual, !legacy'), [('virtual', 'exists', []), ('legacy', '!exists', [])])
+        for selector in ['', 'role=', 'role=db,', 'dc in fra1', 'dc in (fra1,)', 'role=d b']:
+            with self.assertRaises(ValueError):
+                parse_selector(selector)
+
+
+class HostLabelTests(TestCase):
+    def setUp(self):
+        self.env = Environment.objects.create(name='production')
+        self.db1 = Host.objects.create(name='db1.example.com', environment=self.env)
+        self.db2 = Host.objects.create(name='db2.example.com', environment=self.env)
+        self.web1 = Host.objects.create(name='web1.example.com', environment=self.env)
+        self.db1.set_labels({'role': 'db', 'dc': 'fra1'})
+        self.db2.set_labels({'role': 'db', 'dc': 'lon1', 'legacy': 'true'})
+        self.web1.set_labels({'role': 'web', 'dc': 'ams2'})
+
+    def select(self, selector):
+        return sorted(HostLabel.select(selector).values_list('name', flat=True))
+
+    def test_set_labels(self):
+        self.assertFalse(self.db1.set_labels({'role': 'db', 'dc': 'fra1'}))
+        self.assertTrue(self.db1.set_labels({'role': 'db', 'os': 'debian'}))
+        self.assertEqual(dict(self.db1.hostlabel_set.values_list('key', 'value')), {'role': 'db', 'os': 'debian'})
+        self.assertTrue(self.db1.set_labels({}))
+        self.assertFalse(self.db1.hostlabel_set.exists())
+
+    def test_select(self):
+        self.assertEqual(self.select('role=db'), ['db1.example.com', 'db2.example.com'])
+        self.assertEqual(self.select('role=db,dc in (fra1,ams2)'), ['db1.example.com'])
+        self.assertEqual(self.select('dc notin (fra1,lon1)'), ['web1.example.com'])
+        self.assertEqual(self.select('role!=web,!legacy'), ['db1.example.com'])
+        self.assertEqual(self.select('legacy'), ['db2.example.com'])
+        with self.assertNumQueries(1):
+            self.select('role=db,dc!=lon1,!legacy')
+
+    def test_selector_rules(self):
+        group = Group.objects.create(name='databases')
+        rule = GroupRule(group=group, rule_type='selector', rule='role=db,dc in (fra1')
+        with self.assertRaises(ValidationError):
+            rule.full_clean()
+        rule.rule = 'role=db,dc in (fra1,ams2)'
+        rule.full_clean()
+        rule.save()
+        self.assertTrue(rule.rule_match_host('db1.example.com'))
+        self.assertFalse(rule.rule_match_host('db2.example.com'))
+
+        self.assertEqual(grouprules.reconcile(), (1, 0))
+        self.assertEqual(list(group.hosts.values_list('name', flat=True)), ['db1.example.com'])
+
+        self.db2.set_labels({'role': 'db', 'dc': 'ams2'})
+        self.db1.set_labels({'role': 'db', 'dc': 'lon1'})
+        self.assertEqual(grouprules.reconcile_labels([self.db1.id, self.db2.id]), (1, 1))
+        self.assertEqual(list(group.hosts.values_list('name', flat=True)), ['db2.example.com'])
+
+        host = Host.objects.create(name='db3.example.com', environment=self.env)
+        host.set_labels({'role': 'db', 'dc': 'fra1'})
+        GroupRule.apply_to_hosts([host])
+        self.assertEqual(sorted(group.hosts.values_list('name', flat=True)), ['db2.example.com', 'db3.example.com'])
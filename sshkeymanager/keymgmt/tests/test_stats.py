@@ -0,0 +1,57 @@
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from keymgmt.models import *
+from keymgmt import stats
+from keymgmt.tests.test_resolver import create_fleet
+
+
+@override_settings(STATS_CACHE='stats', CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'stats': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats-tests'}
+})
+class StatsTests(TestCase):
+    def setUp(self):
+        self.hosts = create_fleet()
+        caches['stats'].clear()
+
+    def test_compute(self):
+        with self.assertNumQueries(2):
+            result = stats.compute()
+        self.assertEqual(result['account_count'], 7)
+        self.assertEqual(result['environment_count'], 2)
+        self.assertEqual(result['host_count'], 3)
+        self.assertEqual(result['group_count'], 2)
+        self.assertEqual(result['sshkey_count'], 4)
+        self.assertEqual(result['sshkeyring_count'], 2)
+        self.assertEqual(result['accounts_without_keys'], 1)
+        self.assertEqual(result['keys_per_type'], [('ssh-rsa', 4), ('ssh-dss', 0), ('ecdsa-sha2-nistp256', 0)])
+        self.assertEqual(result['hosts_per_environment'], [('production', 2), ('staging', 1)])
+        self.assertEqual(stats.orm_totals(), stats.totals())
+
+    def test_cache(self):
+        with self.assertNumQueries(2):
+            stats.get_stats()
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_stats()['host_count'], 3)
+
+        Host.objects.create(name='web2.example.com', environment=self.hosts[0].environment)
+        self.assertEqual(stats.get_stats()['host_count'], 4)
+
+        account = SSHAccount.objects.get(name='nobody')
+        account.keys.add(SSHKey.objects.first())
+        self.assertEqual(stats.get_stats()['accounts_without_keys'], 0)
+        account.keys.clear()
+        self.assertEqual(stats.get_stats()['accounts_without_keys'], 1)
+
+        self.hosts[2].environment = self.hosts[0].environment
+        self.hosts[2].save()
+        self.assertEqual(stats.get_stats()['hosts_per_environment'], [('production', 4), ('staging', 0)])
+
+        SSHKeyring.objects.get(name='Admins').delete()
+        self.assertEqual(stats.get_stats()['sshkeyring_count'], 1)
+
+    def test_home(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/')
+        self.assertContains(response, 'Accounts without SSH Keys')
+        self.assertContains(response, 'staging')
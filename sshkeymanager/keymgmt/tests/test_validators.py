@@ -22,4 +22,15 @@ class GroupRuleRegexValidatorTests(TestCase):
     def test_validate_regex(self):
         self.assertIsNone(validate_regex('^web[0-9]+\.example.com$'))
         with self.assertRaisesMessage(ValidationError, 'Rule not valid'):
-            validate_regex('^[fadsfsd')
\ No newline at end of file
+            validate_regex('^[fadsfsd')
+
+
+class SSHKeyFingerprintTests(TestCase):
+    def test_sshkey_fingerprint(self):
+        """ the same as ssh-keygen -lf prints """
+        self.assertEqual(sshkey_fingerprint(SSH_KEY_RSA), 'SHA256:9CEnYkd7IUGFQ/tqhG2Nuf23pVCYNW7dOV4snOa/vK0')
+        self.assertEqual(sshkey_fingerprint(SSH_KEY_RSA.replace('Foo Bar', 'other')), sshkey_fingerprint(SSH_KEY_RSA))
+        with self.assertRaises(ValueError):
+            sshkey_fingerprint('ssh-rsa')
+        with self.assertRaises(ValueError):
+            sshkey_fingerprint('ssh-rsa AAAAB3Nz#aC1yc2E foo')
@@ -16,6 +16,7 @@ from keymgmt.views import (
     GroupCreate,
     GroupDelete,
     GroupDetail,
+    GroupUpdate,
     HostList,
     HostCreate,
     HostDetail,
@@ -40,7 +41,13 @@ from keymgmt.views import (
     GroupRuleDelete,
     GroupRuleUpdate,
     AuditKey2Access,
+    audit_key2access_csv,
     api_get_keys,
+    api_changes,
+    api_stats,
+    api_sshkey,
+    api_sshkey_reach,
+    api_authorized_keys,
 )
 
 urlpatterns = patterns('',
@@ -58,6 +65,7 @@ urlpatterns = patterns('',
 
     url(r'^group/$', GroupList.as_view(), name='group_list'),
     url(r'^group/add/$', GroupCreate.as_view(), name='group_create'),
+    url(r'^group/(?P<pk>[0-9]+)/update/$', GroupUpdate.as_view(), name='group_update'),
     url(r'^group/(?P<pk>[0-9]+)/delete/$', GroupDelete.as_view(), name='group_delete'),
     url(r'^group/(?P<pk>[0-9]+)/$', GroupDetail.as_view(), name='group_detail'),
 
@@ -90,8 +98,14 @@ urlpatterns = patterns('',
     url(r'^sshaccountavailable/(?P<pk>[0-9]+)/delete/$', SSHAccountAvailableDelete.as_view(), name='sshaccountavailable_delete'),
 
     url(r'^audit/key2access/$', AuditKey2Access.as_view(), name='audit_key2access'),
+    url(r'^audit/key2access/csv/$', audit_key2access_csv, name='audit_key2access_csv'),
 
     url(r'^api/getkeys/$', api_get_keys),
+    url(r'^api/changes/$', api_changes),
+    url(r'^api/stats/$', api_stats),
+    url(r'^api/sshkey/$', api_sshkey),
+    url(r'^api/sshkey/reach/$', api_sshkey_reach),
+    url(r'^api/authorized_keys/(?P<host>[0-9A-Za-z_.-]+)/(?P<account>[0-9A-Za-z_.-]+)/?$', api_authorized_keys),
 
     url(r'^$', HomeView.as_view(), name='home'),
 )
@@ -1,4 +1,7 @@
 from django.core.exceptions import ValidationError
+import base64
+import binascii
+import hashlib
 import re
 import sre_constants
 
@@ -16,3 +19,18 @@ def validate_sshkey(value):
         value = value.strip().rstrip()
     if re.search(r'^(ecdsa-sha2-nistp256|ssh-dss|ssh-rsa)\s([^\s\n]+) [^\n]+$', value) is None:
         raise ValidationError('%s is not a valid SSH Public Key' % value)
+
+
+def sshkey_fingerprint(value):
+    """
+    SHA256 fingerprint of the key material as printed by ssh-keygen -l,
+    without the comment. Raises ValueError if the key is not base64.
+    """
+    parts = value.split()
+    if len(parts) < 2:
+        raise ValueError('no key material found')
+    try:
+        blob = base64.b64decode(parts[1].encode('ascii'), validate=True)
+    except (binascii.Error, UnicodeEncodeError):
+        raise ValueError('key material is not base64')
+    return 'SHA256:' + base64.b64encode(hashlib.sha256(blob).digest()).decode('ascii').rstrip('=')
@@ -7,15 +7,28 @@ from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib import messages
 from django.conf import settings
+from django.db.models import Count
 from django.utils.translation import ugettext as _
 from django.core.urlresolvers import reverse_lazy
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponse, HttpResponseRedirect, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag, urlencode
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 import json
-
-from keymgmt.key import KeyAccess
+import hashlib
+
+from keymgmt.key import KeyAccess, json_stream
+from keymgmt.resolver import AccountResolver, KeyReach
+from keymgmt.audit import AccessAudit, csv_lines
+from keymgmt.stats import get_stats
+from keymgmt import effective
+from keymgmt import grouprules
+from keymgmt.authkeys import authorized_keys_cache
+from keymgmt.coalesce import get_keys_flight
+from keymgmt.accesscache import access_cache
 from keymgmt.forms import SSHAccountForm
+from keymgmt.validators import sshkey_fingerprint
 
 from keymgmt.models import (
     Environment,
@@ -26,13 +39,33 @@ from keymgmt.models import (
     SSHAccount,
     DeleteNotAllowed,
     SSHAccountAvailable,
-    GroupRule
+    GroupRule,
+    AccessRevision
 )
 
 
-@csrf_exempt
-@require_POST
-def api_get_keys(request):
+def api_etag(request, revision):
+    """
+    ETag of an API response: the access revision together with all
+    request parameters except the access token.
+    """
+    params = sorted((key, value) for key, value in request.POST.items() if key != 'API_KEY')
+    content = str(revision) + json.dumps(params)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+    if if_none_match is None:
+        return False
+    etags = parse_etags(if_none_match)
+    return etag in etags or '*' in etags
+
+
+def api_access_denied(request):
+    """
+    returns an error response if the request has no valid API_KEY
+    """
     if hasattr(settings, 'API_KEYS') is False:
         return HttpResponse('API_KEYS in settings not found.', status=401)
     access_token = request.POST.get('API_KEY',  None)
@@ -40,6 +73,77 @@ def api_get_keys(request):
         return HttpResponse('Please send your access token as parameter API_KEY!', status=401)
     if access_token not in settings.API_KEYS:
         return HttpResponse('API access token not found in configuration', status=401)
+    return None
+
+
+@csrf_exempt
+@require_POST
+def api_get_keys(request):
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    filter_type = request.POST.get('filter_type', None)
+    filter_value = request.POST.get('filter_value', None)
+
+    if filter_type is not None:
+        if filter_value is None:
+            return HttpResponse('add filter_value.', status=404)
+
+    limit = request.POST.get('limit', None)
+    after = request.POST.get('after', None)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit <= 0:
+            return HttpResponse('limit has to be a positive number.', status=400)
+
+    revision = AccessRevision.current()
+    etag = api_etag(request, revision)
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = quote_etag(etag)
+        response['X-SKM-Revision'] = str(revision)
+        return response
+
+    key_access = KeyAccess(filter_type=filter_type, filter_value=filter_value)
+    if limit is not None:
+        def page():
+            hosts, next_after = key_access.page(limit, after)
+            return json.dumps({'hosts': hosts, 'next': next_after}, sort_keys=True, indent=4).encode('utf-8')
+        response = HttpResponse(get_keys_flight.do(etag, page))
+    elif getattr(settings, 'API_STREAMING', False):
+        response = StreamingHttpResponse(json_stream(key_access.iter_export()))
+    else:
+        content = get_keys_flight.do(
+            etag,
+            lambda: json.dumps(key_access.export(), sort_keys=True, indent=4).encode('utf-8')
+        )
+        response = HttpResponse(content)
+    response['ETag'] = quote_etag(etag)
+    response['X-SKM-Revision'] = str(revision)
+    return response
+
+
+@csrf_exempt
+@require_POST
+def api_changes(request):
+    """
+    hosts changed after the revision since. Returns the hosts in the
+    format of api_get_keys together with the removed hosts and the
+    current revision, or 410 if since is too old for a delta.
+    With a filter, changed hosts that do not match it are removed hosts.
+    """
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    try:
+        since = int(request.POST.get('since', ''))
+    except ValueError:
+        return HttpResponse('add since as revision number.', status=400)
 
     filter_type = request.POST.get('filter_type', None)
     filter_value = request.POST.get('filter_value', None)
@@ -48,46 +152,177 @@ def api_get_keys(request):
         if filter_value is None:
             return HttpResponse('add filter_value.', status=404)
 
+    revision, changed, removed = effective.changes_since(since)
+    if revision is None:
+        return HttpResponse('revision ' + str(since) + ' is too old, fetch all hosts.', status=410)
+
     key_access = KeyAccess(filter_type=filter_type, filter_value=filter_value)
     hosts = {}
-    for host in key_access.all():
-        accounts = {}
-        for name, keys in host.get_account_merged().items():
-            account_keys = []
-            for key in keys:
-                account_keys.append(key.ssh_key_entry())
-            accounts[name] = account_keys
-        hosts[host.name] = {
-                'ip': host.ipaddress,
-                'environment': host.environment.name,
-                'accounts': accounts
-            }
-
-    return HttpResponse(json.dumps(hosts, sort_keys=True, indent=4))
+    for names in effective.chunks(changed):
+        hosts.update(key_access.export(key_access.all().filter(name__in=names)))
+
+    if filter_type is not None:
+        # changed hosts outside of the filter may have left it, deleted hosts
+        # are reported unless the filter names another host
+        removed = sorted(set(removed).union(name for name in changed if name not in hosts))
+        if filter_type == 'host':
+            removed = [name for name in removed if name == filter_value]
+
+    result = {
+        'revision': revision,
+        'hosts': hosts,
+        'removed': removed
+    }
+    return HttpResponse(json.dumps(result, sort_keys=True, indent=4))
+
+
+@csrf_exempt
+@require_POST
+def api_authorized_keys(request, host, account):
+    """
+    authorized_keys content of one account on one host as plain text,
+    for sshd AuthorizedKeysCommand. Answers 404 if the account is not
+    deployed to the host.
+    """
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    entries = authorized_keys_cache.get(host, account)
+    if entries is None:
+        return HttpResponse('', status=404, content_type='text/plain')
+    return HttpResponse(''.join(entry + "\n" for entry in entries), content_type='text/plain')
+
+
+@csrf_exempt
+@require_POST
+def api_sshkey(request):
+    """
+    the SSH key with the given fingerprint, or the fingerprint of the
+    given public key, as JSON. Answers 404 if no key has this material.
+    """
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    fingerprint = api_fingerprint(request)
+    if fingerprint is None:
+        return HttpResponse('add fingerprint or sshkey.', status=400)
+
+    keys = list(SSHKey.objects.filter(fingerprint=fingerprint).values('name', 'fingerprint', 'sshkey'))
+    if len(keys) == 0:
+        return HttpResponse('no SSH key with fingerprint ' + fingerprint, status=404)
+    return HttpResponse(json.dumps(keys[0], sort_keys=True, indent=4))
+
+
+def api_fingerprint(request):
+    """
+    the fingerprint parameter, or the fingerprint of the sshkey parameter.
+    None if neither is given.
+    """
+    fingerprint = request.POST.get('fingerprint', None)
+    if fingerprint is None:
+        try:
+            fingerprint = sshkey_fingerprint(request.POST.get('sshkey', ''))
+        except ValueError:
+            return None
+    return fingerprint
+
+
+@csrf_exempt
+@require_POST
+def api_sshkey_reach(request):
+    """
+    all hosts and accounts the SSH key with the given fingerprint, or
+    of the given public key, is deployed to, with the environments,
+    groups, hosts and keyrings granting it
+    """
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    fingerprint = api_fingerprint(request)
+    if fingerprint is None:
+        return HttpResponse('add fingerprint or sshkey.', status=400)
+
+    keys = list(SSHKey.objects.filter(fingerprint=fingerprint))
+    if len(keys) == 0:
+        return HttpResponse('no SSH key with fingerprint ' + fingerprint, status=404)
+
+    access = []
+    for host, account, sources in KeyReach(keys).reach(keys[0]):
+        access.append({
+            'host': host,
+            'account': account,
+            'sources': [{'type': obj_name, 'name': name, 'keyring': keyring} for obj_name, name, keyring in sources]
+        })
+    result = {
+        'name': keys[0].name,
+        'fingerprint': keys[0].fingerprint,
+        'access': access
+    }
+    return HttpResponse(json.dumps(result, sort_keys=True, indent=4))
+
+
+@csrf_exempt
+@require_POST
+def api_stats(request):
+    """
+    counters of the API caches of this process
+    """
+    denied = api_access_denied(request)
+    if denied is not None:
+        return denied
+
+    result = {
+        'getkeys': get_keys_flight.stats(),
+        'access_cache': access_cache.stats(),
+        'authorized_keys': authorized_keys_cache.stats()
+    }
+    return HttpResponse(json.dumps(result, sort_keys=True, indent=4))
+
+
+def audit_filters(request):
+    return dict((name, request.GET.get(name, '').strip()) for name in AccessAudit.FILTERS)
 
 
 class AuditKey2Access(TemplateView):
     template_name = 'AuditKey2Access.html'
 
     def get_context_data(self, **kwargs):
-        keys = KeyAccess()
+        filters = audit_filters(self.request)
+        try:
+            per_page = min(max(int(self.request.GET.get('per_page', 100)), 1), 1000)
+        except ValueError:
+            per_page = 100
+        try:
+            page = AccessAudit(**filters).page(self.request.GET.get('page', 1), per_page)
+        except InvalidPage:
+            raise Http404('page not found')
+        query = urlencode(sorted((name, value) for name, value in filters.items() if value))
         return {
-                'hosts': keys.all()
+                'filters': filters,
+                'page': page,
+                'per_page': per_page,
+                'query': query
         }
 
 
+def audit_key2access_csv(request):
+    """
+    the audit report with the filters of AuditKey2Access as streamed CSV
+    """
+    audit = AccessAudit(**audit_filters(request))
+    response = StreamingHttpResponse(csv_lines(audit.iter_rows()), content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="key2access.csv"'
+    return response
+
+
 class HomeView(TemplateView):
     template_name = 'home.html'
 
     def get_context_data(self, **kwargs):
-        return {
-                'account_count': SSHAccount.objects.all().count(),
-                'environment_count': Environment.objects.all().count(),
-                'host_count': Host.objects.all().count(),
-                'group_count': Group.objects.all().count(),
-                'sshkey_count': SSHKey.objects.all().count(),
-                'sshkeyring_count': SSHKeyring.objects.all().count()
-        }
+        return get_stats()
 
 
 class SSHAccountAvailableList(ListView):
@@ -152,6 +387,11 @@ class EnvironmentDetail(DetailView):
     template_name = 'EnvironmentDetail.html'
     model = Environment
 
+    def get_context_data(self, **kwargs):
+        context = super(EnvironmentDetail, self).get_context_data(**kwargs)
+        context['accounts'] = SSHAccount.with_objects(self.object.get_accounts().prefetch_related('keys', 'keyrings'))
+        return context
+
 
 class SSHKeyList(ListView):
     template_name = 'SSHKeyList.html'
@@ -192,12 +432,27 @@ class SSHKeyDetail(DetailView):
     template_name = 'SSHKeyDetail.html'
     model = SSHKey
 
+    def get_context_data(self, **kwargs):
+        context = super(SSHKeyDetail, self).get_context_data(**kwargs)
+        context['reach'] = KeyReach([self.object]).reach(self.object)
+        return context
+
+
+def apply_group_rules(request, group_ids):
+    """
+    update the members of the groups after one of their rules changed
+    """
+    added, removed = grouprules.reconcile(group_ids)
+    if added > 0 or removed > 0:
+        messages.add_message(request, messages.INFO,
+                             '%d hosts were added to and %d hosts removed from the group.' % (added, removed))
+
 
 class GroupRuleUpdate(SuccessMessageMixin, UpdateView):
     template_name = 'GroupRuleUpdate.html'
     model = GroupRule
     success_message = "rule %(rule)s was updated successfully"
-    fields = ['rule', 'group']
+    fields = ['rule_type', 'rule', 'group']
 
     def get_context_data(self, **kwargs):
         context = super(GroupRuleUpdate, self).get_context_data(**kwargs)
@@ -207,12 +462,18 @@ class GroupRuleUpdate(SuccessMessageMixin, UpdateView):
     def get_success_url(self):
         return reverse_lazy('group_detail', kwargs={'pk': self.kwargs['group_pk']})
 
+    def form_valid(self, form):
+        groups = list(GroupRule.objects.filter(pk=self.object.pk).values_list('group_id', flat=True))
+        response = super(GroupRuleUpdate, self).form_valid(form)
+        apply_group_rules(self.request, set(groups + [self.object.group_id]))
+        return response
+
 
 class GroupRuleCreate(SuccessMessageMixin, CreateView):
     template_name = 'GroupRuleCreate.html'
     model = GroupRule
     success_message = "rule %(rule)s was created successfully"
-    fields = ['rule', 'group']
+    fields = ['rule_type', 'rule', 'group']
 
     def get_success_url(self):
         return reverse_lazy('group_detail', kwargs={'pk': self.kwargs['pk']})
@@ -228,6 +489,11 @@ class GroupRuleCreate(SuccessMessageMixin, CreateView):
         context['group'] = Group.objects.get(pk=self.kwargs['pk'])
         return context
 
+    def form_valid(self, form):
+        response = super(GroupRuleCreate, self).form_valid(form)
+        apply_group_rules(self.request, [self.object.group_id])
+        return response
+
 
 class GroupRuleDelete(DeleteView):
     template_name = 'GroupRuleDelete.html'
@@ -240,6 +506,7 @@ class GroupRuleDelete(DeleteView):
         self.object = self.get_object()
         self.object.delete()
         messages.add_message(request, messages.INFO, self.object.rule + ' was deleted successfully.')
+        apply_group_rules(request, [self.object.group_id])
         return HttpResponseRedirect(self.get_success_url())
 
 
@@ -255,7 +522,17 @@ class GroupCreate(SuccessMessageMixin, CreateView):
     success_url = reverse_lazy('group_list')
     success_message = "%(name)s was created successfully"
     model = Group
-    fields = ['name']
+    fields = ['name', 'parent']
+
+
+class GroupUpdate(SuccessMessageMixin, UpdateView):
+    template_name = 'GroupUpdate.html'
+    success_message = "%(name)s was updated successfully"
+    model = Group
+    fields = ['name', 'parent']
+
+    def get_success_url(self):
+        return reverse_lazy('group_detail', kwargs={'pk': self.kwargs['pk']})
 
 
 class GroupDelete(DeleteView):
@@ -274,12 +551,21 @@ class GroupDetail(DetailView):
     template_name = 'GroupDetail.html'
     model = Group
 
+    def get_context_data(self, **kwargs):
+        context = super(GroupDetail, self).get_context_data(**kwargs)
+        context['accounts'] = SSHAccount.with_objects(self.object.get_accounts().prefetch_related('keys', 'keyrings'))
+        return context
+
 
 class HostList(ListView):
     template_name = 'HostList.html'
 
     def get_queryset(self):
-        return Host.objects.all()
+        hosts = list(Host.objects.all())
+        counts = dict(SSHAccount.host_objects.values_list('obj_id').annotate(Count('id')).order_by())
+        for host in hosts:
+            host.account_count = counts.get(host.id, 0)
+        return hosts
 
 
 class HostCreate(SuccessMessageMixin, CreateView):
@@ -294,6 +580,13 @@ class HostDetail(DetailView):
     template_name = 'HostDetail.html'
     model = Host
 
+    def get_context_data(self, **kwargs):
+        context = super(HostDetail, self).get_context_data(**kwargs)
+        resolver = AccountResolver(Host.objects.filter(pk=self.object.pk))
+        context['accounts_merged'] = resolver.get_account_merged(self.object)
+        context['accounts'] = SSHAccount.with_objects(self.object.get_accounts().prefetch_related('keys', 'keyrings'))
+        return context
+
 
 class HostUpdate(SuccessMessageMixin, UpdateView):
     template_name = 'HostUpdate.html'
@@ -310,6 +603,11 @@ class HostDelete(DeleteView):
     model = Host
     success_url = reverse_lazy('host_list')
 
+    def get_context_data(self, **kwargs):
+        context = super(HostDelete, self).get_context_data(**kwargs)
+        context['accounts'] = SSHAccount.with_objects(self.object.get_accounts().prefetch_related('keys', 'keyrings'))
+        return context
+
     def delete(self, request, *args, **kwargs):
         self.object = self.get_object()
         self.object.delete()
@@ -317,6 +615,12 @@ class HostDelete(DeleteView):
         return HttpResponseRedirect(self.get_success_url())
 
 
+def warn_unknown(request, kind, names):
+    """ message about names that were not found and therefore not added """
+    if names:
+        messages.add_message(request, messages.WARNING, kind + ' not found: ' + ', '.join(names))
+
+
 class SSHKeyringList(ListView):
     template_name = 'SSHKeyringList.html'
 
@@ -340,7 +644,7 @@ class SSHKeyringCreate(SuccessMessageMixin, CreateView):
         post = super(SSHKeyringCreate, self).post(self, request, *args, **kwargs)
         sshkeys = request.POST.get('keys', '')
         if self.object:
-            self.object.add_keys(sshkeys)
+            warn_unknown(request, 'SSH Keys', self.object.add_keys(sshkeys))
         return post
 
 
@@ -360,7 +664,7 @@ class SSHKeyringUpdate(SuccessMessageMixin, UpdateView):
         post = super(SSHKeyringUpdate, self).post(self, request, *args, **kwargs)
         self.object = self.get_object()
         sshkeys = request.POST.get('keys', '')
-        self.object.add_keys(sshkeys)
+        warn_unknown(request, 'SSH Keys', self.object.add_keys(sshkeys))
         return post
 
 
@@ -385,10 +689,11 @@ class SSHAccountList(TemplateView):
     template_name = 'SSHAccountList.html'
 
     def get_context_data(self, **kwargs):
+        accounts = SSHAccount.with_objects(SSHAccount.objects.prefetch_related('keys', 'keyrings'))
         return {
-                'object_list_group': SSHAccount.group_objects.all(),
-                'object_list_host': SSHAccount.host_objects.all(),
-                'object_list_environment': SSHAccount.environment_objects.all()
+                'object_list_group': [account for account in accounts if account.obj_name == 'group'],
+                'object_list_host': [account for account in accounts if account.obj_name == 'host'],
+                'object_list_environment': [account for account in accounts if account.obj_name == 'environment']
         }
 
 
@@ -407,9 +712,9 @@ class SSHAccountKeyUpdate(SuccessMessageMixin, UpdateView):
         post = super(SSHAccountKeyUpdate, self).post(self, request, *args, **kwargs)
         self.object = self.get_object()
         keyrings = request.POST.get('keyrings', '')
-        self.object.update_keyrings(keyrings)
+        warn_unknown(request, 'SSH Keyrings', self.object.update_keyrings(keyrings))
         keys = request.POST.get('keys', '')
-        self.object.update_keys(keys)
+        warn_unknown(request, 'SSH Keys', self.object.update_keys(keys))
 
         return post
 